@@ -1,62 +1,224 @@
 # Adapted from: https://github.com/tinygrad/tinygrad/blob/9561803cb0370461bc991b3af7c4e9867cd8f0eb/examples/coder.py#L22
 import re
 import os
-from openai import OpenAI
+import sys
+import signal
+import asyncio
+from openai import AsyncOpenAI
 from rich.console import Console
 from rich.live import Live
 from rich.markdown import Markdown
 from rich.text import Text
-from io import StringIO
-from contextlib import redirect_stdout
-import traceback
+from pathlib import Path
+
+sys.path.insert(0, Path(__file__).resolve().parent.parent.as_posix())
+from common.completion_cache import cached_client
+from common.exec_pool import ExecPool
+from common.history import ChatHistory
+from common.metrics import METRICS_SUMMARY, LatencyMetrics
+from common.trajectory import TrajectoryRecorder
 
 openai_api_key = os.getenv(
     "OPENAI_API_KEY",
     "xai-sk-XXXXXXXXXXXXXXXXXXXXXXXXXXXXXX",
 )
 openai_api_base = "https://api.x.ai/v1"  # "http://127.0.0.1:30000/v1"
-client = OpenAI(api_key=openai_api_key, base_url=openai_api_base)
+# COMPLETION_CACHE=on|record|replay serves repeated requests from a local cache
+client = cached_client(AsyncOpenAI(api_key=openai_api_key, base_url=openai_api_base))
+
+# Frames per second while a response streams in; network reads never wait on rendering
+RENDER_FPS = float(os.getenv("RENDER_FPS", 10))
 
 console = Console()
 
-messages = [
-    {
-        "role": "system",
-        "content": "You are Quentin, a helpful assistant who writes concise Python code to answer questions.",
-    }
-]
-
-while True:
-    user_input = console.input("[bold blue]You:[/bold blue] ")
-    if user_input.lower() == "exit":
-        console.print("[yellow]Goodbye![/yellow]")
-        break
-    # chat memory
-    messages.append({"role": "user", "content": user_input})
+# Generated code runs in warm worker interpreters, with time and memory limits
+exec_pool = ExecPool()
+# Requests, chunk timings and code runs are logged to TRAJECTORY_DIR ('off' to disable)
+recorder = TrajectoryRecorder("chat_terminal")
+# TTFT, inter-chunk latency, tokens/s and time spent rendering and running code, per turn
+metrics = LatencyMetrics("chat_terminal")
 
-    stream = client.chat.completions.create(
+# Token-budgeted chat memory; the system prompt stays fixed so prefix caching keeps hitting
+history = ChatHistory(
+    [
+        {
+            "role": "system",
+            "content": "You are Quentin, a helpful assistant who writes concise Python code to answer questions.",
+        }
+    ]
+)
+
+
+async def read_stream(messages, received, turn):
+    """
+    Request a completion and append its text chunks to received as they arrive.
+    """
+    request = dict(
         model="grok-4-latest",
         messages=messages,
         stream=True,
         temperature=0.7,
         max_tokens=32768,
     )
-
-    # Stream and render assistant response with styles
-    assistant_response = Text()
-    current_type = None
-    with Live(assistant_response, refresh_per_second=4, console=console) as live:
-        for chunk in stream:
-            delta = chunk.choices[0].delta
-            if delta.content is not None:
+    record = recorder.response(recorder.request(request))
+    cancelled, error = False, None
+    turn.request()
+    try:
+        stream = await client.chat.completions.create(**request)
+        try:
+            async for chunk in stream:
+                if not chunk.choices:
+                    continue
                 content = chunk.choices[0].delta.content
-                assistant_response.append(content)
-                live.update(assistant_response)
-    # Add assistant response to history (plain text)
-    messages.append({"role": "assistant", "content": assistant_response.plain})
+                if content is not None:
+                    received.append(content)
+                    record.chunk(content)
+                    turn.chunk()
+        finally:
+            # Drops the connection when cancelled instead of draining the response
+            await stream.close()
+    except asyncio.CancelledError:
+        cancelled = True
+        raise
+    except Exception as e:
+        error = repr(e)
+        raise
+    finally:
+        record.finish(cancelled=cancelled, error=error)
+
+
+async def render_loop(live, received, done, turn):
+    """
+    Render the chunks received since the last frame, once per 1 / RENDER_FPS seconds.
+    Completed lines are printed above the live region, so a frame only re-renders
+    the unfinished last line instead of the whole response.
+    """
+    rendered = 0
+    tail = ""
+    while True:
+        finished = done.is_set()
+        if rendered < len(received):
+            with turn.timed("render"):
+                tail += "".join(received[rendered:])
+                rendered = len(received)
+                lines, newline, tail = tail.rpartition("\n")
+                if newline:
+                    live.console.print(Text(lines + newline), end="")
+                live.update(Text(tail), refresh=True)
+        if finished:
+            return
+        try:
+            await asyncio.wait_for(done.wait(), 1 / RENDER_FPS)
+        except asyncio.TimeoutError:
+            pass
+
+
+async def stream_response(messages, turn):
+    """
+    Stream one assistant response to the terminal. Ctrl-C cancels it mid-stream.
+    Returns (response text received so far, True if the response completed).
+    """
+    received = []
+    done = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    with Live(Text(), console=console, auto_refresh=False) as live:
+        renderer = asyncio.create_task(render_loop(live, received, done, turn))
+        reader = asyncio.create_task(read_stream(messages, received, turn))
+        try:
+            loop.add_signal_handler(signal.SIGINT, reader.cancel)
+        except NotImplementedError:
+            # No loop signal handlers on Windows; Ctrl-C there ends the session
+            pass
+        try:
+            await asyncio.wait([reader])
+        finally:
+            try:
+                loop.remove_signal_handler(signal.SIGINT)
+            except NotImplementedError:
+                pass
+            done.set()
+            await renderer
+    if not reader.cancelled():
+        # Re-raise network and API errors
+        reader.result()
+    return "".join(received), not reader.cancelled()
+
+
+async def run_code(code, turn):
+    """
+    Run code on the worker pool, streaming its output. Ctrl-C stops the run.
+    """
+    loop = asyncio.get_running_loop()
+    console.print("[yellow]Code output:[/yellow]")
+    task = asyncio.create_task(
+        exec_pool.run(
+            code,
+            on_output=lambda stream, text: console.print(
+                Text(text, style="red" if stream == "stderr" else ""), end=""
+            ),
+        )
+    )
+    try:
+        loop.add_signal_handler(signal.SIGINT, task.cancel)
+    except NotImplementedError:
+        pass
+    try:
+        result = await task
+    finally:
+        try:
+            loop.remove_signal_handler(signal.SIGINT)
+        except NotImplementedError:
+            pass
+    turn.add("exec", result.duration)
+    recorder.record(
+        "exec",
+        code=code,
+        output=result.output,
+        error=result.error,
+        returncode=result.returncode,
+        duration=result.duration,
+        timed_out=result.timed_out,
+        cancelled=result.cancelled,
+    )
+    return result
+
+
+async def main():
+    await exec_pool.start()
+    try:
+        await chat()
+    finally:
+        await exec_pool.close()
+
+
+async def chat():
+    while True:
+        user_input = console.input("[bold blue]You:[/bold blue] ")
+        if user_input.lower() == "exit":
+            console.print("[yellow]Goodbye![/yellow]")
+            break
+        turn = metrics.start_turn()
+        await respond(user_input, turn)
+        summary = metrics.finish(turn)
+        if METRICS_SUMMARY:
+            console.print(summary, style="dim")
+
+
+async def respond(user_input, turn):
+    # chat memory
+    history.add("user", user_input)
+
+    # Stream and render assistant response
+    plain_response, completed = await stream_response(history.messages, turn)
+    turn.tokens = history.count_tokens(plain_response)
+    # Add assistant response to history (plain text), including a cancelled partial one
+    if plain_response:
+        history.add("assistant", plain_response)
+    if not completed:
+        console.print("[yellow]Response cancelled.[/yellow]")
+        return
 
     # Extract Python code block from plain text
-    plain_response = assistant_response.plain
     code_block_pattern = r"```python(.*?)```"
     match = re.search(code_block_pattern, plain_response, re.DOTALL)
 
@@ -64,18 +226,17 @@ while True:
         code = match.group(1).strip()
         run = console.input("[bold red]Run the code? (y/n): [/bold red]").lower() == "y"
         if run:
-            my_stdout = StringIO()
-            try:
-                with redirect_stdout(my_stdout):
-                    exec(code)
-                output = my_stdout.getvalue()
-                console.print(f"[yellow]Code output:[/yellow]\n{output}")
-                messages.append({"role": "user", "content": f"Code output:\n{output}"})
-            except Exception as e:
-                error_msg = "".join(traceback.format_exception_only(e))
-                console.print(f"[red]Code error:[/red]\n{error_msg}")
-                messages.append(
-                    {"role": "user", "content": f"Code error:\n{error_msg}"}
-                )
+            result = await run_code(code, turn)
+            if result.cancelled:
+                console.print("[yellow]Run cancelled.[/yellow]")
+                return
+            content = f"Code output:\n{result.output}"
+            if result.error:
+                content += f"\nCode error:\n{result.error}"
+            history.add("user", content, tool=True)
     else:
-        console.print("<system>No Python code block found in the response.</system>")
\ No newline at end of file
+        console.print("<system>No Python code block found in the response.</system>")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
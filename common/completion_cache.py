@@ -0,0 +1,304 @@
+import os
+import json
+import time
+import asyncio
+import hashlib
+import inspect
+from pathlib import Path
+
+# 'off' calls the API directly; 'on' serves cached completions and stores misses;
+# 'record' always calls the API and overwrites the entry; 'replay' only serves
+# cached completions and fails on a miss, so a run never reaches the network
+COMPLETION_CACHE = os.getenv("COMPLETION_CACHE", "off")
+COMPLETION_CACHE_DIR = os.getenv(
+    "COMPLETION_CACHE_DIR", os.path.join(os.path.expanduser("~"), ".cache", "completion_cache")
+)
+# Least recently used entries are evicted once the cache holds more than this many bytes
+COMPLETION_CACHE_MAX_BYTES = int(os.getenv("COMPLETION_CACHE_MAX_BYTES", 512 * 1024 * 1024))
+# Replayed streams keep their recorded chunk timing scaled by this factor (0 = no delays)
+COMPLETION_REPLAY_SPEED = float(os.getenv("COMPLETION_REPLAY_SPEED", 0))
+# Request arguments that do not change the completion, left out of the key
+TRANSPORT_ARGS = {"timeout", "extra_headers", "extra_query"}
+CACHE_VERSION = 1
+
+
+class CacheMiss(LookupError):
+    pass
+
+
+def cache_key(kwargs):
+    """
+    Hash of the model, messages, sampling parameters and stream flag of a request.
+    """
+    request = {name: value for name, value in kwargs.items() if name not in TRANSPORT_ARGS}
+    encoded = json.dumps([CACHE_VERSION, request], sort_keys=True, separators=(",", ":"), default=str)
+    return hashlib.blake2b(encoded.encode("utf-8"), digest_size=16).hexdigest()
+
+
+class CompletionStore:
+    """
+    One JSON file per cached completion in a directory, evicted least recently
+    used first (by file mtime, which a hit refreshes) when over max_bytes.
+    """
+
+    def __init__(self, directory=COMPLETION_CACHE_DIR, max_bytes=COMPLETION_CACHE_MAX_BYTES):
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max_bytes
+        # key -> (size, last use); kept in memory so eviction does not rescan the directory
+        self.entries = {}
+        for path in self.directory.glob("*.json"):
+            try:
+                st = path.stat()
+            except OSError:
+                continue
+            self.entries[path.stem] = (st.st_size, st.st_mtime)
+        self.total_bytes = sum(size for size, _ in self.entries.values())
+
+    def get(self, key):
+        path = self.directory / f"{key}.json"
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                entry = json.load(f)
+            os.utime(path)
+        except (OSError, ValueError):
+            return None
+        if key in self.entries:
+            self.entries[key] = (self.entries[key][0], time.time())
+        return entry
+
+    def put(self, key, entry):
+        path = self.directory / f"{key}.json"
+        tmp_path = path.with_suffix(".tmp")
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(entry, f, separators=(",", ":"))
+        os.replace(tmp_path, path)
+        size = path.stat().st_size
+        previous = self.entries.get(key)
+        self.total_bytes += size - (previous[0] if previous else 0)
+        self.entries[key] = (size, time.time())
+        if self.total_bytes > self.max_bytes:
+            self.evict(keep=key)
+
+    def evict(self, keep=None):
+        for key, (size, _) in sorted(self.entries.items(), key=lambda item: item[1][1]):
+            if self.total_bytes <= self.max_bytes:
+                break
+            if key == keep:
+                continue
+            try:
+                (self.directory / f"{key}.json").unlink()
+            except FileNotFoundError:
+                pass
+            del self.entries[key]
+            self.total_bytes -= size
+
+
+def _chunk_types():
+    from openai.types.chat import ChatCompletion, ChatCompletionChunk
+
+    return ChatCompletion, ChatCompletionChunk
+
+
+class _Recorder:
+    """
+    Collects the chunks of a live stream with their arrival offsets.
+    """
+
+    def __init__(self, store, key):
+        self.store = store
+        self.key = key
+        self.started = time.monotonic()
+        self.chunks = []
+
+    def add(self, chunk):
+        self.chunks.append([time.monotonic() - self.started, chunk.model_dump(mode="json")])
+
+    def finish(self):
+        self.store.put(self.key, {"kind": "stream", "chunks": self.chunks})
+
+
+class RecordingStream:
+    """
+    Passes a live stream through and caches it once it has been read to the end;
+    a stream closed early is not cached.
+    """
+
+    def __init__(self, stream, recorder):
+        self.stream = stream
+        self.recorder = recorder
+
+    def __iter__(self):
+        for chunk in self.stream:
+            self.recorder.add(chunk)
+            yield chunk
+        self.recorder.finish()
+
+    def close(self):
+        self.stream.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class AsyncRecordingStream(RecordingStream):
+    async def __aiter__(self):
+        async for chunk in self.stream:
+            self.recorder.add(chunk)
+            yield chunk
+        self.recorder.finish()
+
+    async def close(self):
+        await self.stream.close()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.close()
+
+
+class ReplayStream:
+    """
+    Reproduces a recorded chunk stream, optionally with its original timing.
+    """
+
+    def __init__(self, chunks, speed=COMPLETION_REPLAY_SPEED):
+        self.chunks = chunks
+        self.speed = speed
+
+    def _delays(self):
+        previous = 0.0
+        _, chunk_type = _chunk_types()
+        for offset, data in self.chunks:
+            yield (offset - previous) * self.speed, chunk_type.model_validate(data)
+            previous = offset
+
+    def __iter__(self):
+        for delay, chunk in self._delays():
+            if delay > 0:
+                time.sleep(delay)
+            yield chunk
+
+    def close(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        pass
+
+
+class AsyncReplayStream(ReplayStream):
+    async def __aiter__(self):
+        for delay, chunk in self._delays():
+            if delay > 0:
+                await asyncio.sleep(delay)
+            yield chunk
+
+    async def close(self):
+        pass
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        pass
+
+
+def is_async_completions(completions):
+    """
+    True for AsyncOpenAI's completions. The SDK wraps create() in a synchronous
+    argument-checking decorator, so the coroutine function is looked up through it.
+    """
+    return inspect.iscoroutinefunction(inspect.unwrap(completions.create))
+
+
+class CachedCompletions:
+    """
+    Drop-in for client.chat.completions with a read-through disk cache.
+    Works with both OpenAI and AsyncOpenAI; create() keeps the client's calling style.
+    """
+
+    def __init__(self, completions, mode=COMPLETION_CACHE, store=None):
+        self.completions = completions
+        self.mode = mode
+        self.store = store or CompletionStore()
+        self.is_async = is_async_completions(completions)
+        self.hits = 0
+        self.misses = 0
+
+    def _cached(self, key):
+        if self.mode == "record":
+            return None
+        entry = self.store.get(key)
+        if entry is None:
+            if self.mode == "replay":
+                raise CacheMiss(f"No cached completion for request {key} (COMPLETION_CACHE=replay)")
+            return None
+        self.hits += 1
+        if entry["kind"] == "stream":
+            return (AsyncReplayStream if self.is_async else ReplayStream)(entry["chunks"])
+        completion_type, _ = _chunk_types()
+        return completion_type.model_validate(entry["response"])
+
+    def _store(self, key, stream, response):
+        self.misses += 1
+        if stream:
+            recorder = _Recorder(self.store, key)
+            return (AsyncRecordingStream if self.is_async else RecordingStream)(response, recorder)
+        self.store.put(key, {"kind": "response", "response": response.model_dump(mode="json")})
+        return response
+
+    def create(self, **kwargs):
+        if self.mode == "off":
+            return self.completions.create(**kwargs)
+        key = cache_key(kwargs)
+        stream = bool(kwargs.get("stream"))
+        if self.is_async:
+            return self._create_async(key, stream, kwargs)
+        cached = self._cached(key)
+        if cached is not None:
+            return cached
+        return self._store(key, stream, self.completions.create(**kwargs))
+
+    async def _create_async(self, key, stream, kwargs):
+        cached = self._cached(key)
+        if cached is not None:
+            return cached
+        return self._store(key, stream, await self.completions.create(**kwargs))
+
+
+class _Chat:
+    def __init__(self, completions):
+        self.completions = completions
+
+
+class CachedClient:
+    """
+    Wraps an OpenAI or AsyncOpenAI client so that client.chat.completions.create
+    goes through the completion cache; every other attribute is the client's own.
+    """
+
+    def __init__(self, client, mode=COMPLETION_CACHE, store=None):
+        self.client = client
+        self.chat = _Chat(CachedCompletions(client.chat.completions, mode, store))
+
+    def __getattr__(self, name):
+        return getattr(self.client, name)
+
+
+def cached_client(client, mode=COMPLETION_CACHE, store=None):
+    """
+    Return client unchanged when caching is off, otherwise a CachedClient
+    (on store, or a CompletionStore in COMPLETION_CACHE_DIR).
+    """
+    if mode == "off":
+        return client
+    if mode not in ("on", "record", "replay"):
+        raise ValueError(f"Unknown COMPLETION_CACHE mode {mode!r}, expected off, on, record or replay")
+    return CachedClient(client, mode, store)
@@ -0,0 +1,182 @@
+import os
+import sys
+import time
+import codecs
+import signal
+import asyncio
+import importlib
+import traceback
+from dataclasses import dataclass
+
+# Idle interpreters kept ready; each runs one snippet and is replaced in the background
+EXEC_WORKERS = int(os.getenv("EXEC_WORKERS", 2))
+# Modules imported by every worker before it receives code (missing ones are skipped)
+PRELOAD_MODULES = os.getenv(
+    "EXEC_PRELOAD", "math,json,re,random,itertools,collections,functools,datetime,numpy,pandas"
+).split(",")
+# Per-run limits: wall-clock seconds and address space in MiB (0 = no limit). The memory
+# limit is what a snippet may add on top of the warm worker: address space the preloaded
+# modules already reserved (numpy/BLAS thread buffers and the like) does not count
+EXEC_TIMEOUT = float(os.getenv("EXEC_TIMEOUT", 60))
+EXEC_MEMORY_MB = int(os.getenv("EXEC_MEMORY_MB", 2048))
+# Output kept per stream for the result; anything beyond is still streamed but not stored
+MAX_OUTPUT_CHARS = 1024 * 1024
+
+
+@dataclass
+class ExecResult:
+    output: str
+    error: str
+    returncode: int
+    duration: float
+    timed_out: bool = False
+    cancelled: bool = False
+
+
+def address_space_bytes():
+    """
+    Current virtual memory size of this process, or 0 where /proc is not available.
+    """
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[0]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        return 0
+
+
+def worker_main(memory_mb):
+    """
+    Worker entry point: preload, wait for code on stdin, apply limits, run it once.
+    """
+    for name in PRELOAD_MODULES:
+        try:
+            importlib.import_module(name.strip())
+        except Exception:
+            pass
+    code = sys.stdin.read()
+    if memory_mb > 0:
+        try:
+            import resource
+
+            # Measured after preloading, so the limit is relative to the warm worker
+            limit = address_space_bytes() + memory_mb * 1024 * 1024
+            resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
+        except (ImportError, ValueError, OSError):
+            pass
+    try:
+        exec(compile(code, "<generated>", "exec"), {"__name__": "__main__"})
+    except Exception as e:
+        sys.stdout.flush()
+        sys.stderr.write("".join(traceback.format_exception_only(e)))
+        sys.exit(1)
+
+
+class ExecPool:
+    """
+    Runs generated code in separate, pre-started Python interpreters.
+
+    Each worker imports PRELOAD_MODULES ahead of time and then blocks reading its
+    stdin, so a run only pays for piping the code over. Workers are single-use:
+    every run gets a clean namespace and fresh limits, and a replacement starts
+    warming up right away. stdout/stderr are streamed back as they are produced,
+    and a run that exceeds its wall-clock limit is killed with its process group.
+    """
+
+    def __init__(self, size=EXEC_WORKERS, timeout=EXEC_TIMEOUT, memory_mb=EXEC_MEMORY_MB):
+        self.size = max(1, size)
+        self.timeout = timeout
+        self.memory_mb = memory_mb
+        self.idle = []
+
+    async def _spawn(self):
+        return await asyncio.create_subprocess_exec(
+            sys.executable, "-u", os.path.abspath(__file__), str(self.memory_mb),
+            stdin=asyncio.subprocess.PIPE,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE,
+            start_new_session=True,
+        )
+
+    async def start(self):
+        while len(self.idle) < self.size:
+            self.idle.append(await self._spawn())
+
+    async def _take(self):
+        while self.idle:
+            proc = self.idle.pop(0)
+            if proc.returncode is None:
+                return proc
+        return await self._spawn()
+
+    @staticmethod
+    def _kill(proc):
+        if proc.returncode is not None:
+            return
+        try:
+            os.killpg(proc.pid, signal.SIGKILL)
+        except (AttributeError, ProcessLookupError, PermissionError):
+            proc.kill()
+
+    @staticmethod
+    async def _pump(stream, name, kept, on_output):
+        size = 0
+        # Characters split across two reads are held back until their last byte arrives
+        decoder = codecs.getincrementaldecoder("utf-8")("replace")
+        while True:
+            data = await stream.read(64 * 1024)
+            text = decoder.decode(data, final=not data)
+            if not text:
+                if not data:
+                    return
+                continue
+            if on_output is not None:
+                on_output(name, text)
+            if size < MAX_OUTPUT_CHARS:
+                kept.append(text[: MAX_OUTPUT_CHARS - size])
+                size += len(kept[-1])
+
+    async def run(self, code, on_output=None):
+        """
+        Run code in a warm worker; on_output(stream name, text) receives output as it
+        arrives. Cancelling the task running this kills the worker, and the output
+        produced so far is still returned, marked as cancelled.
+        """
+        proc = await self._take()
+        await self.start()
+        started = time.monotonic()
+        proc.stdin.write(code.encode("utf-8"))
+        proc.stdin.close()
+        output, error = [], []
+        pumps = asyncio.gather(
+            self._pump(proc.stdout, "stdout", output, on_output),
+            self._pump(proc.stderr, "stderr", error, on_output),
+            proc.wait(),
+        )
+        timed_out = cancelled = False
+        try:
+            await asyncio.wait_for(asyncio.shield(pumps), self.timeout if self.timeout > 0 else None)
+        except asyncio.TimeoutError:
+            timed_out = True
+        except asyncio.CancelledError:
+            cancelled = True
+        finally:
+            self._kill(proc)
+            # Collect whatever was written before the kill
+            await pumps
+        if timed_out:
+            error.append(f"\n[Timed out after {self.timeout:g}s, worker killed]\n")
+        return ExecResult(
+            "".join(output), "".join(error), proc.returncode, time.monotonic() - started, timed_out, cancelled
+        )
+
+    async def close(self):
+        for proc in self.idle:
+            self._kill(proc)
+            await proc.wait()
+        self.idle.clear()
+
+
+if __name__ == "__main__":
+    # Run as a script, sys.path[0] is common/; generated code must not import its siblings
+    del sys.path[0]
+    worker_main(int(sys.argv[1]) if len(sys.argv) > 1 else 0)
@@ -0,0 +1,135 @@
+import os
+
+# Compact the history once it grows past this many tokens (0 = never compact)
+HISTORY_TOKEN_BUDGET = int(os.getenv("HISTORY_TOKEN_BUDGET", 64000))
+# Compaction goes down to this fraction of the budget, so it happens rarely and the
+# history is append-only (and prefix-cache friendly) between compactions
+COMPACT_TARGET = 0.75
+# The most recent messages are never compacted
+KEEP_RECENT_MESSAGES = int(os.getenv("HISTORY_KEEP_RECENT", 6))
+# Tool output (code output, debugger results) is cut to this many tokens when added,
+# and old tool output to OLD_TOOL_OUTPUT_TOKENS when the history is compacted
+MAX_TOOL_OUTPUT_TOKENS = int(os.getenv("MAX_TOOL_OUTPUT_TOKENS", 4000))
+OLD_TOOL_OUTPUT_TOKENS = 200
+
+
+def approx_tokens(text):
+    """
+    Rough token count (about 4 characters per token); used when tiktoken is not installed.
+    """
+    return len(text) // 4 + 1
+
+
+def load_token_counter():
+    try:
+        import tiktoken
+    except ImportError:
+        return approx_tokens
+    encoding = tiktoken.get_encoding("cl100k_base")
+    return lambda text: len(encoding.encode(text, disallowed_special=()))
+
+
+def elide(text, max_tokens, count_tokens):
+    """
+    Keep the head and tail of text within about max_tokens, noting what was cut.
+    """
+    total = count_tokens(text)
+    if total <= max_tokens:
+        return text
+    lines = text.splitlines(keepends=True)
+    half = max_tokens // 2
+    head, head_tokens = 0, 0
+    while head < len(lines) and head_tokens + count_tokens(lines[head]) <= half:
+        head_tokens += count_tokens(lines[head])
+        head += 1
+    tail, tail_tokens = len(lines), 0
+    while tail > head and tail_tokens + count_tokens(lines[tail - 1]) <= half:
+        tail -= 1
+        tail_tokens += count_tokens(lines[tail])
+    if head == 0 and tail == len(lines):
+        # One long line: cut by characters instead
+        keep = max(1, len(text) * half // total)
+        return f"{text[:keep]}\n[... about {total - 2 * half} tokens elided ...]\n{text[-keep:]}"
+    kept_head = "".join(lines[:head])
+    kept_tail = "".join(lines[tail:])
+    if kept_head and not kept_head.endswith("\n"):
+        kept_head += "\n"
+    return f"{kept_head}[... {tail - head} lines, about {total - head_tokens - tail_tokens} tokens elided ...]\n{kept_tail}"
+
+
+class ChatHistory:
+    """
+    Message list for a chat loop with per-message token counts and a budget.
+
+    The prefix messages (system prompt) are never modified. New tool output is
+    capped at MAX_TOOL_OUTPUT_TOKENS. Once the total passes the budget, old tool
+    output is elided and, if that is not enough, the oldest turns are replaced by
+    a single note, down to COMPACT_TARGET of the budget in one step. Between
+    compactions messages are only appended, so server-side prefix caching keeps
+    hitting everything but the newest turn.
+    """
+
+    def __init__(self, prefix, budget=HISTORY_TOKEN_BUDGET, keep_recent=KEEP_RECENT_MESSAGES, count_tokens=None):
+        self.count_tokens = count_tokens or load_token_counter()
+        self.budget = budget
+        self.keep_recent = keep_recent
+        self.prefix_length = len(prefix)
+        # Sent as is to the API; tokens and tool flags are kept alongside
+        self.messages = [dict(message) for message in prefix]
+        self.tokens = [self.count_tokens(message["content"]) for message in prefix]
+        self.tool = [False] * len(prefix)
+        self.omitted = 0
+        self.compactions = 0
+
+    @property
+    def total_tokens(self):
+        return sum(self.tokens)
+
+    def add(self, role, content, tool=False):
+        """
+        Append a message; tool=True marks output that may be elided later.
+        """
+        if tool:
+            content = elide(content, MAX_TOOL_OUTPUT_TOKENS, self.count_tokens)
+        self.messages.append({"role": role, "content": content})
+        self.tokens.append(self.count_tokens(content))
+        self.tool.append(tool)
+        if self.budget > 0 and self.total_tokens > self.budget:
+            self.compact()
+
+    def _replace(self, idx, content):
+        self.messages[idx] = {**self.messages[idx], "content": content}
+        self.tokens[idx] = self.count_tokens(content)
+
+    def compact(self):
+        target = int(self.budget * COMPACT_TARGET)
+        end = max(self.prefix_length, len(self.messages) - self.keep_recent)
+        total = self.total_tokens
+        # Oldest tool output first
+        for idx in range(self.prefix_length, end):
+            if total <= target:
+                break
+            if self.tool[idx] and self.tokens[idx] > OLD_TOOL_OUTPUT_TOKENS:
+                before = self.tokens[idx]
+                self._replace(idx, elide(self.messages[idx]["content"], OLD_TOOL_OUTPUT_TOKENS, self.count_tokens))
+                self.tool[idx] = False
+                total += self.tokens[idx] - before
+        # Then whole messages, oldest first, behind a note of how many were dropped
+        has_note = self.omitted > 0
+        first = self.prefix_length + has_note
+        drop = first
+        while drop < end and total > target:
+            total -= self.tokens[drop]
+            drop += 1
+        if drop > first:
+            self.omitted += drop - first
+            del self.messages[first:drop], self.tokens[first:drop], self.tool[first:drop]
+            note = {"role": "user", "content": f"[{self.omitted} earlier messages were omitted to save context]"}
+            if has_note:
+                self.messages[self.prefix_length] = note
+                self.tokens[self.prefix_length] = self.count_tokens(note["content"])
+            else:
+                self.messages.insert(self.prefix_length, note)
+                self.tokens.insert(self.prefix_length, self.count_tokens(note["content"]))
+                self.tool.insert(self.prefix_length, False)
+        self.compactions += 1
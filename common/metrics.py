@@ -0,0 +1,218 @@
+import os
+import json
+import time
+import bisect
+import threading
+from collections import defaultdict
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Print a one-line latency summary after every turn
+METRICS_SUMMARY = os.getenv("METRICS_SUMMARY", "1") != "0"
+# Append one JSON record per turn to this file ('' = off)
+METRICS_FILE = os.getenv("METRICS_FILE", "")
+# Serve Prometheus text format on 127.0.0.1:<port>/metrics (0 = off)
+METRICS_PORT = int(os.getenv("METRICS_PORT", 0))
+# Histogram bucket upper bounds, in seconds
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return None
+    return sorted_values[min(len(sorted_values) - 1, int(fraction * len(sorted_values)))]
+
+
+class Histogram:
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def exposition(self, name, labels):
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.buckets + ("+Inf",), self.counts):
+            cumulative += count
+            lines.append(f'{name}_bucket{{{labels}le="{bound}"}} {cumulative}')
+        lines.append(f"{name}_sum{{{labels.rstrip(',')}}} {self.sum}")
+        lines.append(f"{name}_count{{{labels.rstrip(',')}}} {self.count}")
+        return lines
+
+
+class Turn:
+    """
+    Timings of one agent turn. chunk() is called from the streaming loop and
+    only appends a timestamp; everything else is derived in summary().
+    """
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.request_started = None
+        self.chunk_times = []
+        self.tokens = 0
+        self.phases = defaultdict(float)  # phase -> seconds: render, exec, debug
+        self.calls = []  # (endpoint, seconds) middleware round trips
+
+    def request(self):
+        self.request_started = time.perf_counter()
+
+    def chunk(self):
+        self.chunk_times.append(time.perf_counter())
+
+    def add(self, phase, seconds):
+        self.phases[phase] += seconds
+
+    @contextmanager
+    def timed(self, phase, endpoint=None):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - started
+            self.phases[phase] += elapsed
+            if endpoint is not None:
+                self.calls.append((endpoint, elapsed))
+
+    def summary(self):
+        times = self.chunk_times
+        gaps = sorted(b - a for a, b in zip(times, times[1:]))
+        if len(times) > 1:
+            decode = times[-1] - times[0]
+        else:
+            # Non-streamed: the whole response arrives at once
+            decode = times[-1] - self.request_started if times and self.request_started else 0.0
+        return {
+            "ttft": times[0] - self.request_started if times and self.request_started else None,
+            "model": times[-1] - self.request_started if times and self.request_started else None,
+            "chunks": len(times),
+            "tokens": self.tokens,
+            "tokens_per_second": self.tokens / decode if decode > 0 else None,
+            "inter_chunk": {
+                "p50": percentile(gaps, 0.5),
+                "p90": percentile(gaps, 0.9),
+                "p99": percentile(gaps, 0.99),
+                "max": gaps[-1] if gaps else None,
+            },
+            "phases": dict(self.phases),
+            "calls": self.calls,
+            "total": time.perf_counter() - self.started,
+        }
+
+
+def _ms(seconds):
+    return f"{seconds * 1000:.0f} ms"
+
+
+def format_summary(summary):
+    parts = []
+    if summary["ttft"] is not None:
+        parts.append(f"TTFT {_ms(summary['ttft'])}")
+    if summary["tokens_per_second"] is not None:
+        parts.append(f"{summary['tokens_per_second']:.1f} tok/s")
+    gaps = summary["inter_chunk"]
+    if gaps["p50"] is not None:
+        parts.append(f"ITL p50 {_ms(gaps['p50'])} p90 {_ms(gaps['p90'])} p99 {_ms(gaps['p99'])}")
+    if summary["model"] is not None:
+        parts.append(f"model {summary['model']:.2f} s")
+    for phase, seconds in sorted(summary["phases"].items()):
+        parts.append(f"{phase} {_ms(seconds)}")
+    if summary["calls"]:
+        parts.append(f"{len(summary['calls'])} middleware calls")
+    parts.append(f"turn {summary['total']:.2f} s")
+    return " · ".join(parts)
+
+
+class LatencyMetrics:
+    """
+    Per-session registry: finish(turn) aggregates a turn into histograms, appends it
+    to METRICS_FILE and returns the on-screen summary line.
+    """
+
+    def __init__(self, session, metrics_file=METRICS_FILE, port=METRICS_PORT):
+        self.session = session
+        self.metrics_file = metrics_file
+        self.lock = threading.Lock()
+        self.histograms = defaultdict(Histogram)  # (metric name, endpoint) -> Histogram
+        self.phase_seconds = defaultdict(float)
+        self.turns = 0
+        self.tokens = 0
+        self.last_tokens_per_second = 0.0
+        self.server = None
+        if port:
+            self.serve(port)
+
+    def start_turn(self):
+        return Turn()
+
+    def finish(self, turn):
+        summary = turn.summary()
+        with self.lock:
+            self.turns += 1
+            self.tokens += summary["tokens"]
+            if summary["ttft"] is not None:
+                self.histograms[("ttft_seconds", None)].observe(summary["ttft"])
+            times = turn.chunk_times
+            for a, b in zip(times, times[1:]):
+                self.histograms[("inter_chunk_seconds", None)].observe(b - a)
+            if summary["tokens_per_second"] is not None:
+                self.last_tokens_per_second = summary["tokens_per_second"]
+            for phase, seconds in summary["phases"].items():
+                self.phase_seconds[phase] += seconds
+            for endpoint, seconds in summary["calls"]:
+                self.histograms[("middleware_rtt_seconds", endpoint)].observe(seconds)
+        if self.metrics_file:
+            record = {"session": self.session, "t": time.time(), **summary}
+            with open(self.metrics_file, "a", encoding="utf-8") as f:
+                f.write(json.dumps(record) + "\n")
+        return format_summary(summary)
+
+    def exposition(self):
+        session = f'session="{self.session}",'
+        with self.lock:
+            lines = [
+                "# TYPE agent_turns_total counter",
+                f"agent_turns_total{{{session.rstrip(',')}}} {self.turns}",
+                "# TYPE agent_tokens_total counter",
+                f"agent_tokens_total{{{session.rstrip(',')}}} {self.tokens}",
+                "# TYPE agent_tokens_per_second gauge",
+                f"agent_tokens_per_second{{{session.rstrip(',')}}} {self.last_tokens_per_second}",
+                "# TYPE agent_phase_seconds_total counter",
+            ]
+            for phase, seconds in sorted(self.phase_seconds.items()):
+                lines.append(f'agent_phase_seconds_total{{{session}phase="{phase}"}} {seconds}')
+            typed = set()
+            for (name, endpoint), histogram in sorted(self.histograms.items(), key=lambda item: (item[0][0], item[0][1] or "")):
+                if name not in typed:
+                    lines.append(f"# TYPE agent_{name} histogram")
+                    typed.add(name)
+                labels = session + (f'endpoint="{endpoint}",' if endpoint else "")
+                lines.extend(histogram.exposition(f"agent_{name}", labels))
+        return "\n".join(lines) + "\n"
+
+    def serve(self, port):
+        metrics = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path != "/metrics":
+                    self.send_error(404)
+                    return
+                body = metrics.exposition().encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", port), Handler)
+        threading.Thread(target=self.server.serve_forever, name="metrics-server", daemon=True).start()
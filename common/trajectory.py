@@ -0,0 +1,211 @@
+import os
+import sys
+import json
+import time
+import zlib
+import atexit
+import threading
+from pathlib import Path
+from collections import Counter
+
+# Where session logs go; 'off' disables recording
+TRAJECTORY_DIR = os.getenv("TRAJECTORY_DIR", os.path.join(os.path.expanduser("~"), ".cache", "trajectories"))
+# Buffered events are compressed and appended by a background thread this often (seconds)
+FLUSH_INTERVAL = float(os.getenv("TRAJECTORY_FLUSH_INTERVAL", 1.0))
+# ... or as soon as this many events are waiting
+FLUSH_EVENTS = 1024
+COMPRESSION_LEVEL = 6
+READ_CHUNK_BYTES = 1024 * 1024
+
+
+class ResponseRecord:
+    """
+    Chunks of one streamed response with their arrival times; chunk() only appends
+    to a list, and the whole response is logged as a single event by finish().
+    """
+
+    def __init__(self, recorder, request_id):
+        self.recorder = recorder
+        self.request_id = request_id
+        self.started = time.monotonic()
+        self.chunks = []
+
+    def chunk(self, text):
+        self.chunks.append([round((time.monotonic() - self.started) * 1000, 1), text])
+
+    def finish(self, cancelled=False, error=None):
+        self.recorder.record(
+            "response",
+            request=self.request_id,
+            chunks=self.chunks,
+            duration=time.monotonic() - self.started,
+            cancelled=cancelled,
+            error=error,
+        )
+
+
+class TrajectoryRecorder:
+    """
+    Append-only log of an agent session: requests, response chunk timings, code
+    runs and debugger calls, one JSON event per line.
+
+    record() only appends the event to an in-memory buffer. A background thread
+    serializes buffered events every FLUSH_INTERVAL seconds and appends them to
+    the log as one gzip member, so the file is a valid multi-member .jsonl.gz at
+    every flush and a crash loses at most the last interval. Request messages are
+    logged as a delta against the previous request (the shared prefix length plus
+    the new messages), so long conversations do not grow the log quadratically.
+    """
+
+    def __init__(self, name, directory=TRAJECTORY_DIR, flush_interval=FLUSH_INTERVAL):
+        self.enabled = directory not in ("", "off")
+        self.path = None
+        self.pending = []
+        self.lock = threading.Lock()
+        self.wake = threading.Event()
+        self.closed = False
+        self.requests = 0
+        self.previous_messages = []
+        if not self.enabled:
+            return
+        Path(directory).mkdir(parents=True, exist_ok=True)
+        stamp = time.strftime("%Y%m%d-%H%M%S")
+        self.path = os.path.join(directory, f"{stamp}-{os.getpid()}-{name}.jsonl.gz")
+        self.file = open(self.path, "ab")
+        self.flush_interval = flush_interval
+        self.flusher = threading.Thread(target=self._flush_loop, name="trajectory-flusher", daemon=True)
+        self.flusher.start()
+        atexit.register(self.close)
+        self.record("session", name=name, argv=sys.argv, cwd=os.getcwd())
+
+    def record(self, event_type, **fields):
+        if not self.enabled or self.closed:
+            return
+        fields["type"] = event_type
+        fields["t"] = time.time()
+        with self.lock:
+            self.pending.append(fields)
+            if len(self.pending) >= FLUSH_EVENTS:
+                self.wake.set()
+
+    def request(self, kwargs):
+        """
+        Log a completion request; returns its id for the matching response().
+        """
+        self.requests += 1
+        if not self.enabled:
+            return self.requests
+        messages = kwargs.get("messages", [])
+        shared = 0
+        for old, new in zip(self.previous_messages, messages):
+            if old != new:
+                break
+            shared += 1
+        self.previous_messages = list(messages)
+        params = {name: value for name, value in kwargs.items() if name != "messages"}
+        self.record("request", id=self.requests, params=params, messages_from=shared, messages=messages[shared:])
+        return self.requests
+
+    def response(self, request_id):
+        return ResponseRecord(self, request_id)
+
+    def _write_pending(self):
+        with self.lock:
+            events, self.pending = self.pending, []
+        if not events:
+            return
+        lines = "".join(json.dumps(event, ensure_ascii=False, default=str) + "\n" for event in events)
+        # wbits=31 produces a complete gzip member; appended members form one valid .gz file
+        compressor = zlib.compressobj(COMPRESSION_LEVEL, zlib.DEFLATED, 31)
+        data = compressor.compress(lines.encode("utf-8", "surrogateescape")) + compressor.flush()
+        self.file.write(data)
+        self.file.flush()
+
+    def _flush_loop(self):
+        while not self.closed:
+            self.wake.wait(self.flush_interval)
+            self.wake.clear()
+            try:
+                self._write_pending()
+            except OSError as e:
+                print(f"Trajectory recording stopped: {e}", file=sys.stderr)
+                self.enabled = False
+                return
+
+    def close(self):
+        if not self.enabled or self.closed:
+            return
+        self.record("end")
+        self.closed = True
+        self.wake.set()
+        self.flusher.join()
+        self._write_pending()
+        self.file.close()
+
+
+def read_trajectory(path):
+    """
+    Yield the events of a trajectory log one at a time, decompressing it
+    READ_CHUNK_BYTES of compressed data at a time, so memory does not depend on
+    the log size. A member cut short by a crash ends the iteration instead of raising.
+    """
+    decompressor = zlib.decompressobj(31)
+    tail = b""
+    with open(path, "rb") as f:
+        while True:
+            data = f.read(READ_CHUNK_BYTES)
+            if not data:
+                return
+            while data:
+                try:
+                    text = decompressor.decompress(data)
+                except zlib.error:
+                    return
+                data = b""
+                if decompressor.eof:
+                    # The rest belongs to the next gzip member
+                    data = decompressor.unused_data
+                    decompressor = zlib.decompressobj(31)
+                lines = (tail + text).split(b"\n")
+                tail = lines.pop()
+                for line in lines:
+                    if line:
+                        yield json.loads(line.decode("utf-8", "surrogateescape"))
+
+
+def iter_requests(path):
+    """
+    Yield (full message list, response event or None) for every request in a log,
+    rebuilding each message list from the logged deltas.
+    """
+    messages = []
+    waiting = {}
+    for event in read_trajectory(path):
+        if event["type"] == "request":
+            messages = messages[: event["messages_from"]] + event["messages"]
+            waiting[event["id"]] = messages
+        elif event["type"] == "response" and event["request"] in waiting:
+            yield waiting.pop(event["request"]), event
+    for request_messages in waiting.values():
+        yield request_messages, None
+
+
+def main():
+    if len(sys.argv) != 2:
+        print("Usage: python trajectory.py <session.jsonl.gz>")
+        sys.exit(1)
+    counts = Counter()
+    first_chunk = []
+    for event in read_trajectory(sys.argv[1]):
+        counts[event["type"]] += 1
+        if event["type"] == "response" and event["chunks"]:
+            first_chunk.append(event["chunks"][0][0])
+    for event_type, count in sorted(counts.items()):
+        print(f"{event_type}: {count}")
+    if first_chunk:
+        first_chunk.sort()
+        print(f"Median time to first chunk: {first_chunk[len(first_chunk) // 2]:.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
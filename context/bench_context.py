@@ -0,0 +1,346 @@
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import argparse
+import platform
+import tempfile
+import subprocess
+import contextlib
+
+# End-to-end benchmark of the context generators on deterministic synthetic trees.
+# Every scenario builds (or reuses) a tree under --work-dir, probes the walk and the
+# exclusion matcher in a fresh interpreter, then runs each generator as a child
+# process and records wall time, output bytes/s and the child's peak RSS.
+#
+# Usage:
+#   python bench_context.py [--sizes 1000,100000,1000000] [--shapes wide,deep]
+#                           [--patterns 200] [--binary-ratio 0.02] [--output results.json]
+#   python bench_context.py --compare old.json new.json
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_WORK_DIR = os.path.join(os.getenv("TMPDIR", '/tmp'), 'context_bench')
+# Files per directory for each shape: 'wide' is two levels of large directories,
+# 'deep' is a 4-ary tree about a dozen levels deep with a few files at every leaf
+WIDE_FILES_PER_DIR = 200
+DEEP_FILES_PER_DIR = 8
+DEEP_FANOUT = 4
+# Patterns written to the synthetic .gitignore that do match generated content
+MATCHING_PATTERNS = ['*.log', 'build/', 'node_modules/', '__pycache__/', '*.tmp']
+# Pattern used for the context_creation runs (rg, or the trigram index when rg is missing)
+QUERY = 'def handler_7'
+GENERATORS = ('static_prompt_gen', 'prompt_gen', 'prompt_gen_incremental', 'context_creation')
+
+TEXT_LINES = [
+    'import os',
+    'import sys',
+    'from collections import defaultdict',
+    '',
+    'CONFIG = {"retries": 3, "timeout": 30}',
+    'class Worker:',
+    '    """Process queued jobs."""',
+    '    def __init__(self, name):',
+    '        self.name = name',
+    '        self.jobs = []',
+    '    def run(self):',
+    '        for job in self.jobs:',
+    '            job()',
+    'def handler_{n}(event, context):',
+    '    return {"status": 200, "body": event.get("id")}',
+    '# TODO: remove once the migration is done',
+]
+
+
+# ---- tree generation ---------------------------------------------------------------
+
+def scenario_name(num_files, shape, num_patterns, binary_ratio):
+    return f"{shape}-{num_files}-p{num_patterns}-b{binary_ratio:g}"
+
+
+def file_dir(index, shape):
+    if shape == 'wide':
+        slot = index // WIDE_FILES_PER_DIR
+        return os.path.join(f"pkg{slot // 64:04d}", f"mod{slot % 64:02d}")
+    slot = index // DEEP_FILES_PER_DIR
+    digits = []
+    for _ in range(12):
+        slot, digit = divmod(slot, DEEP_FANOUT)
+        digits.append(f"n{digit}")
+    return os.path.join(*reversed(digits))
+
+
+def gitignore_patterns(num_patterns):
+    patterns = list(MATCHING_PATTERNS)
+    for i in range(max(0, num_patterns - len(patterns))):
+        kind = i % 4
+        if kind == 0:
+            patterns.append(f"*.ext{i}")
+        elif kind == 1:
+            patterns.append(f"generated_{i}/")
+        elif kind == 2:
+            patterns.append(f"cache_{i}_*")
+        else:
+            patterns.append(f"/artifacts/run{i}")
+    return patterns
+
+
+def text_body(rng, index):
+    lines = [f"# synthetic module {index}"]
+    for _ in range(rng.randint(4, 120)):
+        lines.append(rng.choice(TEXT_LINES).replace('{n}', str(rng.randint(0, 999))))
+    return '\n'.join(lines) + '\n'
+
+
+def generate_tree(root, num_files, shape, num_patterns, binary_ratio, seed=0):
+    """
+    Build a deterministic synthetic repository under root (reused if a complete
+    one with the same parameters exists). Returns (seconds spent, bytes written).
+    """
+    params = {'files': num_files, 'shape': shape, 'patterns': num_patterns, 'binary_ratio': binary_ratio, 'seed': seed}
+    stamp = os.path.join(root, '.bench_complete')
+    try:
+        with open(stamp, 'r', encoding='utf-8') as f:
+            done = json.load(f)
+        if done['params'] == params:
+            return 0.0, done['bytes']
+    except (OSError, ValueError, KeyError):
+        pass
+
+    shutil.rmtree(root, ignore_errors=True)
+    start = time.perf_counter()
+    rng = random.Random(seed)
+    total = 0
+    made = set()
+    os.makedirs(root)
+    with open(os.path.join(root, '.gitignore'), 'w', encoding='utf-8') as f:
+        f.write('# synthetic exclusion rules\n' + '\n'.join(gitignore_patterns(num_patterns)) + '\n')
+    for index in range(num_files):
+        directory = os.path.join(root, file_dir(index, shape))
+        if directory not in made:
+            os.makedirs(directory, exist_ok=True)
+            made.add(directory)
+        roll = rng.random()
+        if roll < binary_ratio:
+            data = b'\0BLOB' + rng.randbytes(rng.choice((4096, 65536, 262144)))
+            name = f"blob{index}.bin"
+        elif roll < binary_ratio + 0.02:
+            data = f"excluded log line {index}\n".encode() * 20
+            name = f"run{index}.log"
+        elif index % 500 == 0:
+            # An excluded build directory next to the sources
+            excluded = os.path.join(directory, 'build')
+            os.makedirs(excluded, exist_ok=True)
+            data = text_body(rng, index).encode()
+            name = os.path.join('build', f"out{index}.py")
+        else:
+            data = text_body(rng, index).encode()
+            name = f"file{index}.py"
+        with open(os.path.join(directory, name), 'wb') as f:
+            f.write(data)
+        total += len(data)
+    with open(stamp, 'w', encoding='utf-8') as f:
+        json.dump({'params': params, 'bytes': total}, f)
+    return time.perf_counter() - start, total
+
+
+# ---- measurements ------------------------------------------------------------------
+
+def probe(module_name, root):
+    """
+    Child mode: time pattern loading, get_tree and should_exclude for one generator
+    module imported in this (fresh) interpreter, and print the results as JSON.
+    """
+    os.environ['DIR_PATH'] = root
+    sys.path.insert(0, HERE)
+    result = {}
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        start = time.perf_counter()
+        module = __import__(module_name)
+        result['import_s'] = time.perf_counter() - start
+        if hasattr(module, 'load_gitignore_patterns'):
+            start = time.perf_counter()
+            patterns = module.load_gitignore_patterns(root)
+            result['load_patterns_s'] = time.perf_counter() - start
+            result['num_patterns'] = len(patterns)
+        start = time.perf_counter()
+        tree_lines, file_paths = module.get_tree(root)
+        result['walk_s'] = time.perf_counter() - start
+        result['tree_lines'] = len(tree_lines)
+        result['files'] = len(file_paths)
+        start = time.perf_counter()
+        excluded = sum(1 for path in file_paths if module.should_exclude(path))
+        elapsed = time.perf_counter() - start
+    result['matcher_s'] = elapsed
+    result['matcher_us_per_path'] = elapsed / len(file_paths) * 1e6 if file_paths else 0.0
+    result['matcher_excluded'] = excluded
+    print(json.dumps(result))
+
+
+def run_child(cmd, cwd, env):
+    """
+    Run cmd to completion and return (wall seconds, return code, peak RSS in KiB).
+    wait4 reports the rusage of this child alone, unlike RUSAGE_CHILDREN.
+    """
+    with tempfile.TemporaryFile() as stderr:
+        start = time.perf_counter()
+        proc = subprocess.Popen(cmd, cwd=cwd, env=env, stdout=subprocess.DEVNULL, stderr=stderr)
+        _, status, usage = os.wait4(proc.pid, 0)
+        elapsed = time.perf_counter() - start
+        proc.returncode = os.waitstatus_to_exitcode(status)
+        if proc.returncode != 0:
+            stderr.seek(0)
+            print(stderr.read().decode('utf-8', 'replace')[-2000:], file=sys.stderr)
+    # ru_maxrss is in KiB on Linux but bytes on macOS
+    peak = usage.ru_maxrss // 1024 if sys.platform == 'darwin' else usage.ru_maxrss
+    return elapsed, proc.returncode, peak
+
+
+def run_generator(name, root, run_dir):
+    env = dict(os.environ, DIR_PATH=root, PYTHONDONTWRITEBYTECODE='1')
+    if name == 'context_creation':
+        if shutil.which('rg'):
+            args = ['rg', '-l', QUERY]
+        else:
+            env['TRIGRAM_INDEX_DIR'] = os.path.join(run_dir, '.trigram_index')
+            args = ['--index', QUERY]
+        cmd = [sys.executable, os.path.join(HERE, 'context_creation.py')] + args
+    else:
+        script = 'prompt_gen' if name.startswith('prompt_gen') else name
+        cmd = [sys.executable, os.path.join(HERE, script + '.py')]
+        env['INCREMENTAL'] = '1' if name == 'prompt_gen_incremental' else '0'
+        if name == 'prompt_gen_incremental':
+            # Prime the manifest; the measured run is the unchanged re-run
+            run_child(cmd, run_dir, env)
+
+    wall, returncode, peak_rss = run_child(cmd, run_dir, env)
+    output = os.path.join(run_dir, 'output.txt')
+    size = os.path.getsize(output) if os.path.exists(output) else 0
+    result = {
+        'wall_s': wall,
+        'returncode': returncode,
+        'output_bytes': size,
+        'bytes_per_s': size / wall if wall > 0 else 0.0,
+        'peak_rss_kb': peak_rss,
+    }
+    if name == 'context_creation':
+        result['mode'] = args[0]
+    return result
+
+
+def run_scenario(work_dir, num_files, shape, num_patterns, binary_ratio, generators):
+    name = scenario_name(num_files, shape, num_patterns, binary_ratio)
+    root = os.path.join(work_dir, 'trees', name)
+    print(f"[{name}] generating tree...", flush=True)
+    generate_s, tree_bytes = generate_tree(root, num_files, shape, num_patterns, binary_ratio)
+    scenario = {
+        'name': name, 'files': num_files, 'shape': shape, 'patterns': num_patterns,
+        'binary_ratio': binary_ratio, 'tree_bytes': tree_bytes, 'generate_s': generate_s,
+        'probes': {}, 'runs': {},
+    }
+    for module_name in ('static_prompt_gen', 'prompt_gen'):
+        output = subprocess.check_output(
+            [sys.executable, os.path.abspath(__file__), '--probe', module_name, root],
+            env=dict(os.environ, PYTHONDONTWRITEBYTECODE='1'),
+        )
+        scenario['probes'][module_name] = json.loads(output.decode().strip().splitlines()[-1])
+        probe_result = scenario['probes'][module_name]
+        print(f"[{name}] {module_name}: walk {probe_result['walk_s']:.2f}s, "
+              f"matcher {probe_result['matcher_us_per_path']:.2f} us/path", flush=True)
+    for generator in generators:
+        run_dir = os.path.join(work_dir, 'runs', name, generator)
+        shutil.rmtree(run_dir, ignore_errors=True)
+        os.makedirs(run_dir)
+        result = run_generator(generator, root, run_dir)
+        scenario['runs'][generator] = result
+        print(f"[{name}] {generator}: {result['wall_s']:.2f}s, "
+              f"{result['bytes_per_s'] / 1e6:.1f} MB/s, peak RSS {result['peak_rss_kb'] / 1024:.0f} MiB", flush=True)
+        shutil.rmtree(run_dir, ignore_errors=True)
+    return scenario
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'], cwd=HERE, stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+# ---- comparison --------------------------------------------------------------------
+
+COMPARED_METRICS = [
+    ('probes', 'walk_s'), ('probes', 'matcher_us_per_path'),
+    ('runs', 'wall_s'), ('runs', 'bytes_per_s'), ('runs', 'peak_rss_kb'),
+]
+
+
+def compare(old_path, new_path):
+    """
+    Print new/old ratios for every metric present in both result files.
+    """
+    with open(old_path, 'r', encoding='utf-8') as f:
+        old = {s['name']: s for s in json.load(f)['scenarios']}
+    with open(new_path, 'r', encoding='utf-8') as f:
+        new = json.load(f)['scenarios']
+    for scenario in new:
+        before = old.get(scenario['name'])
+        if before is None:
+            continue
+        print(scenario['name'])
+        for section, metric in COMPARED_METRICS:
+            for target, values in scenario[section].items():
+                old_value = before[section].get(target, {}).get(metric)
+                new_value = values.get(metric)
+                if old_value and new_value is not None:
+                    print(f"  {target:<24} {metric:<22} {old_value:12.3f} -> {new_value:12.3f}  ({new_value / old_value:.2f}x)")
+
+
+def main():
+    if len(sys.argv) == 4 and sys.argv[1] == '--probe':
+        probe(sys.argv[2], sys.argv[3])
+        return
+
+    parser = argparse.ArgumentParser(description='Benchmark the context generators on synthetic trees.')
+    parser.add_argument('--sizes', default='1000,100000', help='comma-separated file counts, e.g. 1000,100000,1000000')
+    parser.add_argument('--shapes', default='wide,deep', help="comma-separated tree shapes: 'wide', 'deep'")
+    parser.add_argument('--patterns', type=int, default=200, help='exclusion patterns in the synthetic .gitignore')
+    parser.add_argument('--binary-ratio', type=float, default=0.02, help='fraction of files that are binary blobs')
+    parser.add_argument('--generators', default=','.join(GENERATORS), help='comma-separated generators to run')
+    parser.add_argument('--work-dir', default=DEFAULT_WORK_DIR, help='where trees are generated and cached')
+    parser.add_argument('--output', help='results JSON (default: bench_context_<commit>.json)')
+    parser.add_argument('--compare', nargs=2, metavar=('OLD', 'NEW'), help='compare two result files and exit')
+    args = parser.parse_args()
+
+    if args.compare:
+        compare(*args.compare)
+        return
+
+    commit = git_commit()
+    generators = [g for g in args.generators.split(',') if g]
+    unknown = set(generators) - set(GENERATORS)
+    if unknown:
+        parser.error(f"unknown generators: {', '.join(sorted(unknown))}")
+    scenarios = []
+    for num_files in (int(size) for size in args.sizes.split(',')):
+        for shape in args.shapes.split(','):
+            scenarios.append(run_scenario(
+                args.work_dir, num_files, shape, args.patterns, args.binary_ratio, generators
+            ))
+
+    results = {
+        'commit': commit,
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpus': os.cpu_count(),
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        'scenarios': scenarios,
+    }
+    output = args.output or f"bench_context_{(commit or 'nogit')[:10]}.json"
+    with open(output, 'w', encoding='utf-8') as f:
+        json.dump(results, f, indent=2)
+    print(f"Results saved to: {output}")
+
+
+if __name__ == '__main__':
+    main()
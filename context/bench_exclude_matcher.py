@@ -0,0 +1,108 @@
+import os
+import sys
+import fnmatch
+import random
+import timeit
+
+from exclude_matcher import ExcludeMatcher
+
+# Micro-benchmark: per-path cost of the compiled ExcludeMatcher against the
+# original per-pattern fnmatch loop that should_exclude used to run.
+# Usage: python bench_exclude_matcher.py [num_paths] [num_extra_patterns]
+
+ROOT = '/work/monorepo'
+BASE_PATTERNS = [
+    f"{ROOT}/logs",
+    f"{ROOT}/__pycache__",
+    f"{ROOT}/*/__pycache__",
+    "*.pyc", "*.pyo", "*.log", "*.pt", "*.pth",
+    ".git", "DS_Store", "*.tmp", ".gitignore",
+    "__pycache__/", "node_modules/", "build/", "dist/", ".venv/",
+    "*.egg-info/", "/test_output.txt", "*.py[cod]", "FusionTree/wandb",
+]
+
+
+def reference_should_exclude(path, patterns, match_suffixes):
+    """
+    The original should_exclude from prompt_gen.py / static_prompt_gen.py.
+    """
+    normalized_path = path.replace('\\', '/')
+    for exclude_pattern in patterns:
+        if normalized_path == exclude_pattern:
+            return True
+        if fnmatch.fnmatch(normalized_path, exclude_pattern):
+            return True
+        path_parts = normalized_path.split('/')
+        for part in path_parts:
+            if fnmatch.fnmatch(part, exclude_pattern):
+                return True
+    if match_suffixes:
+        for exclude_pattern in patterns:
+            clean_pattern = exclude_pattern.rstrip('/')
+            if clean_pattern and not any(c in clean_pattern for c in '*?['):
+                if normalized_path.endswith(clean_pattern) or normalized_path.endswith('/' + clean_pattern):
+                    return True
+    return False
+
+
+def make_patterns(num_extra):
+    rng = random.Random(1)
+    patterns = list(BASE_PATTERNS)
+    for i in range(num_extra):
+        kind = i % 3
+        if kind == 0:
+            patterns.append(f"*.ext{i}")
+        elif kind == 1:
+            patterns.append(f"generated_{i}")
+        else:
+            patterns.append(f"cache_{i}_*/")
+    rng.shuffle(patterns)
+    return patterns
+
+
+def make_paths(num_paths):
+    rng = random.Random(0)
+    dirs = ['src', 'lib', 'pkg', 'tests', 'docs', 'tools', 'core', 'utils', 'node_modules', 'build']
+    exts = ['.py', '.md', '.txt', '.json', '.pyc', '.log', '.cfg', '.ts', '.c', '.h']
+    paths = []
+    for _ in range(num_paths):
+        depth = rng.randint(1, 6)
+        parts = [rng.choice(dirs) + str(rng.randint(0, 3)) for _ in range(depth)]
+        parts.append(f"file{rng.randint(0, 999)}{rng.choice(exts)}")
+        paths.append(ROOT + '/' + '/'.join(parts))
+    return paths
+
+
+def bench(label, fn, paths, repeat=3):
+    runs = timeit.repeat(lambda: [fn(p) for p in paths], number=1, repeat=repeat)
+    per_path_us = min(runs) / len(paths) * 1e6
+    print(f"  {label:<28} {per_path_us:8.2f} us/path")
+    return per_path_us
+
+
+def main():
+    num_paths = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    num_extra = int(sys.argv[2]) if len(sys.argv) > 2 else 60
+    patterns = make_patterns(num_extra)
+    paths = make_paths(num_paths)
+
+    for match_suffixes in (False, True):
+        matcher = ExcludeMatcher(patterns, match_suffixes=match_suffixes)
+        mismatches = [
+            p for p in paths
+            if matcher(p) != reference_should_exclude(p, patterns, match_suffixes)
+        ]
+        if mismatches:
+            print(f"Matcher disagrees with the reference on {len(mismatches)} paths, e.g. {mismatches[0]}")
+            sys.exit(1)
+
+        label = 'prompt_gen' if match_suffixes else 'static_prompt_gen'
+        print(f"{label}: {len(paths)} paths, {len(patterns)} patterns")
+        before = bench('fnmatch loop (original)', lambda p: reference_should_exclude(p, patterns, match_suffixes), paths)
+        after = bench('ExcludeMatcher (full path)', matcher, paths)
+        child = bench('ExcludeMatcher (walk child)', lambda p: matcher.excludes_child(p, os.path.basename(p)), paths)
+        print(f"  speedup: {before / after:.1f}x full path, {before / child:.1f}x during the walk")
+
+
+if __name__ == '__main__':
+    main()
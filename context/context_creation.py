@@ -1,12 +1,31 @@
 import os
 import sys
-from gitingest import ingest
 from pathlib import Path
 import subprocess
+from collections import Counter
+
+from exclude_matcher import ExcludeMatcher
+from file_ingest import TokenCountingWriter, summarize_files, tree_for_files, write_contents
+from token_budget import TOKEN_CACHE_SUFFIX, TokenCountCache, build_candidates, load_tokenizer, pack
+from tree_walker import walk_tree
+from trigram_index import TrigramIndex
 
 # Global configuration: Directory path to print, and the output filename
 DIR_PATH = os.getenv("DIR_PATH", Path(__file__).parent.as_posix()) # Please modify to the target directory
 OUTPUT_FILE = 'output.txt'
+# Per-file cap on copied bytes; longer files end with a truncation marker (0 = no cap)
+MAX_FILE_BYTES = int(os.getenv("MAX_FILE_BYTES", 1024 * 1024))
+# Threads that classify and read the matched files ahead of the writer (0 = read inline)
+READ_WORKERS = int(os.getenv("READ_WORKERS", 4))
+# Pack the matched files into this many tokens, most rg hits first (0 = include every match)
+TOKEN_BUDGET = int(os.getenv("TOKEN_BUDGET", 0))
+# Tokenizer for TOKEN_BUDGET: 'approx', 'tiktoken:<encoding>' or '<module>:<function>'
+TOKENIZER = os.getenv("TOKENIZER", "approx")
+# Trigram index used by `--index <pattern>` queries instead of spawning rg
+TRIGRAM_INDEX_DIR = os.getenv("TRIGRAM_INDEX_DIR", '.trigram_index')
+# Re-stat the tree and re-index changed files before each --index query. Off by default so
+# queries stay O(matches); refresh explicitly with `python trigram_index.py update <root>`
+INDEX_REFRESH = os.getenv("INDEX_REFRESH", "0") != "0"
 
 def load_gitignore_patterns(root_dir):
     """
@@ -28,36 +47,91 @@ def load_gitignore_patterns(root_dir):
 print(load_gitignore_patterns(DIR_PATH))
 exclude_patterns = load_gitignore_patterns(DIR_PATH)
 
-if len(sys.argv) < 2:
+# The index and OUTPUT_FILE (with its .tokens.json and other sidecars) are written to the
+# working directory, which is usually inside DIR_PATH; they are never part of the context
+INDEX_PATH = os.path.abspath(TRIGRAM_INDEX_DIR)
+OUTPUT_PATH = os.path.abspath(OUTPUT_FILE)
+
+def is_own_file(path, name=None):
+    name = name or os.path.basename(path)
+    if name != os.path.basename(INDEX_PATH) and not name.startswith(os.path.basename(OUTPUT_PATH)):
+        return False
+    path = os.path.abspath(path)
+    return path == INDEX_PATH or path == OUTPUT_PATH or path.startswith(OUTPUT_PATH + '.')
+
+if len(sys.argv) < 2 or (sys.argv[1] == '--index' and len(sys.argv) != 3):
     print("Usage: python script.py <rg command and arguments>")
+    print("       python script.py --index <pattern>")
     sys.exit(1)
 
 rg_command = sys.argv[1:]
 include_patterns = []
 
-try:
-    output = subprocess.check_output(rg_command, cwd=DIR_PATH)
-    include_patterns = set([os.path.join(DIR_PATH, p.split(':', 1)[0]) for p in output.decode('utf-8').splitlines() if p])
+rg_hits = Counter()
+
+if sys.argv[1] == '--index':
+    index = TrigramIndex.open(TRIGRAM_INDEX_DIR)
+    if index.docs and index.root != os.path.abspath(DIR_PATH):
+        # Answering from an index of another tree would be silently wrong
+        print(f"{TRIGRAM_INDEX_DIR} indexes {index.root}, rebuilding it for {DIR_PATH}")
+    if INDEX_REFRESH or not index.docs or index.root != os.path.abspath(DIR_PATH):
+        matcher = ExcludeMatcher(exclude_patterns + ['.git'], match_suffixes=True)
+        _, indexed_paths = walk_tree(
+            DIR_PATH, lambda path, name: matcher.excludes_child(path, name) or is_own_file(path, name)
+        )
+        print(f"Indexed {index.update(DIR_PATH, indexed_paths)} changed files into {TRIGRAM_INDEX_DIR}")
+    rg_hits = Counter(index.search(sys.argv[2]))
+    include_patterns = set(rg_hits)
     print(include_patterns)
-except Exception as e:
-    print(f"Error running rg: {e}")
-    include_patterns = []
-
-# Ingest with filtering
-summary, tree, content = ingest(
-    DIR_PATH,
-    include_patterns=include_patterns,
-    exclude_patterns=exclude_patterns
+else:
+    try:
+        output = subprocess.check_output(rg_command, cwd=DIR_PATH)
+        rg_hits = Counter(os.path.join(DIR_PATH, p.split(':', 1)[0]) for p in output.decode('utf-8').splitlines() if p)
+        include_patterns = set(rg_hits)
+        print(include_patterns)
+    except Exception as e:
+        print(f"Error running rg: {e}")
+        include_patterns = []
+
+# The match set is final: apply the exclusions to it instead of re-walking the tree
+exclude_matcher = ExcludeMatcher(exclude_patterns, match_suffixes=True)
+include_patterns = set(
+    p for p in include_patterns if os.path.isfile(p) and not exclude_matcher(p) and not is_own_file(p)
 )
 
+tokenizer_name, count_tokens = load_tokenizer(TOKENIZER)
+dropped = []
+if TOKEN_BUDGET > 0 and include_patterns:
+    token_cache = TokenCountCache(OUTPUT_FILE + TOKEN_CACHE_SUFFIX, tokenizer_name)
+    candidates = build_candidates(
+        DIR_PATH, sorted(include_patterns), count_tokens, token_cache, max_bytes=MAX_FILE_BYTES, hits=rg_hits
+    )
+    token_cache.save()
+    kept, dropped, used_tokens = pack(candidates, TOKEN_BUDGET)
+    include_patterns = set(kept)
+    print(f"Packed {len(kept)} files into {used_tokens}/{TOKEN_BUDGET} tokens, dropped {len(dropped)}")
+
+# Single pass over the matched files: the tree is built from their paths alone and
+# contents are streamed straight to OUTPUT_FILE, so cost scales with the matches
+tree, file_paths = tree_for_files(DIR_PATH, sorted(include_patterns))
+summary = summarize_files(DIR_PATH, file_paths)
+
 print(f"\n=== Summary ===\n{summary}")
 print(f"\n=== Tree ===\n{tree}")
-print(f"\n=== Content Length: {len(content)} characters ===")
 
-# Optional: Save to file for review
-with open(OUTPUT_FILE, 'w') as f:
+with open(OUTPUT_FILE, 'wb') as raw:
+    f = TokenCountingWriter(raw, count_tokens)
     f.write(f"## Summary\n{summary}\n\n")
+    if TOKEN_BUDGET > 0:
+        f.write(f"## Dropped files ({len(dropped)}, token budget {TOKEN_BUDGET})\n")
+        for candidate in dropped:
+            f.write(f"- {candidate.path} ({candidate.tokens} tokens)\n")
+        f.write("\n")
     f.write(f"## Tree Structure\n```\n{tree}\n```\n\n")
-    f.write(f"## Content\n{content}\n")
+    f.write("## Content\n")
+    content_start, tokens_start = f.tell(), f.tokens
+    write_contents(f, DIR_PATH, file_paths, max_bytes=MAX_FILE_BYTES, workers=READ_WORKERS)
+    content_bytes, content_tokens = f.tell() - content_start, f.tokens - tokens_start
 
-print(f"Context saved to: {OUTPUT_FILE}")
\ No newline at end of file
+print(f"\n=== Content Length: {content_bytes} bytes, {content_tokens} tokens ({tokenizer_name}) ===")
+print(f"Context saved to: {OUTPUT_FILE}")
@@ -0,0 +1,613 @@
+import io
+import os
+import sys
+import json
+import time
+import errno
+import select
+import socket
+import struct
+import hashlib
+import threading
+import socketserver
+import ctypes
+import ctypes.util
+
+import prompt_gen
+from dedup import dedup_known
+from file_classifier import iter_prepared, write_prepared
+from prompt_gen import DIR_PATH, EXCLUDE_MATCHER, MAX_FILE_BYTES, OUTPUT_FILE, READ_WORKERS
+from py_skeleton import build_skeletons
+from snapshot_manifest import hash_file, stat_key
+from stream_writer import ByteCountingWriter
+from tree_walker import list_dir, walk_tree
+
+# Long-running context server: keeps prompt_gen's tree, exclusion decisions and
+# rendered file bodies in memory, applies filesystem change notifications, and
+# serves the current context over a Unix socket.
+#
+# Usage:
+#   DIR_PATH=<root> python context_daemon.py serve      run the daemon in the foreground
+#   DIR_PATH=<root> python context_daemon.py get [out]  write the current context (default: output.txt)
+#   DIR_PATH=<root> python context_daemon.py changes <generation>
+#                                                       sections changed since a generation
+#   DIR_PATH=<root> python context_daemon.py status | stop
+
+# Unix socket the daemon listens on; by default one per tree, in the temp directory
+CONTEXT_SOCKET = os.getenv("CONTEXT_SOCKET", os.path.join(
+    os.getenv("TMPDIR", '/tmp'),
+    f"context-{os.getuid()}-{hashlib.blake2b(os.path.abspath(DIR_PATH).encode(), digest_size=6).hexdigest()}.sock",
+))
+# Seconds between scans when inotify is unavailable (or WATCH_MODE=poll)
+POLL_INTERVAL = float(os.getenv("POLL_INTERVAL", 2.0))
+# 'auto' uses inotify where available and falls back to polling
+WATCH_MODE = os.getenv("WATCH_MODE", "auto")
+# Events are applied once the tree has been quiet this long (seconds), or after DEBOUNCE_MAX
+DEBOUNCE = 0.05
+DEBOUNCE_MAX = 0.5
+
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_ISDIR = 0x40000000
+WATCH_MASK = (
+    IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO
+    | IN_CREATE | IN_DELETE | IN_DELETE_SELF | IN_MOVE_SELF | IN_ONLYDIR
+)
+STRUCTURE_EVENTS = IN_CREATE | IN_DELETE | IN_MOVED_FROM | IN_MOVED_TO
+CONTENT_EVENTS = IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE
+EVENT_HEADER = struct.Struct('iIII')
+
+
+class InotifyWatcher:
+    """
+    Directory watches through the Linux inotify API (via ctypes). Directories
+    that cannot be watched (typically ENOSPC once fs.inotify.max_user_watches is
+    used up) are polled every POLL_INTERVAL instead, along with their files.
+    """
+
+    def __init__(self, state):
+        self.state = state
+        self.fallback = None  # PollingWatcher for the directories inotify refused
+        libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+        self._add_watch = libc.inotify_add_watch
+        self._add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+        self._rm_watch = libc.inotify_rm_watch
+        self._rm_watch.argtypes = [ctypes.c_int, ctypes.c_int]
+        self.fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), 'inotify_init1 failed')
+        self.dirs = {}  # watch descriptor -> directory
+        self.wds = {}   # directory -> watch descriptor
+
+    def watch(self, path):
+        wd = self._add_watch(self.fd, os.fsencode(path), WATCH_MASK)
+        if wd < 0:
+            err = ctypes.get_errno()
+            if err in (errno.ENOENT, errno.ENOTDIR):
+                return
+            if self.fallback is None:
+                print(f"inotify_add_watch failed for {path} ({os.strerror(err)}), polling it "
+                      f"and any other directory that cannot be watched every {POLL_INTERVAL}s")
+                self.fallback = PollingWatcher(self.state, POLL_INTERVAL, watched_only=True)
+            self.fallback.watch(path)
+            return
+        self.dirs[wd] = path
+        self.wds[path] = wd
+
+    def unwatch(self, path):
+        if self.fallback is not None:
+            self.fallback.unwatch(path)
+        wd = self.wds.pop(path, None)
+        if wd is not None:
+            self.dirs.pop(wd, None)
+            self._rm_watch(self.fd, wd)
+
+    def read_events(self, timeout):
+        """
+        Wait up to timeout seconds and return [(directory, name, mask)].
+        A (None, None, IN_Q_OVERFLOW) event means events were lost.
+        """
+        if self.fallback is not None:
+            timeout = min(timeout, max(0.0, self.fallback.next_poll - time.monotonic()))
+        ready, _, _ = select.select([self.fd], [], [], timeout)
+        events = self.fallback.read_events(0) if self.fallback is not None else []
+        while ready:
+            try:
+                data = os.read(self.fd, 256 * 1024)
+            except BlockingIOError:
+                break
+            offset = 0
+            while offset < len(data):
+                wd, mask, _, length = EVENT_HEADER.unpack_from(data, offset)
+                offset += EVENT_HEADER.size
+                name = os.fsdecode(data[offset:offset + length].rstrip(b'\0'))
+                offset += length
+                if mask & IN_Q_OVERFLOW:
+                    events.append((None, None, IN_Q_OVERFLOW))
+                    continue
+                directory = self.dirs.get(wd)
+                if mask & IN_IGNORED:
+                    self.dirs.pop(wd, None)
+                    if directory is not None and self.wds.get(directory) == wd:
+                        del self.wds[directory]
+                    continue
+                if directory is not None:
+                    events.append((directory, name, mask))
+        return events
+
+    def close(self):
+        os.close(self.fd)
+
+
+class PollingWatcher:
+    """
+    Fallback that re-stats every watched directory and known file each interval and
+    reports what changed as inotify-style events. With watched_only, only files in
+    watched directories are checked (the rest are left to inotify).
+    """
+
+    def __init__(self, state, interval, watched_only=False):
+        self.state = state
+        self.interval = interval
+        self.watched_only = watched_only
+        self.dir_keys = {}
+        self.next_poll = time.monotonic() + interval
+
+    def watch(self, path):
+        self.dir_keys[path] = stat_key(path)
+
+    def unwatch(self, path):
+        self.dir_keys.pop(path, None)
+
+    def read_events(self, timeout):
+        wait = self.next_poll - time.monotonic()
+        if wait > timeout:
+            time.sleep(timeout)
+            return []
+        time.sleep(max(0.0, wait))
+        self.next_poll = time.monotonic() + self.interval
+        events = []
+        for path, key in list(self.dir_keys.items()):
+            current = stat_key(path)
+            if current != key:
+                self.dir_keys[path] = current
+                # A changed directory mtime means entries were added, removed or renamed
+                events.append((path, '', IN_CREATE))
+        for path, key in list(self.state.keys.items()):
+            if self.watched_only and os.path.dirname(path) not in self.dir_keys:
+                continue
+            if stat_key(path) != key:
+                events.append((os.path.dirname(path), os.path.basename(path), IN_MODIFY))
+        return events
+
+    def close(self):
+        pass
+
+
+class ContextState:
+    """
+    In-memory copy of everything prompt_gen writes for one tree: raw directory
+    listings, memoized exclusion decisions, the rendered tree and every file's
+    rendered body. Changes are applied per directory and per file, and each
+    applied batch bumps the generation so clients can ask for what changed since.
+    """
+
+    def __init__(self, root):
+        self.root = root
+        self.lock = threading.Lock()
+        self.listings = {}    # directory -> sorted (name, path, is_dir), before exclusion
+        self.excluded = {}    # path -> exclusion decision
+        self.tree_lines = []
+        self.file_paths = []
+        self.bodies = {}      # path -> rendered body text
+        self.keys = {}        # path -> (size, mtime_ns) when the body was rendered
+        self.digests = {}     # path -> content hash
+        self.dedup = None
+        self.dedup_generation = None
+        self.dedup_view = {}  # path -> (reference line, collapsed) under the last dedup
+        self.generation = 0
+        self.tree_generation = 0
+        self.changed_at = {}  # path -> generation of its last change or removal
+        self.watcher = None
+
+    # ---- building ----------------------------------------------------------------
+
+    def excludes_child(self, path, name):
+        decision = self.excluded.get(path)
+        if decision is None:
+            decision = self.excluded[path] = prompt_gen.excludes_child(path, name)
+        return decision
+
+    def _list(self, path):
+        # Watch before listing, so entries created in between still raise an event
+        if self.watcher is not None:
+            self.watcher.watch(path)
+        try:
+            listing = list_dir(path)
+        except OSError:
+            listing = []
+        self.listings[path] = listing
+        return listing
+
+    def _scan(self, path):
+        """
+        List path and every non-excluded directory below it.
+        """
+        stack = [path]
+        while stack:
+            for name, child_path, is_dir in self._list(stack.pop()):
+                if is_dir and not self.excludes_child(child_path, name):
+                    stack.append(child_path)
+
+    def _render_tree(self):
+        root_excluded = any(
+            EXCLUDE_MATCHER.match_name(part) for part in self.root.replace('\\', '/').split('/')
+        )
+        self.tree_lines, self.file_paths = walk_tree(
+            self.root,
+            self.excludes_child,
+            root_excluded=root_excluded,
+            lister=lambda path: self.listings.get(path, []),
+        )
+
+    def _load_bodies(self, paths):
+        if prompt_gen.SKELETON:
+            # Only changed files get here, so no cache is needed; small batches skip the process pool
+            workers = READ_WORKERS if len(paths) > 64 else 0
+            skeletons = build_skeletons(paths, max_bytes=MAX_FILE_BYTES, workers=workers)
+            for path, (body, digest) in skeletons.items():
+                self.bodies[path] = body
+                self.keys[path] = stat_key(path)
+                self.digests[path] = digest
+            paths = [path for path in paths if path not in skeletons]
+        for path, info in zip(paths, iter_prepared(paths, max_bytes=MAX_FILE_BYTES, workers=READ_WORKERS)):
+            buffer = io.StringIO()
+            digest = write_prepared(buffer, info, max_bytes=MAX_FILE_BYTES)
+            key = stat_key(path)
+            if digest is None and key is not None:
+                # Skipped files still take part in deduplication, like in prompt_gen
+                try:
+                    digest = hash_file(path, MAX_FILE_BYTES)
+                except OSError:
+                    pass
+            self.bodies[path] = buffer.getvalue()
+            self.keys[path] = key
+            self.digests[path] = digest
+
+    def _current_dedup(self):
+        # O(files), so computed on demand and at most once per generation, not per event
+        if prompt_gen.DEDUP == 'off':
+            return None
+        if self.dedup_generation != self.generation:
+            sizes = {path: key[0] for path, key in self.keys.items() if key is not None}
+            digests = {path: digest for path, digest in self.digests.items() if path in sizes}
+            self.dedup = dedup_known(self.file_paths, sizes, digests, MAX_FILE_BYTES)
+            self.dedup_generation = self.generation
+            # A file whose copy changed is rendered differently without being touched itself
+            view = {
+                path: (self.dedup.reference(path), path in self.dedup.collapsed_files)
+                for path in self.file_paths
+            }
+            for path, entry in view.items():
+                if entry != self.dedup_view.get(path, (None, False)):
+                    self.changed_at[path] = max(self.changed_at.get(path, 0), self.generation)
+            self.dedup_view = view
+        return self.dedup
+
+    def build(self, watcher):
+        self.watcher = watcher
+        start = time.perf_counter()
+        self._scan(self.root)
+        self._render_tree()
+        self._load_bodies(self.file_paths)
+        self.generation += 1
+        self.tree_generation = self.generation
+        print(f"Loaded {len(self.file_paths)} files from {self.root} in {time.perf_counter() - start:.2f}s")
+
+    # ---- applying changes --------------------------------------------------------
+
+    def _forget_dir(self, path):
+        prefix = path + os.sep
+        for directory in [d for d in self.listings if d == path or d.startswith(prefix)]:
+            del self.listings[directory]
+            if self.watcher is not None:
+                self.watcher.unwatch(directory)
+
+    def apply(self, events):
+        """
+        Apply a batch of (directory, name, mask) events. Returns True if anything changed.
+        """
+        if any(mask & IN_Q_OVERFLOW for _, _, mask in events):
+            print("Event queue overflowed, rescanning the tree")
+            with self.lock:
+                self._forget_dir(self.root)
+                self._scan(self.root)
+                self._render_tree()
+                stale = [path for path in self.file_paths if stat_key(path) != self.keys.get(path)]
+                return self._finish(stale, structure_changed=True)
+
+        dirty_dirs = set()
+        touched = set()
+        for directory, name, mask in events:
+            path = os.path.join(directory, name) if name else directory
+            if mask & STRUCTURE_EVENTS:
+                dirty_dirs.add(directory)
+            if mask & (IN_DELETE_SELF | IN_MOVE_SELF):
+                dirty_dirs.add(os.path.dirname(directory))
+            if mask & (CONTENT_EVENTS | IN_CREATE | IN_MOVED_TO) and not mask & IN_ISDIR:
+                touched.add(path)
+
+        with self.lock:
+            structure_changed = False
+            for directory in sorted(dirty_dirs):
+                if directory not in self.listings:
+                    continue  # excluded, or inside a directory that is already gone
+                old = {entry[1]: entry for entry in self.listings[directory]}
+                try:
+                    listing = list_dir(directory)
+                except OSError:
+                    listing = []
+                new = {entry[1]: entry for entry in listing}
+                if old == new:
+                    continue
+                structure_changed = True
+                self.listings[directory] = listing
+                for path, (name, _, is_dir) in old.items():
+                    if is_dir and (path not in new or not new[path][2]):
+                        self._forget_dir(path)
+                for path, (name, _, is_dir) in new.items():
+                    if is_dir and path not in self.listings and not self.excludes_child(path, name):
+                        self._scan(path)
+            stale = []
+            if structure_changed:
+                self._render_tree()
+                current = set(self.file_paths)
+                stale = [path for path in self.file_paths if path not in self.bodies]
+                for path in [path for path in self.bodies if path not in current]:
+                    del self.bodies[path], self.keys[path], self.digests[path]
+                    self.changed_at[path] = self.generation + 1
+            # Known files whose size or mtime moved since they were rendered
+            stale += [path for path in touched if path in self.bodies and stat_key(path) != self.keys[path]]
+            return self._finish(list(dict.fromkeys(stale)), structure_changed)
+
+    def _finish(self, stale, structure_changed):
+        if not stale and not structure_changed:
+            return False
+        self._load_bodies(stale)
+        self.generation += 1
+        for path in stale:
+            self.changed_at[path] = self.generation
+        if structure_changed:
+            self.tree_generation = self.generation
+        return True
+
+    def watch_forever(self, stop):
+        """
+        Apply events as they arrive until stop is set.
+        """
+        while not stop.is_set():
+            events = self.watcher.read_events(0.5)
+            if not events:
+                continue
+            deadline = time.monotonic() + DEBOUNCE_MAX
+            while time.monotonic() < deadline:
+                more = self.watcher.read_events(DEBOUNCE)
+                if not more:
+                    break
+                events.extend(more)
+            start = time.perf_counter()
+            if self.apply(events):
+                print(f"Generation {self.generation}: applied {len(events)} events "
+                      f"in {(time.perf_counter() - start) * 1000:.1f} ms")
+
+    # ---- rendering ---------------------------------------------------------------
+
+    def snapshot(self):
+        with self.lock:
+            dedup = self._current_dedup()
+            return (
+                self.generation, self.tree_generation, self.tree_lines, self.file_paths,
+                dict(self.bodies), dedup, dict(self.changed_at),
+            )
+
+    def render(self, out, snapshot=None):
+        """
+        Write the full context to out, byte-identical to a prompt_gen run.
+        snapshot, if given, is the snapshot() to render; returns its generation.
+        """
+        generation, _, tree_lines, file_paths, bodies, dedup, _ = snapshot or self.snapshot()
+        if dedup is not None:
+            file_paths = [path for path in file_paths if path not in dedup.collapsed_files]
+        prompt_gen.write_header(out, tree_lines, file_paths, dedup=dedup)
+        out.write("\nStarting to print all file contents...\n")
+        for idx, path in enumerate(file_paths, 1):
+            out.write(prompt_gen.section_header(idx, len(file_paths), path))
+            reference = dedup.reference(path) if dedup is not None else None
+            out.write(reference if reference is not None else bodies[path])
+        return generation
+
+    def render_changes(self, out, since, snapshot=None):
+        """
+        Write only what changed after generation `since`: the tree if it changed,
+        the sections of changed files (including files whose duplicate reference
+        changed), a line per removed file and a line per newly collapsed file.
+        """
+        snapshot = snapshot or self.snapshot()
+        generation, tree_generation, tree_lines, file_paths, bodies, dedup, changed_at = snapshot
+        # Removals are stamped one generation ahead while an update is being applied
+        changed_at = {path: gen for path, gen in changed_at.items() if since < gen <= generation}
+        collapsed_files = dedup.collapsed_files if dedup is not None else set()
+        current = set(file_paths)
+        shown = [path for path in file_paths if path not in collapsed_files]
+        changed = [path for path in shown if path in changed_at]
+        collapsed = [path for path in file_paths if path in collapsed_files and path in changed_at]
+        removed = sorted(path for path in changed_at if path not in current)
+        out.write(f"Changes since generation {since} (now {generation}): "
+                  f"{len(changed)} changed, {len(removed)} removed, {len(collapsed)} collapsed\n")
+        if tree_generation > since:
+            out.write("\n" + "=" * 80 + "\n")
+            for line in tree_lines:
+                out.write(line + '\n')
+        index = {path: idx for idx, path in enumerate(shown, 1)}
+        for path in changed:
+            out.write(prompt_gen.section_header(index[path], len(shown), path))
+            reference = dedup.reference(path) if dedup is not None else None
+            out.write(reference if reference is not None else bodies[path])
+        for path in removed:
+            out.write(f"\n[Removed: {path}]\n")
+        if collapsed:
+            for copy_dir, original_dir, count in dedup.collapsed_dirs:
+                out.write(f"\n[Collapsed: {copy_dir}: {count} files, "
+                          f"each identical to the same path under {original_dir}]\n")
+            for path in collapsed:
+                out.write(f"\n[Collapsed: {path}]\n")
+        return generation
+
+
+# ---- socket protocol ---------------------------------------------------------------
+# A client sends one command line; the daemon answers "OK <generation>\n" followed by
+# the payload and closes the connection, or "ERR <message>\n".
+
+class RequestHandler(socketserver.StreamRequestHandler):
+
+    def handle(self):
+        state = self.server.state
+        command, _, arg = self.rfile.readline().decode('utf-8').strip().partition(' ')
+        out = ByteCountingWriter(self.wfile)
+        try:
+            if command == 'GET':
+                # The header carries the generation of the snapshot actually rendered
+                snapshot = state.snapshot()
+                self.wfile.write(f"OK {snapshot[0]}\n".encode())
+                state.render(out, snapshot)
+            elif command == 'CHANGES':
+                snapshot = state.snapshot()
+                self.wfile.write(f"OK {snapshot[0]}\n".encode())
+                state.render_changes(out, int(arg or 0), snapshot)
+            elif command == 'STATUS':
+                status = {
+                    'root': state.root, 'generation': state.generation, 'files': len(state.file_paths),
+                    'watcher': type(state.watcher).__name__,
+                }
+                self.wfile.write(f"OK {state.generation}\n{json.dumps(status)}\n".encode())
+            elif command == 'STOP':
+                self.wfile.write(f"OK {state.generation}\n".encode())
+                self.server.stop.set()
+                threading.Thread(target=self.server.shutdown, daemon=True).start()
+            else:
+                self.wfile.write(f"ERR unknown command {command!r}\n".encode())
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+
+
+class ContextServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+def make_watcher(state):
+    if WATCH_MODE != 'poll' and sys.platform.startswith('linux'):
+        try:
+            return InotifyWatcher(state)
+        except (OSError, AttributeError) as e:
+            print(f"inotify unavailable ({e}), polling every {POLL_INTERVAL}s")
+    return PollingWatcher(state, POLL_INTERVAL)
+
+
+def serve():
+    if prompt_gen.FILE_SOURCE != 'walk' or prompt_gen.TOKEN_BUDGET > 0:
+        print("The daemon serves the full walked tree; unset FILE_SOURCE and TOKEN_BUDGET")
+        sys.exit(1)
+    if os.path.exists(CONTEXT_SOCKET):
+        try:
+            request('STATUS')
+            print(f"A daemon is already serving {CONTEXT_SOCKET}")
+            sys.exit(1)
+        except OSError:
+            os.unlink(CONTEXT_SOCKET)  # stale socket from a daemon that died
+
+    state = ContextState(DIR_PATH)
+    watcher = make_watcher(state)
+    try:
+        state.build(watcher)
+    except OSError as e:
+        if isinstance(watcher, PollingWatcher):
+            raise
+        print(f"Could not watch the tree ({e}), polling every {POLL_INTERVAL}s")
+        watcher.close()
+        state = ContextState(DIR_PATH)
+        watcher = PollingWatcher(state, POLL_INTERVAL)
+        state.build(watcher)
+
+    server = ContextServer(CONTEXT_SOCKET, RequestHandler)
+    server.state = state
+    server.stop = threading.Event()
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    print(f"Serving context for {DIR_PATH} on {CONTEXT_SOCKET} ({type(watcher).__name__})")
+    try:
+        state.watch_forever(server.stop)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.shutdown()
+        server.server_close()
+        watcher.close()
+        if os.path.exists(CONTEXT_SOCKET):
+            os.unlink(CONTEXT_SOCKET)
+
+
+def request(command, sink=None):
+    """
+    Send one command to the daemon. The payload is streamed to sink.write() when
+    given, otherwise returned. Returns (generation, payload bytes or None).
+    """
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.connect(CONTEXT_SOCKET)
+        sock.sendall(command.encode('utf-8') + b'\n')
+        with sock.makefile('rb') as reader:
+            status = reader.readline().decode('utf-8').strip()
+            if not status.startswith('OK '):
+                raise RuntimeError(f"Daemon error: {status}")
+            generation = int(status.split()[1])
+            if sink is None:
+                return generation, reader.read()
+            while True:
+                chunk = reader.read(64 * 1024)
+                if not chunk:
+                    return generation, None
+                sink.write(chunk)
+
+
+def main():
+    command = sys.argv[1] if len(sys.argv) > 1 else ''
+    if command == 'serve':
+        serve()
+    elif command == 'get':
+        output_file = sys.argv[2] if len(sys.argv) > 2 else OUTPUT_FILE
+        tmp_file = output_file + '.tmp'
+        with open(tmp_file, 'wb') as f:
+            generation, _ = request('GET', f)
+        os.replace(tmp_file, output_file)
+        print(f"Generation {generation} saved to: {output_file}")
+    elif command == 'changes' and len(sys.argv) == 3:
+        _, payload = request(f"CHANGES {int(sys.argv[2])}")
+        sys.stdout.write(payload.decode('utf-8', 'replace'))
+    elif command in ('status', 'stop'):
+        _, payload = request(command.upper())
+        print(payload.decode('utf-8').strip() if payload else 'Stopped')
+    else:
+        print("Usage: python context_daemon.py serve | get [output] | changes <generation> | status | stop")
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,248 @@
+import os
+import zlib
+import heapq
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from dataclasses import dataclass, field
+
+from snapshot_manifest import hash_file
+
+# Files smaller than this are always printed; a reference line would not be shorter
+MIN_DEDUP_BYTES = 64
+# Near-duplicate detection: files in this size range, compared with bottom-k MinHash
+# sketches of word shingles; pairs above the estimated Jaccard threshold are collapsed
+NEAR_DUP_MIN_BYTES = 512
+NEAR_DUP_MAX_BYTES = 256 * 1024
+NEAR_DUP_THRESHOLD = 0.9
+SHINGLE_WORDS = 5
+SKETCH_SIZE = 64
+# Sketch values shared by more files than this are boilerplate and ignored when pairing
+MAX_POSTING_FILES = 256
+
+
+@dataclass
+class DedupResult:
+    duplicates: dict = field(default_factory=dict)  # path -> (original path, similarity)
+    collapsed_dirs: list = field(default_factory=list)  # (directory, original directory, file count)
+    collapsed_files: set = field(default_factory=set)
+    digests: dict = field(default_factory=dict)  # path -> content hash, for the files that were hashed
+
+    def reference(self, path):
+        """
+        Reference line replacing the body of a duplicate, or None to print it in full.
+        """
+        match = self.duplicates.get(path)
+        if match is None:
+            return None
+        original, similarity = match
+        if similarity >= 1.0:
+            return f"[Identical to {original}, content omitted]\n"
+        return f"[Near-duplicate of {original} (~{similarity:.0%} similar), content omitted]\n"
+
+
+def sketch_file(path):
+    """
+    Bottom-k MinHash sketch of a file's shingles (runs of SHINGLE_WORDS whitespace-separated words), or None for binary files.
+    """
+    with open(path, 'rb') as f:
+        data = f.read(NEAR_DUP_MAX_BYTES + 1)
+    if b'\0' in data:
+        return None
+    words = data.split()
+    # Words are hashed with crc32 and shingles as tuples of ints, both stable across
+    # runs (unlike hash() of bytes), so the output does not change between runs
+    word_hashes = list(map(zlib.crc32, words)) or [0]
+    shingles = set(map(hash, zip(*(word_hashes[i:] for i in range(min(SHINGLE_WORDS, len(word_hashes)))))))
+    return sorted(heapq.nsmallest(SKETCH_SIZE, shingles))
+
+
+def _safe_sketch(path):
+    try:
+        return sketch_file(path)
+    except OSError:
+        return None
+
+
+def _sketch_all(paths, workers):
+    # Shingling is pure Python, so it runs on processes rather than threads
+    if workers <= 0 or len(paths) < 64:
+        return [_safe_sketch(path) for path in paths]
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        return list(pool.map(_safe_sketch, paths, chunksize=32))
+
+
+def estimate_similarity(a, b):
+    """
+    Estimated Jaccard similarity of two bottom-k sketches.
+    """
+    a, b = set(a), set(b)
+    union = heapq.nsmallest(SKETCH_SIZE, a | b)
+    return sum(1 for value in union if value in a and value in b) / len(union)
+
+
+def find_duplicates(file_paths, near=False, max_bytes=0, workers=0, known_digest=None):
+    """
+    Map later copies of a file to its first occurrence in file_paths.
+
+    Exact copies: files are bucketed by size and only sizes shared by several
+    files are hashed (streamed, on a thread pool; known_digest(path) can supply
+    hashes already known from a previous run). With near=True, remaining text
+    files are also compared with MinHash sketches built on a process pool. Directories whose every file
+    is an exact copy of the same relative path in one other directory are
+    reported as collapsed vendored copies.
+    """
+    result = DedupResult()
+    sizes = {}
+    for path in file_paths:
+        try:
+            sizes[path] = os.stat(path).st_size
+        except OSError:
+            pass
+    by_size = defaultdict(list)
+    for path, size in sizes.items():
+        by_size[size].append(path)
+    to_hash = [path for paths in by_size.values() if len(paths) > 1 for path in paths]
+
+    digests = {}
+    missing = []
+    for path in to_hash:
+        digest = known_digest(path) if known_digest else None
+        if digest is not None:
+            digests[path] = digest
+        else:
+            missing.append(path)
+
+    def safe_hash(path):
+        try:
+            return hash_file(path, max_bytes)
+        except OSError:
+            return None
+
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+        for path, digest in zip(missing, pool.map(safe_hash, missing)):
+            if digest is not None:
+                digests[path] = digest
+
+        exact = group_exact(file_paths, sizes, digests, result, max_bytes)
+
+        if near:
+            candidates = [
+                path for path in file_paths
+                if path not in exact and NEAR_DUP_MIN_BYTES <= sizes.get(path, 0) <= NEAR_DUP_MAX_BYTES
+            ]
+
+            sketches = dict(zip(candidates, _sketch_all(candidates, workers)))
+            _match_near_duplicates(candidates, sketches, result)
+
+    result.digests = digests
+    collapse_directories(file_paths, exact, result, sizes)
+    return result
+
+
+def group_exact(file_paths, sizes, digests, result, max_bytes=0):
+    """
+    Record in result every file whose (size, digest) repeats an earlier one.
+    Returns {copy: original} for all exact copies, including tiny files.
+    Files larger than max_bytes only had a prefix hashed and are never matched.
+    """
+    first_seen = {}
+    exact = {}
+    for path in file_paths:
+        digest = digests.get(path)
+        if digest is None or (max_bytes and sizes[path] > max_bytes):
+            continue
+        key = (sizes[path], digest)
+        if key in first_seen:
+            exact[path] = first_seen[key]
+        else:
+            first_seen[key] = path
+    for path, original in exact.items():
+        if sizes[path] >= MIN_DEDUP_BYTES:
+            result.duplicates[path] = (original, 1.0)
+    return exact
+
+
+def dedup_known(file_paths, sizes, digests, max_bytes=0):
+    """
+    Exact deduplication from sizes and digests already in memory (no file access).
+    """
+    result = DedupResult(digests=digests)
+    exact = group_exact(file_paths, sizes, digests, result, max_bytes)
+    collapse_directories(file_paths, exact, result, sizes)
+    return result
+
+
+def _match_near_duplicates(candidates, sketches, result):
+    order = {path: idx for idx, path in enumerate(candidates)}
+    postings = defaultdict(list)
+    for path in candidates:
+        for value in sketches.get(path) or ():
+            postings[value].append(path)
+
+    for path in candidates:
+        sketch = sketches.get(path)
+        if not sketch:
+            continue
+        shared = defaultdict(int)
+        for value in sketch:
+            earlier = postings[value]
+            if len(earlier) > MAX_POSTING_FILES:
+                continue
+            for other in earlier:
+                if order[other] < order[path]:
+                    shared[other] += 1
+        best = None
+        for other, count in shared.items():
+            if count < SKETCH_SIZE * NEAR_DUP_THRESHOLD / 2 or other in result.duplicates:
+                continue
+            similarity = estimate_similarity(sketch, sketches[other])
+            if similarity >= NEAR_DUP_THRESHOLD and (best is None or similarity > best[1]):
+                best = (other, similarity)
+        if best is not None:
+            result.duplicates[path] = (best[0], min(best[1], 0.99))
+
+
+def collapse_directories(file_paths, exact, result, sizes):
+    if not exact:
+        return
+    # Count files per parent once, then push the counts up through distinct directories
+    per_parent = defaultdict(int)
+    for path in file_paths:
+        per_parent[os.path.dirname(path)] += 1
+    files_under = defaultdict(int)
+    for parent, count in per_parent.items():
+        while parent and parent != os.path.dirname(parent):
+            files_under[parent] += count
+            parent = os.path.dirname(parent)
+
+    # (copy dir, original dir) -> number of files of copy dir that mirror original dir;
+    # tiny files (empty __init__.py and the like) may mirror but do not count as evidence
+    support = defaultdict(int)
+    substantial = defaultdict(int)
+    for path, original in exact.items():
+        if os.path.basename(path) != os.path.basename(original):
+            continue
+        copy_dir, original_dir = os.path.dirname(path), os.path.dirname(original)
+        while copy_dir != original_dir and copy_dir and original_dir:
+            support[(copy_dir, original_dir)] += 1
+            if sizes[path] >= MIN_DEDUP_BYTES:
+                substantial[(copy_dir, original_dir)] += 1
+            if os.path.basename(copy_dir) != os.path.basename(original_dir):
+                break
+            copy_dir, original_dir = os.path.dirname(copy_dir), os.path.dirname(original_dir)
+
+    collapsed = []
+    for (copy_dir, original_dir), count in support.items():
+        inside = original_dir.startswith(copy_dir + os.sep) or copy_dir.startswith(original_dir + os.sep)
+        if count == files_under[copy_dir] and substantial[(copy_dir, original_dir)] > 1 and not inside:
+            collapsed.append((copy_dir, original_dir, count))
+
+    # Keep only the outermost collapsed directories
+    collapsed.sort(key=lambda item: (len(item[0]), item[0]))
+    for copy_dir, original_dir, count in collapsed:
+        if any(copy_dir.startswith(kept + os.sep) or copy_dir == kept for kept, _, _ in result.collapsed_dirs):
+            continue
+        result.collapsed_dirs.append((copy_dir, original_dir, count))
+    for path in file_paths:
+        if any(path.startswith(copy_dir + os.sep) for copy_dir, _, _ in result.collapsed_dirs):
+            result.collapsed_files.add(path)
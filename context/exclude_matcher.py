@@ -0,0 +1,106 @@
+import re
+import fnmatch
+
+WILDCARD_CHARS = '*?['
+
+
+class ExcludeMatcher:
+    """
+    Exclusion matcher compiled once from a list of fnmatch-style patterns.
+
+    Gives the same answers as looping over the patterns with fnmatch, but splits
+    them up front into:
+      - literal names, matched against path components with a set lookup
+      - '*<literal>' suffixes (e.g. '*.pyc'), matched with str.endswith
+      - every other component pattern, folded into one combined regex
+      - full-path patterns, folded into a literal set and one combined regex
+    With match_suffixes=True, literal patterns (trailing '/' stripped) also match
+    any path ending with them, as prompt_gen.py did for '.gitignore' entries.
+    """
+
+    def __init__(self, patterns, match_suffixes=False):
+        self.patterns = list(patterns)
+        component_names = set()
+        component_suffixes = set()
+        component_regexes = []
+        path_literals = set()
+        path_regexes = []
+        path_suffixes = set()
+
+        for pattern in self.patterns:
+            is_literal = not any(c in pattern for c in WILDCARD_CHARS)
+            if is_literal:
+                path_literals.add(pattern)
+            else:
+                path_regexes.append(fnmatch.translate(pattern))
+
+            # Path components never contain '/', so such patterns only match the full path
+            if '/' not in pattern:
+                if is_literal:
+                    component_names.add(pattern)
+                elif pattern.startswith('*') and not any(c in pattern[1:] for c in WILDCARD_CHARS):
+                    component_suffixes.add(pattern[1:])
+                else:
+                    component_regexes.append(fnmatch.translate(pattern))
+
+            if match_suffixes and is_literal:
+                clean_pattern = pattern.rstrip('/')
+                if clean_pattern:
+                    path_suffixes.add(clean_pattern)
+
+        self.component_names = frozenset(component_names)
+        # '*' also matches the empty string, so an empty suffix matches every component
+        self.component_suffixes = tuple(sorted(component_suffixes))
+        self.component_regex = self._combine(component_regexes)
+        self.path_literals = frozenset(path_literals)
+        self.path_regex = self._combine(path_regexes)
+        self.path_suffixes = tuple(sorted(path_suffixes))
+
+    @staticmethod
+    def _combine(regexes):
+        if not regexes:
+            return None
+        return re.compile('|'.join(f'(?:{r})' for r in regexes))
+
+    def match_name(self, name):
+        """
+        Check a single path component against the component rules.
+        """
+        if name in self.component_names:
+            return True
+        if self.component_suffixes and name.endswith(self.component_suffixes):
+            return True
+        if self.component_regex is not None and self.component_regex.match(name):
+            return True
+        return False
+
+    def match_path(self, path):
+        """
+        Check a normalized path against the full-path and suffix rules.
+        """
+        if path in self.path_literals:
+            return True
+        if self.path_regex is not None and self.path_regex.match(path):
+            return True
+        if self.path_suffixes and path.endswith(self.path_suffixes):
+            return True
+        return False
+
+    def __call__(self, path):
+        """
+        Check if a path should be excluded (drop-in for should_exclude).
+        """
+        normalized_path = path.replace('\\', '/')
+        if self.match_path(normalized_path):
+            return True
+        return any(self.match_name(part) for part in normalized_path.split('/'))
+
+    def excludes_child(self, path, name):
+        """
+        Check an entry whose parent directory has already been accepted.
+
+        Every component of the parent passed match_name, so only the new name
+        and the full-path rules need checking. This is what lets get_tree prune
+        an excluded directory without re-testing its ancestors for each child.
+        """
+        return self.match_name(name) or self.match_path(path.replace('\\', '/'))
@@ -0,0 +1,140 @@
+import io
+import os
+import codecs
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Optional
+
+from snapshot_manifest import new_hasher
+from stream_writer import write_file_body
+
+# Bytes sniffed from the start of every file to classify it
+SNIFF_BYTES = 8 * 1024
+# Text files up to this size are read and decoded by the worker pool ahead of the writer
+PREFETCH_BYTES = 64 * 1024
+# Kinds whose content is replaced by a one-line summary
+SKIPPED_KINDS = ('binary', 'minified', 'lockfile')
+
+LOCKFILE_NAMES = {
+    'package-lock.json', 'npm-shrinkwrap.json', 'yarn.lock', 'pnpm-lock.yaml',
+    'poetry.lock', 'Pipfile.lock', 'uv.lock', 'pdm.lock', 'Cargo.lock',
+    'Gemfile.lock', 'composer.lock', 'go.sum', 'flake.lock', 'mix.lock',
+}
+MINIFIED_SUFFIXES = ('.min.js', '.min.css', '.min.mjs', '.js.map', '.css.map')
+# A sniff window this long without a newline, or lines this long on average, means generated code
+MAX_MEAN_LINE_LENGTH = 1000
+MAX_UNBROKEN_LENGTH = 4 * 1024
+# Small files are always kept in full, however long their lines
+MIN_MINIFIED_SIZE = 2 * 1024
+
+
+@dataclass
+class FileInfo:
+    path: str
+    kind: str = 'text'  # 'text', 'binary', 'minified' or 'lockfile'
+    size: int = 0
+    detail: str = ''
+    body: Optional[str] = None  # decoded output for prefetched files
+    digest: Optional[str] = None  # content hash of the prefetched bytes
+
+    def summary(self):
+        label = 'lockfile' if self.kind == 'lockfile' else f"{self.kind} file"
+        detail = f", {self.detail}" if self.detail else ''
+        return f"[Skipped {label}: {self.size} bytes{detail}]\n"
+
+
+def classify_file(path):
+    """
+    Classify a file from its name and its first SNIFF_BYTES bytes:
+    NUL bytes or invalid UTF-8 mean binary; lockfile names and very long
+    lines (or *.min.js style names) mean lockfile / minified content.
+    """
+    with open(path, 'rb') as f:
+        size = os.fstat(f.fileno()).st_size
+        sniff = f.read(SNIFF_BYTES)
+
+    name = os.path.basename(path)
+    if b'\0' in sniff:
+        return FileInfo(path, 'binary', size, 'contains NUL bytes')
+    try:
+        codecs.getincrementaldecoder('utf-8')().decode(sniff, final=len(sniff) == size)
+    except UnicodeDecodeError:
+        return FileInfo(path, 'binary', size, 'not valid UTF-8')
+    if name in LOCKFILE_NAMES:
+        return FileInfo(path, 'lockfile', size)
+    if name.endswith(MINIFIED_SUFFIXES):
+        return FileInfo(path, 'minified', size)
+
+    if size < MIN_MINIFIED_SIZE:
+        return FileInfo(path, 'text', size)
+    lines = sniff.split(b'\n')
+    if len(sniff) < size:
+        lines.pop()  # the last line is cut off by the sniff window
+    if lines:
+        mean = sum(len(line) for line in lines) / len(lines)
+        if mean > MAX_MEAN_LINE_LENGTH:
+            return FileInfo(path, 'minified', size, f"mean line length {mean:.0f}")
+    elif len(sniff) >= MAX_UNBROKEN_LENGTH:
+        return FileInfo(path, 'minified', size, f"no line break in the first {len(sniff)} bytes")
+    return FileInfo(path, 'text', size)
+
+
+def prepare_file(path, max_bytes=0, prefetch_bytes=PREFETCH_BYTES):
+    """
+    Classify a file and, for small text files, decode its output body in advance.
+    """
+    try:
+        info = classify_file(path)
+    except OSError:
+        # Leave it to write_file_body to report the error in the output
+        return FileInfo(path)
+    if info.kind == 'text' and info.size <= prefetch_bytes:
+        buffer = io.StringIO()
+        hasher = new_hasher()
+        write_file_body(buffer, path, max_bytes=max_bytes, hasher=hasher)
+        info.body = buffer.getvalue()
+        info.digest = hasher.hexdigest()
+    return info
+
+
+def iter_prepared(paths, max_bytes=0, workers=0, prefetch_bytes=PREFETCH_BYTES):
+    """
+    Yield a FileInfo for every path, in order. With workers > 0 the reads run on
+    a thread pool so they overlap; at most a few files per worker are in flight,
+    which keeps memory bounded by roughly workers * prefetch_bytes.
+    """
+    if workers <= 0:
+        for path in paths:
+            yield prepare_file(path, max_bytes, prefetch_bytes)
+        return
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        in_flight = deque()
+        remaining = iter(paths)
+        for path in remaining:
+            in_flight.append(pool.submit(prepare_file, path, max_bytes, prefetch_bytes))
+            if len(in_flight) >= workers * 4:
+                break
+        while in_flight:
+            info = in_flight.popleft().result()
+            path = next(remaining, None)
+            if path is not None:
+                in_flight.append(pool.submit(prepare_file, path, max_bytes, prefetch_bytes))
+            yield info
+
+
+def write_prepared(out, info, max_bytes=0):
+    """
+    Write the output body for a prepared file and return its content hash
+    (None for skipped files). Large text files are streamed here.
+    """
+    if info.kind in SKIPPED_KINDS:
+        out.write(info.summary())
+        return None
+    if info.body is not None:
+        out.write(info.body)
+        return info.digest
+    hasher = new_hasher()
+    write_file_body(out, info.path, max_bytes=max_bytes, hasher=hasher)
+    return hasher.hexdigest()
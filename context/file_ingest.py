@@ -0,0 +1,68 @@
+import os
+
+from file_classifier import iter_prepared, write_prepared
+from stream_writer import ByteCountingWriter
+from tree_walker import listings_from_paths, walk_tree
+
+SEPARATOR = '=' * 48
+
+
+class TokenCountingWriter(ByteCountingWriter):
+    """
+    ByteCountingWriter that also tallies the tokens of everything written.
+    """
+
+    def __init__(self, raw, count_tokens, encoding='utf-8'):
+        super().__init__(raw, encoding)
+        self.count_tokens = count_tokens
+        self.tokens = 0
+
+    def write(self, text):
+        self.tokens += self.count_tokens(text)
+        return super().write(text)
+
+
+def tree_for_files(root, file_paths):
+    """
+    Render the directory tree of an explicit list of files under root, without
+    touching the filesystem. Returns (tree text, file paths in tree order).
+    """
+    rel_paths = [os.path.relpath(path, root).replace(os.sep, '/') for path in file_paths]
+    lines, ordered = walk_tree(
+        root,
+        lambda path, name: False,
+        prefix='    ',
+        lister=listings_from_paths(root, rel_paths),
+    )
+    name = os.path.basename(os.path.normpath(root))
+    return '\n'.join(['Directory structure:', f"└── {name}/"] + lines), ordered
+
+
+def summarize_files(root, file_paths):
+    """
+    Summary block for the ingested files, from stat() alone.
+    """
+    total_bytes = 0
+    for path in file_paths:
+        try:
+            total_bytes += os.stat(path).st_size
+        except OSError:
+            pass
+    return (
+        f"Directory: {os.path.basename(os.path.normpath(root))}\n"
+        f"Files analyzed: {len(file_paths)}\n"
+        f"Total size: {total_bytes} bytes"
+    )
+
+
+def write_contents(out, root, file_paths, max_bytes=0, workers=0):
+    """
+    Stream every file to out as a FILE block, in order. Files are classified and
+    read on the worker pool, so memory stays bounded regardless of the match count.
+    """
+    prepared = iter_prepared(file_paths, max_bytes=max_bytes, workers=workers)
+    for path, info in zip(file_paths, prepared):
+        rel_path = os.path.relpath(path, root).replace(os.sep, '/')
+        out.write(f"{SEPARATOR}\nFILE: {rel_path}\n{SEPARATOR}\n")
+        write_prepared(out, info, max_bytes=max_bytes)
+        out.write('\n')
@@ -0,0 +1,30 @@
+import os
+import subprocess
+
+
+def _ls_files(root, *args):
+    output = subprocess.check_output(['git', 'ls-files', '-z', *args], cwd=root)
+    return [os.fsdecode(p) for p in output.split(b'\0') if p]
+
+
+def list_git_files(root, include_untracked=False):
+    """
+    List the files under root straight from the git index, relative to root.
+
+    Tracked files come from the index (submodule gitlinks and files deleted from
+    the working tree are left out); with include_untracked, untracked files that
+    no .gitignore (nested ones and negations included) ignores are added too.
+    Raises subprocess.CalledProcessError if root is not inside a git work tree.
+    """
+    paths = {}
+    for record in _ls_files(root, '--cached', '--stage'):
+        meta, rel_path = record.split('\t', 1)
+        if meta.startswith('160000'):  # submodule
+            continue
+        paths[rel_path] = None
+    for rel_path in _ls_files(root, '--deleted'):
+        paths.pop(rel_path, None)
+    if include_untracked:
+        for rel_path in _ls_files(root, '--others', '--exclude-standard'):
+            paths[rel_path] = None
+    return sorted(paths)
@@ -1,10 +1,54 @@
+import io
 import os
-import fnmatch
+import re
+import sys
+import time
+import subprocess
+from contextlib import nullcontext
 from pathlib import Path
 
+from dedup import find_duplicates
+from exclude_matcher import ExcludeMatcher
+from git_files import list_git_files
+from file_classifier import iter_prepared, write_prepared
+from py_skeleton import SKELETON_CACHE_SUFFIX, SkeletonCache, build_skeletons
+from sharded_output import INDEX_SUFFIX, SHARD_BYTES, ShardedDump, ShardWriter
+from snapshot_manifest import MANIFEST_SUFFIX, SnapshotManifest, stat_key, tree_digest
+from stream_writer import ByteCountingWriter, copy_range
+from token_budget import TOKEN_CACHE_SUFFIX, TokenCountCache, build_candidates, load_tokenizer, pack, rg_hit_counts
+from tree_walker import list_dir, listings_from_paths, walk_tree
+
 # Global configuration: Directory path to print, and the output filename
 DIR_PATH = os.getenv("DIR_PATH", Path(__file__).parent.as_posix()) # Please modify to the target directory
 OUTPUT_FILE = 'output.txt'
+# Threads used to prefetch directory listings during the walk (0 = walk inline)
+WALK_WORKERS = int(os.getenv("WALK_WORKERS", 0))
+# Per-file cap on copied bytes; longer files end with a truncation marker (0 = no cap)
+MAX_FILE_BYTES = int(os.getenv("MAX_FILE_BYTES", 1024 * 1024))
+# Threads that classify and read files ahead of the writer (0 = read inline)
+READ_WORKERS = int(os.getenv("READ_WORKERS", 4))
+# Keep a manifest next to OUTPUT_FILE and only re-read files that changed since the last run
+INCREMENTAL = os.getenv("INCREMENTAL", "1") != "0"
+# Where the file list comes from: 'walk' (filesystem walk), 'git' (tracked files from
+# the git index) or 'git-untracked' (tracked plus untracked files that are not ignored)
+FILE_SOURCE = os.getenv("FILE_SOURCE", "walk")
+# Pack the most relevant files into this many tokens and list the rest as dropped (0 = include everything)
+TOKEN_BUDGET = int(os.getenv("TOKEN_BUDGET", 0))
+# Tokenizer for TOKEN_BUDGET: 'approx', 'tiktoken:<encoding>' or '<module>:<function>'
+TOKENIZER = os.getenv("TOKENIZER", "approx")
+# Optional rg pattern; files with more hits rank higher when packing
+RELEVANCE_QUERY = os.getenv("RELEVANCE_QUERY", "")
+# Duplicate handling: 'exact' prints repeated files once and refers back to them,
+# 'near' also collapses near-identical text files, 'off' prints everything
+DEDUP = os.getenv("DEDUP", "exact")
+# Print Python files as skeletons: imports, signatures, class layouts and docstrings only
+SKELETON = os.getenv("SKELETON", "0") != "0"
+# Output layout: 'text' writes OUTPUT_FILE; 'jsonl' and 'records' write shards of about
+# SHARD_BYTES each next to an offset index, <OUTPUT_FILE stem>.index.json (see sharded_output.py)
+OUTPUT_FORMAT = os.getenv("OUTPUT_FORMAT", "text")
+SHARD_BYTES = int(os.getenv("SHARD_BYTES", SHARD_BYTES))
+# Per-record compression of sharded output: 'zlib' or 'none'
+SHARD_COMPRESSION = os.getenv("SHARD_COMPRESSION", "none")
 
 def load_gitignore_patterns(root_dir):
     """
@@ -30,75 +74,121 @@ AGENT_EXCLUDE_LIST = [
     # '*.extra'
 ]
 
-# Combine gitignore patterns with agent exclusions
-EXCLUDE_LIST = load_gitignore_patterns(DIR_PATH) + AGENT_EXCLUDE_LIST
+# Combine gitignore patterns with agent exclusions. When the file list comes from
+# git, git itself has applied every .gitignore, so only the agent exclusions remain
+if FILE_SOURCE == 'walk':
+    EXCLUDE_LIST = load_gitignore_patterns(DIR_PATH) + AGENT_EXCLUDE_LIST
+else:
+    EXCLUDE_LIST = list(AGENT_EXCLUDE_LIST)
+
+# Compiled once; get_tree consults it for every directory entry
+EXCLUDE_MATCHER = ExcludeMatcher(EXCLUDE_LIST, match_suffixes=True)
+
+# Everything a run writes: OUTPUT_FILE with its sidecars (.tmp, manifest, token and
+# skeleton caches), and for sharded output the index and shards next to it. These are
+# never part of the tree, otherwise every run would see the previous one as a change
+OUTPUT_PATH = os.path.abspath(OUTPUT_FILE)
+OUTPUT_STEM = os.path.basename(os.path.splitext(OUTPUT_PATH)[0])
+OUTPUT_NAME_RE = re.compile(
+    re.escape(os.path.basename(OUTPUT_PATH)) + r'(\..*)?$'
+    + '|' + re.escape(OUTPUT_STEM) + r'(-\d{5}\.(jsonl|rec)|' + re.escape(INDEX_SUFFIX) + r')(\.tmp)?$'
+)
+
+def is_output_file(path, name):
+    """
+    True for a file this script writes. Only the name is matched until it looks
+    like an output file, so the walk pays for abspath on those entries alone.
+    """
+    return (
+        name.startswith(OUTPUT_STEM) and OUTPUT_NAME_RE.match(name) is not None
+        and os.path.dirname(os.path.abspath(path)) == os.path.dirname(OUTPUT_PATH)
+    )
+
+def excludes_child(path, name):
+    return EXCLUDE_MATCHER.excludes_child(path, name) or is_output_file(path, name)
 
 def should_exclude(path):
     """
     Check if a path should be excluded.
     """
-    # Normalize the path (using forward slashes)
-    normalized_path = path.replace('\\', '/')
-    
-    for exclude_pattern in EXCLUDE_LIST:
-        # Exact match
-        if normalized_path == exclude_pattern:
-            return True
-        
-        # Wildcard match
-        if fnmatch.fnmatch(normalized_path, exclude_pattern):
-            return True
-        
-        # Check if the path contains a directory name to be excluded
-        path_parts = normalized_path.split('/')
-        for part in path_parts:
-            if fnmatch.fnmatch(part, exclude_pattern):
-                return True
-
-    # Additional check for relative patterns without wildcards (e.g., 'FusionTree/wandb')
-    for exclude_pattern in EXCLUDE_LIST:
-        clean_pattern = exclude_pattern.rstrip('/')
-        if clean_pattern and not any(c in clean_pattern for c in '*?['):
-            if normalized_path.endswith(clean_pattern) or normalized_path.endswith('/' + clean_pattern):
-                return True
-    
-    return False
+    return EXCLUDE_MATCHER(path) or is_output_file(path, os.path.basename(path))
 
 def get_tree(root, prefix=''):
     """
     Returns each line of the directory tree and a list of all file paths.
     Automatically skips files and directories specified in EXCLUDE_LIST.
     """
-    entries = sorted(os.listdir(root))
-    lines = []
-    files = []
-    
-    # Filter out excluded files and directories
-    filtered_entries = []
-    for name in entries:
-        path = os.path.join(root, name)
-        if not should_exclude(path):
-            filtered_entries.append(name)
-        else:
-            print(f"Skipping excluded path: {path}")
-    
-    for idx, name in enumerate(filtered_entries):
-        path = os.path.join(root, name)
-        is_last = (idx == len(filtered_entries) - 1)
-        branch = '└── ' if is_last else '├── '
-        lines.append(prefix + branch + name)
-        
-        if os.path.isdir(path):
-            extension = '    ' if is_last else '│   '
-            child_lines, child_files = get_tree(path, prefix + extension)
-            lines.extend(child_lines)
-            files.extend(child_files)
-        else:
-            # Double-check if the file should be excluded (as a safeguard)
-            if not should_exclude(path):
-                files.append(path)
-    
-    return lines, files
+    # The root's own components are checked once; below it every ancestor has
+    # already been accepted, so only the new name and full-path rules are tested
+    root_excluded = not prefix and any(
+        EXCLUDE_MATCHER.match_name(part) for part in root.replace('\\', '/').split('/')
+    )
+    lister = list_dir
+    if FILE_SOURCE != 'walk':
+        try:
+            rel_paths = list_git_files(root, include_untracked=FILE_SOURCE == 'git-untracked')
+            lister = listings_from_paths(root, rel_paths)
+        except (OSError, subprocess.CalledProcessError) as e:
+            print(f"Could not list files from git ({e}), falling back to a filesystem walk")
+    return walk_tree(
+        root,
+        excludes_child,
+        root_excluded=root_excluded,
+        prefix=prefix,
+        workers=WALK_WORKERS if lister is list_dir else 0,
+        on_skip=lambda path: print(f"Skipping excluded path: {path}"),
+        lister=lister,
+    )
+
+def pack_to_budget(tree_lines, file_paths):
+    """
+    Keep the most relevant files whose bodies fit in TOKEN_BUDGET tokens (after the tree).
+    Returns (kept file paths, dropped candidates, tokens used).
+    """
+    tokenizer_name, count_tokens = load_tokenizer(TOKENIZER)
+    cache = TokenCountCache(OUTPUT_FILE + TOKEN_CACHE_SUFFIX, tokenizer_name)
+    hits = rg_hit_counts(DIR_PATH, RELEVANCE_QUERY) if RELEVANCE_QUERY else {}
+    overhead = count_tokens(section_header(1, 1, DIR_PATH))
+    candidates = build_candidates(
+        DIR_PATH, file_paths, count_tokens, cache,
+        max_bytes=MAX_FILE_BYTES, hits=hits, overhead=overhead,
+    )
+    cache.save()
+    tree_tokens = count_tokens('\n'.join(tree_lines))
+    kept, dropped, used = pack(candidates, TOKEN_BUDGET - tree_tokens)
+    return kept, dropped, used + tree_tokens
+
+def write_header(out, tree_lines, file_paths, dedup=None, dropped=(), used_tokens=0):
+    """
+    Write everything before the first file section: header, exclusion rules and tree.
+    """
+    out.write(f"Directory structure: {DIR_PATH}\n")
+    if os.name != 'nt':
+        date_cmd = os.popen('date').read().strip()
+    else:
+        date_cmd = 'N/A'
+    out.write(f"Generated at: {date_cmd}\n")
+    out.write(f"Number of files included: {len(file_paths)}\n")
+    if dedup is not None and dedup.collapsed_dirs:
+        out.write("Collapsed directory copies:\n")
+        for copy_dir, original_dir, count in dedup.collapsed_dirs:
+            out.write(f"  - {copy_dir}: {count} files, each identical to the same path under {original_dir}\n")
+    if TOKEN_BUDGET > 0:
+        out.write(f"Token budget: {TOKEN_BUDGET} ({TOKENIZER} tokenizer), used: {used_tokens}\n")
+        out.write(f"Dropped files ({len(dropped)}):\n")
+        for candidate in dropped:
+            out.write(f"  - {candidate.path} ({candidate.tokens} tokens)\n")
+    out.write("Exclusion rules:\n")
+    for rule in EXCLUDE_LIST:
+        out.write(f"  - {rule}\n")
+    out.write("\n" + "=" * 80 + "\n")
+
+    # Write the directory tree
+    for line in tree_lines:
+        out.write(line + '\n')
+
+def section_header(idx, total, path):
+    return '\n' + '=' * 80 + '\n' + f"File {idx}/{total}: {path}\n" + '-' * 80 + '\n'
 
 def main():
     print(f"Starting to scan directory: {DIR_PATH}")
@@ -110,42 +200,120 @@ def main():
     tree_lines, file_paths = get_tree(DIR_PATH)
 
     print(f"\nScan complete! Found {len(file_paths)} files")
-    print(f"Writing to: {OUTPUT_FILE}")
-
-    with open(OUTPUT_FILE, 'w', encoding='utf-8') as out:
-        # Write header information
-        out.write(f"Directory structure: {DIR_PATH}\n")
-        if os.name != 'nt':
-            date_cmd = os.popen('date').read().strip()
-        else:
-            date_cmd = 'N/A'
-        out.write(f"Generated at: {date_cmd}\n")
-        out.write(f"Number of files included: {len(file_paths)}\n")
-        out.write("Exclusion rules:\n")
-        for rule in EXCLUDE_LIST:
-            out.write(f"  - {rule}\n")
-        out.write("\n" + "=" * 80 + "\n")
-        
-        # Write the directory tree
-        for line in tree_lines:
-            out.write(line + '\n')
-
-        # Write the file contents
-        out.write("\nStarting to print all file contents...\n")
-        for idx, path in enumerate(file_paths, 1):
-            out.write('\n' + '=' * 80 + '\n')
-            out.write(f"File {idx}/{len(file_paths)}: {path}\n")
-            out.write('-' * 80 + '\n')
-            try:
-                with open(path, 'r', encoding='utf-8') as f:
-                    content = f.read()
-                    out.write(content)
-                    if not content.endswith('\n'):
-                        out.write('\n')
-            except Exception as e:
-                out.write(f"[Could not read this file: {e}]\n")
-
-    print(f"Done! Output saved to: {OUTPUT_FILE}")
+    dropped = []
+    used_tokens = 0
+    if TOKEN_BUDGET > 0:
+        file_paths, dropped, used_tokens = pack_to_budget(tree_lines, file_paths)
+        print(f"Packed {len(file_paths)} files into {used_tokens}/{TOKEN_BUDGET} tokens, dropped {len(dropped)}")
+
+    # Reuse the previous run's output for every file whose size/mtime still match
+    config = {
+        'dir_path': DIR_PATH, 'exclude_list': EXCLUDE_LIST, 'max_file_bytes': MAX_FILE_BYTES,
+        'token_budget': TOKEN_BUDGET, 'tokenizer': TOKENIZER, 'relevance_query': RELEVANCE_QUERY,
+        'dedup': DEDUP, 'skeleton': SKELETON and f"{sys.version_info[0]}.{sys.version_info[1]}",
+        'output_format': OUTPUT_FORMAT, 'shard_compression': SHARD_COMPRESSION,
+    }
+    # For sharded output the manifest describes the index, and reused bodies are read from the old shards
+    output_path = OUTPUT_FILE if OUTPUT_FORMAT == 'text' else os.path.splitext(OUTPUT_FILE)[0] + INDEX_SUFFIX
+    manifest_path = OUTPUT_FILE + MANIFEST_SUFFIX
+    previous = SnapshotManifest.load(manifest_path, config, output_path) if INCREMENTAL else None
+    keys = {path: stat_key(path) for path in file_paths}
+    dedup = None
+    if DEDUP != 'off':
+        # Hashes recorded by the previous run stand in for unchanged files
+        dedup = find_duplicates(
+            file_paths, near=DEDUP == 'near', max_bytes=MAX_FILE_BYTES, workers=READ_WORKERS,
+            known_digest=(lambda path: previous.known_digest(path, keys[path])) if previous else None,
+        )
+        file_paths = [path for path in file_paths if path not in dedup.collapsed_files]
+        print(f"Found {len(dedup.duplicates)} duplicate files, collapsed {len(dedup.collapsed_dirs)} copied directories")
+    print(f"Writing to: {output_path}")
+    tree_hash = tree_digest(tree_lines)
+    if previous is not None and previous.is_up_to_date(tree_hash, file_paths, keys):
+        # The output is left untouched, so its "Generated at" line still names the run that wrote it
+        written = time.ctime(previous.written_at_ns / 1e9) if previous.written_at_ns else "an earlier run"
+        print(f"No changes since the last run, {output_path} is up to date (generated at {written})")
+        return
+
+    manifest = SnapshotManifest(config, tree_hash)
+    manifest.written_at_ns = time.time_ns()
+    references = {path: dedup.reference(path) for path in file_paths} if dedup else {}
+    spans = {
+        path: previous.reusable(path, keys[path], MAX_FILE_BYTES)
+        for path in file_paths if references.get(path) is None
+    } if previous else {}
+    reused = sum(span is not None for span in spans.values())
+    to_read = [path for path in file_paths if spans.get(path) is None and references.get(path) is None]
+    skeletons = {}
+    if SKELETON:
+        # Parsed on a process pool; files seen before come from the cache
+        skeleton_cache = SkeletonCache(OUTPUT_FILE + SKELETON_CACHE_SUFFIX)
+        skeletons = build_skeletons(to_read, max_bytes=MAX_FILE_BYTES, workers=READ_WORKERS, cache=skeleton_cache)
+        # Bodies copied from the previous output keep their skeletons for when that output is gone
+        skeleton_cache.save(keep=(previous.files[path][2] for path, span in spans.items() if span is not None))
+    # Classify and read the remaining files on a worker pool, ahead of the writer
+    prepared = iter_prepared(
+        [path for path in to_read if path not in skeletons],
+        max_bytes=MAX_FILE_BYTES,
+        workers=READ_WORKERS,
+    )
+
+    def write_body(out, path, copy_span):
+        """
+        Write the body of one file and return (content hash, reusable by a later run).
+        """
+        reference = references.get(path)
+        if reference is not None:
+            # The reference depends on another file, so this body is never reused
+            out.write(reference)
+            return dedup.digests.get(path), False
+        span = spans.get(path)
+        if span is not None:
+            copy_span(out, path, span)
+            return previous.files[path][2], True
+        if path in skeletons:
+            body, digest = skeletons[path]
+            out.write(body)
+            return digest, True
+        return write_prepared(out, next(prepared), max_bytes=MAX_FILE_BYTES), True
+
+    if OUTPUT_FORMAT == 'text':
+        tmp_file = OUTPUT_FILE + '.tmp'
+        with open(tmp_file, 'wb') as raw, (open(OUTPUT_FILE, 'rb') if previous else nullcontext()) as old:
+            out = ByteCountingWriter(raw)
+            write_header(out, tree_lines, file_paths, dedup=dedup, dropped=dropped, used_tokens=used_tokens)
+
+            # Write the file contents
+            out.write("\nStarting to print all file contents...\n")
+            for idx, path in enumerate(file_paths, 1):
+                out.write(section_header(idx, len(file_paths), path))
+                offset = out.tell()
+                digest, reusable = write_body(out, path, lambda out, path, span: copy_range(old, out, *span))
+                manifest.add(path, keys[path], digest, offset, out.tell() - offset, reusable=reusable)
+
+        os.replace(tmp_file, OUTPUT_FILE)
+    else:
+        writer = ShardWriter(
+            os.path.splitext(OUTPUT_FILE)[0], OUTPUT_FORMAT, shard_bytes=SHARD_BYTES,
+            compression=None if SHARD_COMPRESSION == 'none' else SHARD_COMPRESSION,
+        )
+        with (ShardedDump(output_path) if previous else nullcontext()) as old:
+            header = io.StringIO()
+            write_header(header, tree_lines, file_paths, dedup=dedup, dropped=dropped, used_tokens=used_tokens)
+            writer.write_header(header.getvalue())
+            for path in file_paths:
+                # Bodies are bounded by MAX_FILE_BYTES, so each is built in memory and stored as one record
+                body = io.StringIO()
+                digest, reusable = write_body(body, path, lambda out, path, span: out.write(old.read(path)))
+                _, offset, length, _ = writer.add(path, body.getvalue())
+                manifest.add(path, keys[path], digest, offset, length, reusable=reusable)
+            writer.close(output_path, DIR_PATH)
+
+    if INCREMENTAL:
+        manifest.save(manifest_path, output_path)
+        rewritten = len(file_paths) - reused - sum(ref is not None for ref in references.values())
+        print(f"Reused {reused} unchanged files, re-read {rewritten}")
+    print(f"Done! Output saved to: {output_path}")
 
 if __name__ == '__main__':
     main()
\ No newline at end of file
@@ -0,0 +1,337 @@
+import os
+import ast
+import sys
+import json
+from concurrent.futures import ProcessPoolExecutor
+
+from snapshot_manifest import new_hasher
+
+SKELETON_CACHE_SUFFIX = '.skeleton.json'
+SKELETON_SUFFIXES = ('.py', '.pyi')
+# Bump when the skeleton format changes so cached skeletons are rebuilt
+SKELETON_VERSION = 1
+# Larger files are printed as usual instead of being parsed
+MAX_SKELETON_SOURCE_BYTES = 8 * 1024 * 1024
+# Source bytes handed to the parser processes at a time
+SKELETON_BATCH_BYTES = 16 * 1024 * 1024
+# Module-level assignments whose source is longer than this keep only their target
+MAX_ASSIGNMENT_LENGTH = 120
+
+
+def _docstring(node):
+    body = getattr(node, 'body', None)
+    if body and isinstance(body[0], ast.Expr) and isinstance(body[0].value, ast.Constant) \
+            and isinstance(body[0].value.value, str):
+        return body[0]
+    return None
+
+
+def _start_line(node):
+    # A decorated def's lineno is the `def` line; its source starts at the first decorator
+    return min([d.lineno for d in getattr(node, 'decorator_list', ())] + [node.lineno])
+
+
+class _Skeleton:
+    """
+    Emits the kept parts of a module as slices of its original source lines, so
+    signatures keep their formatting and no ast.unparse pass is needed.
+    Column offsets from ast are UTF-8 byte offsets, so lines are kept as bytes.
+    """
+
+    def __init__(self, data):
+        self.lines = data.splitlines(keepends=True)
+        self.out = []
+
+    def emit_lines(self, first, last):
+        # 1-based, inclusive
+        self.out.extend(self.lines[first - 1:last])
+
+    def emit_elided(self, indent):
+        self.out.append(b' ' * indent + b'...\n')
+
+    def header(self, node):
+        """
+        Emit decorators and the def/class line(s), up to where the body starts.
+        """
+        first = node.body[0]
+        if self.inline(first):
+            # The body shares a line with the signature, as in `def f(): return 1`
+            line = self.lines[first.lineno - 1]
+            self.emit_lines(_start_line(node), first.lineno - 1)
+            self.out.append(line[:first.col_offset].rstrip() + b' ...\n')
+            return False
+        self.emit_lines(_start_line(node), _start_line(first) - 1)
+        return True
+
+    def inline(self, statement):
+        """
+        True if statement starts on the same line as its block header (`if x: y`).
+        """
+        return bool(self.lines[statement.lineno - 1][:statement.col_offset].strip())
+
+    def docstring(self, node):
+        docstring = _docstring(node)
+        if docstring is not None:
+            self.emit_lines(docstring.lineno, docstring.end_lineno)
+        return docstring
+
+    def function(self, node):
+        if self.header(node):
+            self.docstring(node)
+            self.emit_elided(node.body[0].col_offset)
+
+    def klass(self, node):
+        if not self.header(node):
+            return
+        docstring = self.docstring(node)
+        body = node.body[1:] if docstring is not None else node.body
+        if not self.body(body, in_class=True):
+            self.emit_elided(node.body[0].col_offset)
+
+    def assignment(self, node):
+        length = sum(len(line) for line in self.lines[node.lineno - 1:node.end_lineno])
+        target = node.annotation if isinstance(node, ast.AnnAssign) else node.targets[-1]
+        if node.value is None or length <= MAX_ASSIGNMENT_LENGTH or target.end_lineno != node.lineno:
+            self.emit_lines(node.lineno, node.end_lineno)
+            return
+        # Long values (tables, literals) keep only their target
+        line = self.lines[node.lineno - 1]
+        self.out.append(line[:target.end_col_offset] + b' = ...\n')
+
+    def block(self, node, header_end):
+        """
+        Emit an if/try header line(s) and recurse into its body.
+        """
+        self.emit_lines(node.lineno, header_end)
+        if not self.body(node.body, in_class=False):
+            self.emit_pass(node.body[0].col_offset)
+
+    def emit_pass(self, indent):
+        self.out.append(b' ' * indent + b'pass\n')
+
+    def orelse(self, node):
+        if not node.orelse:
+            return
+        first = node.orelse[0]
+        indent = node.col_offset
+        if isinstance(node, ast.If) and isinstance(first, ast.If) \
+                and self.lines[first.lineno - 1].lstrip().startswith(b'elif'):
+            self.conditional(first)
+            return
+        self.out.append(b' ' * indent + b'else:\n')
+        if not self.body(node.orelse, in_class=False):
+            self.emit_pass(first.col_offset)
+
+    def conditional(self, node):
+        if self.inline(node.body[0]) or node.orelse and self.inline(node.orelse[0]):
+            self.emit_lines(node.lineno, node.end_lineno)
+            return
+        self.block(node, _start_line(node.body[0]) - 1)
+        self.orelse(node)
+
+    def try_block(self, node):
+        bodies = [node.body] + [handler.body for handler in node.handlers] + [node.orelse]
+        if any(body and self.inline(body[0]) for body in bodies):
+            self.emit_lines(node.lineno, node.end_lineno)
+            return
+        self.block(node, _start_line(node.body[0]) - 1)
+        for handler in node.handlers:
+            self.emit_lines(handler.lineno, _start_line(handler.body[0]) - 1)
+            if not self.body(handler.body, in_class=False):
+                self.emit_pass(handler.body[0].col_offset)
+        self.orelse(node)
+        if not node.handlers:
+            # try/finally: the finally clause is elided but must stay for the block to parse
+            self.out.append(b' ' * node.col_offset + b'finally:\n')
+            self.emit_pass(node.finalbody[0].col_offset)
+
+    def keeps(self, node, in_class):
+        """
+        True if a statement contributes anything to the skeleton.
+        """
+        if isinstance(node, (ast.Import, ast.ImportFrom, ast.FunctionDef, ast.AsyncFunctionDef,
+                             ast.ClassDef, ast.Assign, ast.AnnAssign)):
+            return True
+        if in_class:
+            return False
+        if isinstance(node, ast.If):
+            if ast.dump(node.test) in MAIN_GUARDS:
+                return False
+            return any(self.keeps(child, False) for child in node.body + node.orelse)
+        if isinstance(node, ast.Try):
+            return any(self.keeps(child, False) for child in node.body)
+        return False
+
+    def body(self, statements, in_class):
+        """
+        Emit the kept statements of a block; returns False if nothing was kept.
+        """
+        kept = False
+        for node in statements:
+            if not self.keeps(node, in_class):
+                continue
+            kept = True
+            if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)) and node.col_offset == 0:
+                self.out.append(b'\n')
+            if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef)):
+                self.function(node)
+            elif isinstance(node, ast.ClassDef):
+                self.klass(node)
+            elif isinstance(node, (ast.Assign, ast.AnnAssign)):
+                self.assignment(node)
+            elif isinstance(node, ast.If):
+                self.conditional(node)
+            elif isinstance(node, ast.Try):
+                self.try_block(node)
+            else:
+                self.emit_lines(node.lineno, node.end_lineno)
+        return kept
+
+
+MAIN_GUARDS = {
+    ast.dump(ast.parse(guard, mode='eval').body)
+    for guard in ("__name__ == '__main__'", "'__main__' == __name__")
+}
+
+
+def skeletonize(data):
+    """
+    Reduce Python source (bytes) to its imports, module-level assignments, class
+    layouts, def signatures (with decorators) and docstrings, taken verbatim from
+    the source; function bodies become `...`. Returns None if it does not parse.
+    """
+    try:
+        tree = ast.parse(data)
+        skeleton = _Skeleton(data)
+        docstring = skeleton.docstring(tree)
+        skeleton.body(tree.body[1:] if docstring is not None else tree.body, in_class=False)
+    except (SyntaxError, ValueError, RecursionError, MemoryError):
+        # The parser can raise MemoryError on some invalid input; deep nesting hits the recursion limit
+        return None
+    text = b''.join(skeleton.out).decode('utf-8')
+    # Same newline translation as a text-mode read
+    return text.replace('\r\n', '\n').replace('\r', '\n')
+
+
+def render_skeleton(data):
+    """
+    Output body for the raw bytes of a Python file, or None to print it in full.
+    """
+    try:
+        data.decode('utf-8')
+    except UnicodeDecodeError:
+        return None
+    skeleton = skeletonize(data)
+    if skeleton is None:
+        return None
+    return f"[Python skeleton: {len(skeleton.encode('utf-8'))} of {len(data)} bytes, bodies elided]\n{skeleton}"
+
+
+def is_skeleton_candidate(path):
+    return path.endswith(SKELETON_SUFFIXES)
+
+
+class SkeletonCache:
+    """
+    Rendered skeletons keyed by content hash, persisted as JSON next to the output.
+    Keys include the Python version, since ast positions and grammar differ between versions.
+    save() keeps only the skeletons of files looked up this run (and of digests passed as keep).
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.prefix = f"{SKELETON_VERSION}:{sys.version_info[0]}.{sys.version_info[1]}:"
+        self.entries = {}
+        self.seen = set()
+        self.dirty = False
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                self.entries = json.load(f)
+        except (OSError, ValueError):
+            pass
+
+    def get(self, digest):
+        self.seen.add(self.prefix + digest)
+        return self.entries.get(self.prefix + digest)
+
+    def put(self, digest, skeleton):
+        self.seen.add(self.prefix + digest)
+        self.entries[self.prefix + digest] = skeleton
+        self.dirty = True
+
+    def prune(self, keep=()):
+        live = self.seen | {self.prefix + digest for digest in keep if digest is not None}
+        for key in [key for key in self.entries if key not in live]:
+            del self.entries[key]
+            self.dirty = True
+
+    def save(self, keep=()):
+        self.prune(keep)
+        if not self.dirty:
+            return
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(self.entries, f, separators=(',', ':'))
+        os.replace(tmp_path, self.path)
+
+
+def build_skeletons(paths, max_bytes=0, workers=0, cache=None):
+    """
+    Return {path: (body, digest)} for every Python file in paths that parses.
+    Each file is read once here; cache misses are parsed on a process pool in
+    batches of at most SKELETON_BATCH_BYTES of source, which bounds memory.
+    Files larger than max_bytes (or MAX_SKELETON_SOURCE_BYTES) are left to be
+    printed, truncated, as usual, so digest is the hash of the whole file, like
+    snapshot_manifest.hash_file. A cached '' records a file that did not parse.
+    """
+    limit = min(max_bytes, MAX_SKELETON_SOURCE_BYTES) if max_bytes > 0 else MAX_SKELETON_SOURCE_BYTES
+    results = {}
+    batch = []
+    batch_bytes = 0
+    pool = ProcessPoolExecutor(max_workers=workers) if workers > 0 else None
+
+    def flush():
+        sources = [data for _, data, _ in batch]
+        if pool is not None and len(sources) > 1:
+            bodies = pool.map(render_skeleton, sources, chunksize=max(1, len(sources) // (workers * 4)))
+        else:
+            bodies = map(render_skeleton, sources)
+        for (path, _, digest), body in zip(batch, bodies):
+            if cache is not None:
+                cache.put(digest, body or '')
+            if body is not None:
+                results[path] = (body, digest)
+        batch.clear()
+
+    try:
+        for path in paths:
+            if not is_skeleton_candidate(path):
+                continue
+            try:
+                with open(path, 'rb') as f:
+                    if os.fstat(f.fileno()).st_size > limit:
+                        continue
+                    # Bounded again in case the file grew since the fstat
+                    data = f.read(limit + 1)
+            except OSError:
+                continue
+            if len(data) > limit:
+                continue
+            hasher = new_hasher()
+            hasher.update(data)
+            digest = hasher.hexdigest()
+            cached = cache.get(digest) if cache is not None else None
+            if cached is not None:
+                if cached:
+                    results[path] = (cached, digest)
+                continue
+            batch.append((path, data, digest))
+            batch_bytes += len(data)
+            if batch_bytes >= SKELETON_BATCH_BYTES:
+                flush()
+                batch_bytes = 0
+        flush()
+    finally:
+        if pool is not None:
+            pool.shutdown()
+    return results
@@ -0,0 +1,243 @@
+import os
+import sys
+import glob
+import json
+import mmap
+import zlib
+import base64
+import struct
+from bisect import bisect_left
+
+from snapshot_manifest import new_hasher
+
+INDEX_SUFFIX = '.index.json'
+INDEX_VERSION = 1
+# Output formats: one JSON object per line, or length-prefixed binary records
+SHARD_EXTENSIONS = {'jsonl': '.jsonl', 'records': '.rec'}
+# A new shard is started once the current one reaches this many bytes
+SHARD_BYTES = 64 * 1024 * 1024
+COMPRESSION_LEVEL = 6
+# 'records' format: path length and body length, followed by the path and the body
+RECORD_HEADER = struct.Struct('<II')
+
+
+def shard_name(base, number, output_format):
+    return f"{base}-{number:05d}{SHARD_EXTENSIONS[output_format]}"
+
+
+class ShardWriter:
+    """
+    Writes file bodies as records into numbered shards next to an offset index
+    (path -> shard, offset, length, content hash), so consumers can memory-map a
+    shard and slice one file out without scanning the dump.
+
+    With compression='zlib' every record of a shard is deflated on its own, which
+    keeps random access O(1); the setting is recorded per shard in the index.
+    Shards are written under .tmp names and swapped in by close(), index last.
+    """
+
+    def __init__(self, base, output_format='jsonl', shard_bytes=SHARD_BYTES, compression=None):
+        if output_format not in SHARD_EXTENSIONS:
+            raise ValueError(f"Unknown output format {output_format!r}, expected one of {', '.join(SHARD_EXTENSIONS)}")
+        if compression not in (None, 'zlib'):
+            raise ValueError(f"Unknown compression {compression!r}, expected 'zlib' or none")
+        self.base = base
+        self.format = output_format
+        self.shard_bytes = shard_bytes
+        self.compression = compression
+        self.shards = []
+        self.files = {}
+        self.header = None
+        self.current = None
+
+    def _shard(self):
+        if self.current is None or self.shards[-1]['bytes'] >= self.shard_bytes:
+            if self.current is not None:
+                self.current.close()
+            name = shard_name(self.base, len(self.shards), self.format)
+            self.current = open(name + '.tmp', 'wb')
+            self.shards.append({'name': os.path.basename(name), 'compression': self.compression, 'bytes': 0, 'records': 0})
+        return len(self.shards) - 1, self.shards[-1]
+
+    def _record(self, path, data, digest):
+        """
+        Encode one record; returns (record bytes, start and length of the indexed part).
+        """
+        if self.compression == 'zlib':
+            data = zlib.compress(data, COMPRESSION_LEVEL)
+        if self.format == 'records':
+            path_bytes = path.encode('utf-8', 'surrogateescape')
+            start = RECORD_HEADER.size + len(path_bytes)
+            return RECORD_HEADER.pack(len(path_bytes), len(data)) + path_bytes + data, start, len(data)
+        record = {'path': path, 'hash': digest}
+        if self.compression == 'zlib':
+            record['zlib'] = base64.b64encode(data).decode('ascii')
+        else:
+            record['body'] = data.decode('utf-8')
+        line = json.dumps(record, ensure_ascii=False).encode('utf-8', 'surrogateescape')
+        return line + b'\n', 0, len(line)
+
+    def _write(self, path, text):
+        data = text.encode('utf-8')
+        hasher = new_hasher()
+        hasher.update(data)
+        digest = hasher.hexdigest()
+        number, shard = self._shard()
+        record, start, length = self._record(path, data, digest)
+        self.current.write(record)
+        entry = [number, shard['bytes'] + start, length, digest]
+        shard['bytes'] += len(record)
+        shard['records'] += 1
+        return entry
+
+    def write_header(self, text):
+        """
+        Store the dump header (settings and directory tree) as the first record.
+        """
+        self.header = self._write('', text)
+
+    def add(self, path, text):
+        """
+        Append the body of path; returns its index entry [shard, offset, length, hash].
+        """
+        entry = self._write(path, text)
+        self.files[path] = entry
+        return entry
+
+    def close(self, index_path, root):
+        if self.current is not None:
+            self.current.close()
+            self.current = None
+        names = set()
+        for shard in self.shards:
+            name = os.path.join(os.path.dirname(self.base), shard['name'])
+            os.replace(name + '.tmp', name)
+            names.add(name)
+        # Shards left over from a larger previous dump
+        for extension in SHARD_EXTENSIONS.values():
+            for name in glob.glob(f"{glob.escape(self.base)}-[0-9][0-9][0-9][0-9][0-9]{extension}"):
+                if name not in names:
+                    os.remove(name)
+        data = {
+            'version': INDEX_VERSION,
+            'format': self.format,
+            'root': root,
+            'shards': self.shards,
+            'header': self.header,
+            'files': self.files,
+        }
+        tmp_path = index_path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(data, f, separators=(',', ':'))
+        os.replace(tmp_path, index_path)
+
+
+class ShardedDump:
+    """
+    Read side of ShardWriter: loads the index and memory-maps shards on first use,
+    so reading one file touches only its own bytes.
+    """
+
+    def __init__(self, index_path):
+        with open(index_path, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+        if data.get('version') != INDEX_VERSION:
+            raise ValueError(f"{index_path}: unsupported index version {data.get('version')}")
+        self.directory = os.path.dirname(index_path)
+        self.format = data['format']
+        self.root = data['root']
+        self.shards = data['shards']
+        self.files = data['files']
+        self.header_entry = data['header']
+        self.maps = {}
+        self.sorted_paths = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        for mapped in self.maps.values():
+            mapped.close()
+        self.maps.clear()
+
+    def _map(self, number):
+        mapped = self.maps.get(number)
+        if mapped is None:
+            with open(os.path.join(self.directory, self.shards[number]['name']), 'rb') as f:
+                mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            self.maps[number] = mapped
+        return mapped
+
+    def _read(self, entry, verify=False):
+        number, offset, length, digest = entry
+        data = self._map(number)[offset:offset + length]
+        compressed = self.shards[number]['compression'] == 'zlib'
+        if self.format == 'jsonl':
+            record = json.loads(data.decode('utf-8', 'surrogateescape'))
+            data = base64.b64decode(record['zlib']) if compressed else record['body'].encode('utf-8')
+        if compressed:
+            data = zlib.decompress(data)
+        if verify:
+            hasher = new_hasher()
+            hasher.update(data)
+            if hasher.hexdigest() != digest:
+                raise ValueError(f"Record hash mismatch in shard {self.shards[number]['name']} at offset {offset}")
+        return data.decode('utf-8')
+
+    def resolve(self, path):
+        """
+        Index key for path, which may also be given relative to the dumped root.
+        """
+        if path in self.files:
+            return path
+        joined = os.path.join(self.root, path)
+        if joined in self.files:
+            return joined
+        raise KeyError(path)
+
+    def header(self):
+        return self._read(self.header_entry)
+
+    def read(self, path, verify=False):
+        return self._read(self.files[self.resolve(path)], verify)
+
+    def subtree(self, directory):
+        """
+        Paths under directory (absolute or relative to the root), in sorted order.
+        """
+        if self.sorted_paths is None:
+            self.sorted_paths = sorted(self.files)
+        directory = directory.rstrip('/')
+        if not os.path.isabs(directory):
+            directory = os.path.join(self.root, directory) if directory else self.root
+        prefix = directory.rstrip('/') + '/'
+        start = bisect_left(self.sorted_paths, prefix)
+        end = start
+        while end < len(self.sorted_paths) and self.sorted_paths[end].startswith(prefix):
+            end += 1
+        return self.sorted_paths[start:end]
+
+
+def main():
+    command = sys.argv[1] if len(sys.argv) > 1 else ''
+    if command in ('header', 'get', 'ls') and len(sys.argv) >= 3:
+        with ShardedDump(sys.argv[2]) as dump:
+            if command == 'header':
+                sys.stdout.write(dump.header())
+            elif command == 'get' and len(sys.argv) == 4:
+                sys.stdout.write(dump.read(sys.argv[3], verify=True))
+            elif command == 'ls':
+                for path in dump.subtree(sys.argv[3] if len(sys.argv) > 3 else ''):
+                    print(path)
+            else:
+                command = ''
+    if command not in ('header', 'get', 'ls'):
+        print("Usage: python sharded_output.py header <index> | get <index> <path> | ls <index> [directory]")
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
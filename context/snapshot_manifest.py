@@ -0,0 +1,155 @@
+import os
+import json
+import hashlib
+
+MANIFEST_VERSION = 2
+MANIFEST_SUFFIX = '.manifest.json'
+
+
+def new_hasher():
+    return hashlib.blake2b(digest_size=16)
+
+
+def hash_file(path, max_bytes=0, chunk_size=64 * 1024):
+    """
+    Hash the first max_bytes (all bytes when 0) of a file, as copy_text would read them.
+    """
+    hasher = new_hasher()
+    remaining = max_bytes if max_bytes > 0 else None
+    with open(path, 'rb') as f:
+        while remaining is None or remaining > 0:
+            chunk = f.read(chunk_size if remaining is None else min(chunk_size, remaining))
+            if not chunk:
+                break
+            hasher.update(chunk)
+            if remaining is not None:
+                remaining -= len(chunk)
+    return hasher.hexdigest()
+
+
+def stat_key(path):
+    """
+    Return (size, mtime_ns) for a file, or None if it cannot be stat'ed.
+    """
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return st.st_size, st.st_mtime_ns
+
+
+def tree_digest(tree_lines):
+    hasher = new_hasher()
+    for line in tree_lines:
+        hasher.update(line.encode('utf-8', 'surrogateescape'))
+        hasher.update(b'\n')
+    return hasher.hexdigest()
+
+
+class SnapshotManifest:
+    """
+    Records, for one generated output file, where each file body was written
+    (path -> size, mtime_ns, content hash, body offset, body length, reusable)
+    together with the settings that shaped the output. A later run reuses the
+    byte range of every file whose size and mtime still match instead of
+    re-reading it; bodies that depend on other files (duplicate references)
+    are marked as not reusable and always rewritten.
+    """
+
+    def __init__(self, config, tree_hash):
+        self.config = config
+        self.tree_hash = tree_hash
+        self.files = {}
+        self.order = []
+        self.written_at_ns = None
+
+    def add(self, path, key, digest, offset, length, reusable=True):
+        size, mtime_ns = key if key is not None else (None, None)
+        self.files[path] = [size, mtime_ns, digest, offset, length, reusable]
+        self.order.append(path)
+
+    def known_digest(self, path, key):
+        """
+        Return the recorded content hash of path if its (size, mtime) still match.
+        """
+        entry = self.files.get(path)
+        if entry is None or key is None or (entry[0], entry[1]) != tuple(key):
+            return None
+        if self.written_at_ns is not None and key[1] >= self.written_at_ns:
+            return None
+        return entry[2]
+
+    def reusable(self, path, key, max_bytes=0):
+        """
+        Return (offset, length) of the previous body for path if it is still valid.
+        """
+        entry = self.files.get(path)
+        if entry is None or key is None:
+            return None
+        size, mtime_ns, digest, offset, length, reusable = entry
+        if not reusable or size != key[0]:
+            return None
+        # Files modified in the same timestamp tick as the previous run may have
+        # changed after they were read (the "racy clean" case), so re-check them
+        racy = self.written_at_ns is not None and key[1] >= self.written_at_ns
+        if mtime_ns == key[1] and not racy:
+            return offset, length
+        try:
+            if digest is not None and hash_file(path, max_bytes) == digest:
+                return offset, length
+        except OSError:
+            pass
+        return None
+
+    def is_up_to_date(self, tree_hash, file_paths, keys):
+        """
+        True if the tree, the file list and every file's (size, mtime) are unchanged.
+        """
+        if tree_hash != self.tree_hash or file_paths != self.order:
+            return False
+        for path in file_paths:
+            entry = self.files[path]
+            key = keys[path]
+            if key is None or (entry[0], entry[1]) != key:
+                return False
+            if self.written_at_ns is not None and key[1] >= self.written_at_ns:
+                return False
+        return True
+
+    def save(self, manifest_path, output_file):
+        output_key = stat_key(output_file)
+        data = {
+            'version': MANIFEST_VERSION,
+            'config': self.config,
+            'tree_hash': self.tree_hash,
+            'output': list(output_key) if output_key else None,
+            'written_at_ns': self.written_at_ns,
+            'order': self.order,
+            'files': self.files,
+        }
+        tmp_path = manifest_path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(data, f, separators=(',', ':'))
+        os.replace(tmp_path, manifest_path)
+
+    @classmethod
+    def load(cls, manifest_path, config, output_file):
+        """
+        Load a manifest, or return None if it is missing, was written with other
+        settings, or the output file it describes has since been modified.
+        """
+        try:
+            with open(manifest_path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if data.get('version') != MANIFEST_VERSION or data.get('config') != config:
+            return None
+        output_key = stat_key(output_file)
+        if output_key is None or data.get('output') != list(output_key):
+            return None
+        manifest = cls(config, data['tree_hash'])
+        manifest.files = data['files']
+        manifest.order = data['order']
+        manifest.written_at_ns = data.get('written_at_ns')
+        return manifest
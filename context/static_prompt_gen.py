@@ -1,10 +1,26 @@
 import os
-import fnmatch
 from pathlib import Path
 
+from dedup import find_duplicates
+from exclude_matcher import ExcludeMatcher
+from file_classifier import iter_prepared, write_prepared
+from py_skeleton import SKELETON_CACHE_SUFFIX, SkeletonCache, build_skeletons
+from tree_walker import walk_tree
+
 # Global configuration: Directory path to print, and the output filename
 DIR_PATH =  os.getenv("DIR_PATH", Path(__file__).parent.as_posix()) # Please modify to the target directory
 OUTPUT_FILE = 'output.txt'
+# Threads used to prefetch directory listings during the walk (0 = walk inline)
+WALK_WORKERS = int(os.getenv("WALK_WORKERS", 0))
+# Per-file cap on copied bytes; longer files end with a truncation marker (0 = no cap)
+MAX_FILE_BYTES = int(os.getenv("MAX_FILE_BYTES", 1024 * 1024))
+# Threads that classify and read files ahead of the writer (0 = read inline)
+READ_WORKERS = int(os.getenv("READ_WORKERS", 4))
+# Duplicate handling: 'exact' prints repeated files once and refers back to them,
+# 'near' also collapses near-identical text files, 'off' prints everything
+DEDUP = os.getenv("DEDUP", "exact")
+# Print Python files as skeletons: imports, signatures, class layouts and docstrings only
+SKELETON = os.getenv("SKELETON", "0") != "0"
 
 # Exclusion list: Folders/files to exclude (wildcards supported)
 EXCLUDE_LIST = [
@@ -23,29 +39,14 @@ EXCLUDE_LIST = [
 ]
 
 
+# Compiled once; get_tree consults it for every directory entry
+EXCLUDE_MATCHER = ExcludeMatcher(EXCLUDE_LIST)
+
 def should_exclude(path):
     """
     Check if a path should be excluded.
     """
-    # Normalize the path (using forward slashes)
-    normalized_path = path.replace('\\', '/')
-    
-    for exclude_pattern in EXCLUDE_LIST:
-        # Exact match
-        if normalized_path == exclude_pattern:
-            return True
-        
-        # Wildcard match
-        if fnmatch.fnmatch(normalized_path, exclude_pattern):
-            return True
-        
-        # Check if the path contains a directory name to be excluded
-        path_parts = normalized_path.split('/')
-        for part in path_parts:
-            if fnmatch.fnmatch(part, exclude_pattern):
-                return True
-    
-    return False
+    return EXCLUDE_MATCHER(path)
 
 
 def get_tree(root, prefix=''):
@@ -53,36 +54,19 @@ def get_tree(root, prefix=''):
     Returns each line of the directory tree and a list of all file paths.
     Automatically skips files and directories specified in EXCLUDE_LIST.
     """
-    entries = sorted(os.listdir(root))
-    lines = []
-    files = []
-    
-    # Filter out excluded files and directories
-    filtered_entries = []
-    for name in entries:
-        path = os.path.join(root, name)
-        if not should_exclude(path):
-            filtered_entries.append(name)
-        else:
-            print(f"Skipping excluded path: {path}")
-    
-    for idx, name in enumerate(filtered_entries):
-        path = os.path.join(root, name)
-        is_last = (idx == len(filtered_entries) - 1)
-        branch = '└── ' if is_last else '├── '
-        lines.append(prefix + branch + name)
-        
-        if os.path.isdir(path):
-            extension = '    ' if is_last else '│   '
-            child_lines, child_files = get_tree(path, prefix + extension)
-            lines.extend(child_lines)
-            files.extend(child_files)
-        else:
-            # Double-check if the file should be excluded (as a safeguard)
-            if not should_exclude(path):
-                files.append(path)
-    
-    return lines, files
+    # The root's own components are checked once; below it every ancestor has
+    # already been accepted, so only the new name and full-path rules are tested
+    root_excluded = not prefix and any(
+        EXCLUDE_MATCHER.match_name(part) for part in root.replace('\\', '/').split('/')
+    )
+    return walk_tree(
+        root,
+        EXCLUDE_MATCHER.excludes_child,
+        root_excluded=root_excluded,
+        prefix=prefix,
+        workers=WALK_WORKERS,
+        on_skip=lambda path: print(f"Skipping excluded path: {path}"),
+    )
 
 
 def main():
@@ -95,6 +79,11 @@ def main():
     tree_lines, file_paths = get_tree(DIR_PATH)
 
     print(f"\nScan complete! Found {len(file_paths)} files")
+    dedup = None
+    if DEDUP != 'off':
+        dedup = find_duplicates(file_paths, near=DEDUP == 'near', max_bytes=MAX_FILE_BYTES, workers=READ_WORKERS)
+        file_paths = [path for path in file_paths if path not in dedup.collapsed_files]
+        print(f"Found {len(dedup.duplicates)} duplicate files, collapsed {len(dedup.collapsed_dirs)} copied directories")
     print(f"Writing to: {OUTPUT_FILE}")
 
     with open(OUTPUT_FILE, 'w', encoding='utf-8') as out:
@@ -106,6 +95,10 @@ def main():
             date_cmd = 'N/A'
         out.write(f"Generated at: {date_cmd}\n")
         out.write(f"Number of files included: {len(file_paths)}\n")
+        if dedup is not None and dedup.collapsed_dirs:
+            out.write("Collapsed directory copies:\n")
+            for copy_dir, original_dir, count in dedup.collapsed_dirs:
+                out.write(f"  - {copy_dir}: {count} files, each identical to the same path under {original_dir}\n")
         out.write("Exclusion rules:\n")
         for rule in EXCLUDE_LIST:
             out.write(f"  - {rule}\n")
@@ -117,18 +110,33 @@ def main():
 
         # Write the file contents
         out.write("\nStarting to print all file contents...\n")
+        references = {path: dedup.reference(path) for path in file_paths} if dedup else {}
+        skeletons = {}
+        if SKELETON:
+            # Parsed on a process pool; unchanged files come from the cache
+            skeleton_cache = SkeletonCache(OUTPUT_FILE + SKELETON_CACHE_SUFFIX)
+            skeletons = build_skeletons(
+                [path for path in file_paths if references.get(path) is None],
+                max_bytes=MAX_FILE_BYTES, workers=READ_WORKERS, cache=skeleton_cache,
+            )
+            skeleton_cache.save()
+        # Classify and read files on a worker pool, ahead of the writer
+        prepared = iter_prepared(
+            [path for path in file_paths if references.get(path) is None and path not in skeletons],
+            max_bytes=MAX_FILE_BYTES,
+            workers=READ_WORKERS,
+        )
         for idx, path in enumerate(file_paths, 1):
             out.write('\n' + '=' * 80 + '\n')
             out.write(f"File {idx}/{len(file_paths)}: {path}\n")
             out.write('-' * 80 + '\n')
-            try:
-                with open(path, 'r', encoding='utf-8') as f:
-                    content = f.read()
-                    out.write(content)
-                    if not content.endswith('\n'):
-                        out.write('\n')
-            except Exception as e:
-                out.write(f"[Could not read this file: {e}]\n")
+            reference = references.get(path)
+            if reference is not None:
+                out.write(reference)
+            elif path in skeletons:
+                out.write(skeletons[path][0])
+            else:
+                write_prepared(out, next(prepared), max_bytes=MAX_FILE_BYTES)
 
     print(f"Done! Output saved to: {OUTPUT_FILE}")
 
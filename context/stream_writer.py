@@ -0,0 +1,147 @@
+import io
+import os
+import codecs
+
+# Bytes read from a source file per step; memory use per file never exceeds this
+CHUNK_SIZE = 64 * 1024
+
+
+def decode_error_message(e, base):
+    """
+    Render a chunk-relative UnicodeDecodeError with absolute file offsets,
+    matching the message a full f.read() would have raised.
+    """
+    start = base + e.start
+    if e.end - e.start == 1:
+        return f"'{e.encoding}' codec can't decode byte 0x{e.object[e.start]:02x} in position {start}: {e.reason}"
+    return f"'{e.encoding}' codec can't decode bytes in position {start}-{base + e.end - 1}: {e.reason}"
+
+
+class ByteCountingWriter:
+    """
+    Minimal text writer over a binary file that tracks the byte offset itself.
+    tell() is just a counter, so recording where each file body starts costs no
+    flush (unlike TextIOWrapper.tell()). Newlines are translated like text mode.
+    """
+
+    def __init__(self, raw, encoding='utf-8'):
+        self.raw = raw
+        self.encoding = encoding
+        self.pos = raw.tell() if raw.seekable() else 0
+
+    def write(self, text):
+        if os.linesep != '\n':
+            text = text.replace('\n', os.linesep)
+        data = text.encode(self.encoding)
+        self.raw.write(data)
+        self.pos += len(data)
+        return len(text)
+
+    def write_bytes(self, data):
+        self.raw.write(data)
+        self.pos += len(data)
+
+    def seekable(self):
+        return self.raw.seekable()
+
+    def tell(self):
+        return self.pos
+
+    def seek(self, pos):
+        self.pos = self.raw.seek(pos)
+        return self.pos
+
+    def truncate(self):
+        return self.raw.truncate()
+
+
+def copy_range(src, dst, offset, length, chunk_size=CHUNK_SIZE):
+    """
+    Copy length bytes starting at offset of the binary file src into dst.write_bytes.
+    """
+    src.seek(offset)
+    buffer = bytearray(chunk_size)
+    view = memoryview(buffer)
+    remaining = length
+    while remaining > 0:
+        n = src.readinto(view[:min(chunk_size, remaining)])
+        if n == 0:
+            raise EOFError(f"Source ended {remaining} bytes early")
+        dst.write_bytes(view[:n])
+        remaining -= n
+
+
+def copy_text(out, path, max_bytes=0, chunk_size=CHUNK_SIZE, hasher=None):
+    """
+    Copy a UTF-8 file into the text stream out in fixed-size chunks.
+
+    Decodes incrementally (with the same newline translation as open(path, 'r')),
+    stops after max_bytes when max_bytes > 0 and returns (bytes_read, file_size).
+    The raw bytes read are fed to hasher.update() when a hasher is given.
+    If the file turns out not to be valid UTF-8, anything already written is
+    rolled back (when out is seekable) and ValueError is raised.
+    """
+    decoder = io.IncrementalNewlineDecoder(codecs.getincrementaldecoder('utf-8')(), translate=True)
+    buffer = bytearray(chunk_size)
+    view = memoryview(buffer)
+    offset = 0
+    # Decoded text is written one step late, so a file that fits in a single
+    # chunk is fully validated before any of it reaches out
+    held = ''
+    wrote = ''  # last character actually written to out
+    start_pos = None
+    last_char = ''
+
+    with open(path, 'rb') as f:
+        size = os.fstat(f.fileno()).st_size
+        limit = max_bytes if max_bytes > 0 else None
+        try:
+            while True:
+                want = chunk_size if limit is None else min(chunk_size, limit - offset)
+                n = f.readinto(view[:want]) if want > 0 else 0
+                if hasher is not None and n:
+                    hasher.update(view[:n])
+                truncated = n == 0 and limit is not None and limit <= offset < size
+                pending = len(decoder.getstate()[0])
+                try:
+                    text = decoder.decode(view[:n], final=(n == 0 and not truncated))
+                except UnicodeDecodeError as e:
+                    raise ValueError(decode_error_message(e, offset - pending)) from None
+                offset += n
+                if text:
+                    if held:
+                        if not wrote and out.seekable():
+                            start_pos = out.tell()
+                        out.write(held)
+                        wrote = held[-1]
+                    held = text
+                    last_char = text[-1]
+                if n == 0:
+                    break
+        except ValueError:
+            if start_pos is not None:
+                out.seek(start_pos)
+                out.truncate()
+            elif wrote and wrote != '\n':
+                out.write('\n')
+            raise
+
+    out.write(held)
+    if last_char != '\n':
+        out.write('\n')
+    return offset, size
+
+
+def write_file_body(out, path, max_bytes=0, chunk_size=CHUNK_SIZE, hasher=None):
+    """
+    Write the contents of one file to out with bounded memory.
+    Oversized files are cut at max_bytes and followed by a truncation marker;
+    unreadable files are replaced by an error line, as in the original write loop.
+    """
+    try:
+        bytes_read, size = copy_text(out, path, max_bytes=max_bytes, chunk_size=chunk_size, hasher=hasher)
+    except Exception as e:
+        out.write(f"[Could not read this file: {e}]\n")
+        return
+    if bytes_read < size:
+        out.write(f"[... truncated: showed the first {bytes_read} of {size} bytes ...]\n")
@@ -0,0 +1,236 @@
+import io
+import os
+import re
+import json
+import math
+import time
+import importlib
+import subprocess
+from dataclasses import dataclass
+
+from file_classifier import prepare_file, write_prepared
+from snapshot_manifest import hash_file, stat_key
+
+TOKEN_CACHE_SUFFIX = '.tokens.json'
+TOKEN_CACHE_VERSION = 2
+# Rough BPE stand-in: words, numbers, punctuation (repeats like '====' merged) and whitespace runs
+APPROX_TOKEN_RE = re.compile(r"[A-Za-z]+|\d{1,3}|([^\sA-Za-z\d])\1{0,15}|\s+")
+# Weights of the relevance signals combined in score()
+HIT_WEIGHT = 4.0
+DEPTH_WEIGHT = 1.0
+RECENCY_WEIGHT = 1.0
+SIZE_WEIGHT = 0.5
+
+
+def approx_token_count(text):
+    return sum(1 for _ in APPROX_TOKEN_RE.finditer(text))
+
+
+def load_tokenizer(spec):
+    """
+    Return (name, count_fn) for a tokenizer spec:
+      'approx'            regex approximation, no dependencies (default)
+      'tiktoken:<enc>'    a tiktoken encoding such as 'tiktoken:cl100k_base'
+      '<module>:<func>'   any importable callable mapping text -> token count
+    """
+    if spec in ('', 'approx'):
+        return 'approx', approx_token_count
+    kind, _, arg = spec.partition(':')
+    if kind == 'tiktoken':
+        try:
+            import tiktoken
+        except ImportError:
+            raise RuntimeError("TOKENIZER=tiktoken:... requires the 'tiktoken' package") from None
+        encoding = tiktoken.get_encoding(arg or 'cl100k_base')
+        return spec, lambda text: len(encoding.encode(text, disallowed_special=()))
+    return spec, getattr(importlib.import_module(kind), arg)
+
+
+class TokenCountCache:
+    """
+    Token counts keyed by tokenizer name and content hash, persisted as JSON so
+    unchanged files are never re-tokenized across runs. Each file's (size,
+    mtime_ns) is stored with its hash, so a file that has not changed since the
+    last run is looked up without being read again. save() drops files that no
+    longer exist and counts that no remaining file refers to.
+    """
+
+    def __init__(self, path, tokenizer_name):
+        self.path = path
+        self.prefix = tokenizer_name + ':'
+        self.counts = {}
+        self.files = {}  # path -> [size, mtime_ns, max_bytes, content hash]
+        self.seen = set()
+        self.written_at_ns = None
+        self.started_ns = time.time_ns()
+        self.dirty = False
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return
+        if isinstance(data, dict) and data.get('version') == TOKEN_CACHE_VERSION:
+            self.counts = data['counts']
+            self.files = data['files']
+            self.written_at_ns = data['written_at_ns']
+
+    def digest(self, path, max_bytes=0):
+        """
+        Content hash of the first max_bytes of path, hashing it only if its size
+        or mtime changed since it was recorded.
+        """
+        self.seen.add(path)
+        key = stat_key(path)
+        if key is None:
+            return None
+        entry = self.files.get(path)
+        # Files modified in the tick the last run started may have changed after being hashed
+        racy = self.written_at_ns is not None and key[1] >= self.written_at_ns
+        if entry is not None and entry[:3] == [key[0], key[1], max_bytes] and not racy:
+            return entry[3]
+        try:
+            digest = hash_file(path, max_bytes)
+        except OSError:
+            return None
+        self.files[path] = [key[0], key[1], max_bytes, digest]
+        self.dirty = True
+        return digest
+
+    def get(self, digest):
+        return self.counts.get(self.prefix + digest)
+
+    def put(self, digest, count):
+        self.counts[self.prefix + digest] = count
+        self.dirty = True
+
+    def prune(self):
+        # Files not measured this run are only checked for existence
+        for path in [path for path in self.files if path not in self.seen and not os.path.exists(path)]:
+            del self.files[path]
+            self.dirty = True
+        live = {entry[3] for entry in self.files.values()}
+        # Keys are '<tokenizer>:<digest>' and tokenizer names may contain ':' themselves
+        for key in [key for key in self.counts if key.rpartition(':')[2] not in live]:
+            del self.counts[key]
+            self.dirty = True
+
+    def save(self):
+        self.prune()
+        if not self.dirty:
+            return
+        data = {
+            'version': TOKEN_CACHE_VERSION,
+            'written_at_ns': self.started_ns,
+            'files': self.files,
+            'counts': self.counts,
+        }
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(data, f, separators=(',', ':'))
+        os.replace(tmp_path, self.path)
+
+
+@dataclass
+class Candidate:
+    path: str
+    tokens: int
+    hits: int = 0
+    depth: int = 0
+    mtime: float = 0.0
+    score: float = 0.0
+
+
+def count_file_tokens(path, count_tokens, cache, max_bytes=0):
+    """
+    Count the tokens of the body a file contributes to the output,
+    looking the count up by content hash first.
+    """
+    digest = cache.digest(path, max_bytes)
+    if digest is not None:
+        cached = cache.get(digest)
+        if cached is not None:
+            return cached
+    buffer = io.StringIO()
+    write_prepared(buffer, prepare_file(path, max_bytes), max_bytes=max_bytes)
+    count = count_tokens(buffer.getvalue())
+    if digest is not None:
+        cache.put(digest, count)
+    return count
+
+
+def rg_hit_counts(root, query):
+    """
+    Count matches of query per file with ripgrep; returns {absolute path: hits}.
+    """
+    try:
+        output = subprocess.check_output(
+            ['rg', '--count-matches', '--no-messages', '--', query], cwd=root
+        )
+    except (OSError, subprocess.CalledProcessError) as e:
+        print(f"Could not collect rg hits for {query!r}: {e}")
+        return {}
+    hits = {}
+    for line in output.decode('utf-8', 'replace').splitlines():
+        rel_path, _, count = line.rpartition(':')
+        if rel_path and count.isdigit():
+            hits[os.path.normpath(os.path.join(root, rel_path))] = int(count)
+    return hits
+
+
+def score(candidate, newest, oldest):
+    """
+    Higher is more relevant: more rg hits, shallower paths, more recent
+    modification and fewer tokens all raise the score.
+    """
+    recency = (candidate.mtime - oldest) / (newest - oldest) if newest > oldest else 1.0
+    return (
+        HIT_WEIGHT * math.log1p(candidate.hits)
+        + DEPTH_WEIGHT / (1 + candidate.depth)
+        + RECENCY_WEIGHT * recency
+        - SIZE_WEIGHT * math.log1p(candidate.tokens) / math.log1p(100_000)
+    )
+
+
+def pack(candidates, budget):
+    """
+    Greedily fill the budget with the highest-scoring candidates.
+    Returns (kept paths in their original order, dropped candidates, tokens used).
+    """
+    if candidates:
+        newest = max(c.mtime for c in candidates)
+        oldest = min(c.mtime for c in candidates)
+        for candidate in candidates:
+            candidate.score = score(candidate, newest, oldest)
+    kept = set()
+    dropped = []
+    used = 0
+    for candidate in sorted(candidates, key=lambda c: (-c.score, c.path)):
+        if used + candidate.tokens <= budget:
+            kept.add(candidate.path)
+            used += candidate.tokens
+        else:
+            dropped.append(candidate)
+    return [c.path for c in candidates if c.path in kept], dropped, used
+
+
+def build_candidates(root, file_paths, count_tokens, cache, max_bytes=0, hits=None, overhead=0):
+    """
+    Measure every file: body tokens (+ a fixed per-file overhead for its section
+    header), rg hits, depth below root and mtime.
+    """
+    hits = {os.path.normpath(path): count for path, count in (hits or {}).items()}
+    candidates = []
+    for path in file_paths:
+        rel_path = os.path.relpath(path, root)
+        try:
+            mtime = os.stat(path).st_mtime
+        except OSError:
+            mtime = 0.0
+        candidates.append(Candidate(
+            path=path,
+            tokens=count_file_tokens(path, count_tokens, cache, max_bytes) + overhead,
+            hits=hits.get(os.path.normpath(path), 0),
+            depth=rel_path.count(os.sep),
+            mtime=mtime,
+        ))
+    return candidates
@@ -0,0 +1,101 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+
+def list_dir(path):
+    """
+    List a directory with os.scandir, returning sorted (name, path, is_dir) tuples.
+    DirEntry.is_dir() reuses the type from the directory listing, so no extra stat
+    is needed per entry on most filesystems. Like os.path.isdir it follows symlinks.
+    """
+    listing = []
+    with os.scandir(path) as it:
+        for entry in it:
+            try:
+                is_dir = entry.is_dir()
+            except OSError:
+                is_dir = False
+            listing.append((entry.name, entry.path, is_dir))
+    listing.sort()
+    return listing
+
+
+def walk_tree(root, excludes_child, root_excluded=False, prefix='', workers=0, on_skip=None, lister=list_dir):
+    """
+    Iterative replacement for the recursive get_tree.
+
+    Returns the same tree lines and file list (sorted per directory, depth first),
+    without Python recursion. excludes_child(path, name) decides each entry;
+    on_skip(path) is called for every excluded entry in the order get_tree printed them.
+    With workers > 0, subdirectory listings are fetched ahead of time on a thread
+    pool, which overlaps the latency of slow (e.g. network) filesystems.
+    lister(path) supplies the sorted (name, path, is_dir) listing of a directory;
+    it defaults to os.scandir but can serve listings built from a known file list.
+    """
+    lines = []
+    files = []
+    pool = ThreadPoolExecutor(max_workers=workers) if workers > 0 else None
+    pending = {}
+
+    def listing_of(path):
+        future = pending.pop(path, None)
+        return future.result() if future is not None else lister(path)
+
+    def expand(path, is_root=False):
+        kept = []
+        for name, child_path, is_dir in listing_of(path):
+            if (is_root and root_excluded) or excludes_child(child_path, name):
+                if on_skip is not None:
+                    on_skip(child_path)
+            else:
+                kept.append((name, child_path, is_dir))
+        if pool is not None:
+            for _, child_path, is_dir in kept:
+                if is_dir:
+                    pending[child_path] = pool.submit(lister, child_path)
+        return kept
+
+    try:
+        # Each stack frame is (entries of one directory, index of the next entry, prefix)
+        stack = [(expand(root, is_root=True), 0, prefix)]
+        while stack:
+            entries, idx, frame_prefix = stack.pop()
+            if idx >= len(entries):
+                continue
+            name, path, is_dir = entries[idx]
+            is_last = (idx == len(entries) - 1)
+            branch = '└── ' if is_last else '├── '
+            lines.append(frame_prefix + branch + name)
+            stack.append((entries, idx + 1, frame_prefix))
+
+            if is_dir:
+                extension = '    ' if is_last else '│   '
+                stack.append((expand(path), 0, frame_prefix + extension))
+            else:
+                files.append(path)
+    finally:
+        if pool is not None:
+            for future in pending.values():
+                future.cancel()
+            pool.shutdown(wait=True)
+
+    return lines, files
+
+
+def listings_from_paths(root, rel_paths):
+    """
+    Build a lister for walk_tree from '/'-separated paths relative to root,
+    so a known file list renders exactly like a filesystem walk would.
+    """
+    listings = {root: {}}
+    for rel_path in rel_paths:
+        parent = root
+        parts = rel_path.split('/')
+        for depth, name in enumerate(parts):
+            path = os.path.join(parent, name)
+            is_dir = depth < len(parts) - 1
+            listings[parent][name] = (name, path, is_dir)
+            if is_dir and path not in listings:
+                listings[path] = {}
+            parent = path
+    return lambda path: sorted(listings[path].values())
@@ -0,0 +1,350 @@
+import os
+import re
+import sys
+import json
+import mmap
+import bisect
+from array import array
+
+try:
+    from re import _parser as sre_parse, _constants as sre_constants
+except ImportError:  # Python < 3.11
+    import sre_parse
+    import sre_constants
+
+INDEX_VERSION = 1
+# Files larger than this (or containing NUL bytes) are not indexed
+MAX_INDEXED_BYTES = 4 * 1024 * 1024
+META_FILE = 'meta.json'
+KEYS_FILE = 'keys.bin'        # sorted uint32 trigram keys
+OFFSETS_FILE = 'offsets.bin'  # uint64 start of each key's postings (+ one end offset)
+POSTINGS_FILE = 'postings.bin'  # uint32 doc ids, ascending within each key
+
+
+def trigram_keys(data):
+    """
+    Distinct case-folded byte trigrams of data, as 24-bit integer keys.
+    """
+    data = data.lower()
+    grams = {data[i:i + 3] for i in range(len(data) - 2)}
+    return {int.from_bytes(g, 'big') for g in grams}
+
+
+def read_indexable(path):
+    """
+    Return the bytes to index for a file, or None for binary or oversized files.
+    """
+    try:
+        with open(path, 'rb') as f:
+            if os.fstat(f.fileno()).st_size > MAX_INDEXED_BYTES:
+                return None
+            data = f.read()
+    except OSError:
+        return None
+    return None if b'\0' in data else data
+
+
+# Query planning: a regex is reduced to an AND/OR tree of literal strings that any
+# match must contain: ('lit', s) needs s, ('and', [...]) all children and ('or', [...])
+# one of them. Literals shorter than a trigram do not narrow the search.
+REPEAT_OPS = {sre_constants.MAX_REPEAT, sre_constants.MIN_REPEAT}
+if hasattr(sre_constants, 'POSSESSIVE_REPEAT'):  # Python 3.11+
+    REPEAT_OPS.add(sre_constants.POSSESSIVE_REPEAT)
+ATOMIC_GROUP = getattr(sre_constants, 'ATOMIC_GROUP', None)
+
+
+def _plan(items, ignore_case):
+    required = []
+    run = []
+
+    def flush():
+        if run:
+            required.append(('lit', ''.join(run)))
+            run.clear()
+
+    for op, av in items:
+        if op == sre_constants.LITERAL:
+            char = chr(av)
+            if ignore_case and not char.isascii():
+                flush()  # the index only folds ASCII case
+            else:
+                run.append(char)
+            continue
+        flush()
+        if op == sre_constants.SUBPATTERN:
+            required.append(_plan(av[-1], ignore_case))
+        elif op == sre_constants.BRANCH:
+            required.append(('or', [_plan(branch, ignore_case) for branch in av[1]]))
+        elif op in REPEAT_OPS:
+            low, _, body = av
+            if low >= 1:
+                required.append(_plan(body, ignore_case))
+        elif op == ATOMIC_GROUP:
+            required.append(_plan(av, ignore_case))
+    flush()
+    return ('and', required)
+
+
+def plan_query(pattern, flags=0):
+    """
+    Turn a regex into the literal requirements used to look up candidate files.
+    """
+    parsed = sre_parse.parse(pattern, flags)
+    ignore_case = bool((flags | parsed.state.flags) & re.IGNORECASE)
+    return _plan(list(parsed), ignore_case)
+
+
+class TrigramIndex:
+    """
+    On-disk trigram index of a repository.
+
+    Every indexed file (a "doc") contributes its distinct case-folded byte
+    trigrams; for each trigram the index stores the ascending ids of the docs
+    containing it. The key, offset and postings tables are memory-mapped, so
+    opening the index is cheap and a lookup is a binary search plus a slice.
+    update() re-reads only files whose size or mtime changed.
+    """
+
+    def __init__(self, index_dir):
+        self.index_dir = index_dir
+        self.root = None
+        self.docs = []
+        self._maps = []
+        self.keys = self.offsets = self.postings = memoryview(b'')
+
+    # ---- loading -------------------------------------------------------------------
+
+    @classmethod
+    def open(cls, index_dir):
+        """
+        Open an existing index, or return an empty one if there is none yet.
+        """
+        index = cls(index_dir)
+        try:
+            with open(os.path.join(index_dir, META_FILE), 'r', encoding='utf-8') as f:
+                meta = json.load(f)
+        except (OSError, ValueError):
+            return index
+        if meta.get('version') != INDEX_VERSION or meta.get('byteorder') != sys.byteorder:
+            return index
+        index.root = meta['root']
+        index.docs = meta['docs']
+        index.keys = index._map(KEYS_FILE, 'I')
+        index.offsets = index._map(OFFSETS_FILE, 'Q')
+        index.postings = index._map(POSTINGS_FILE, 'I')
+        if len(index.offsets) != len(index.keys) + 1 or len(index.postings) != meta['num_postings']:
+            # Caught mid-write by another process; treat as missing
+            index.close()
+            return cls(index_dir)
+        return index
+
+    def _map(self, name, typecode):
+        path = os.path.join(self.index_dir, name)
+        with open(path, 'rb') as f:
+            if os.fstat(f.fileno()).st_size == 0:
+                return memoryview(array(typecode))
+            mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        base = memoryview(mapped)
+        view = base.cast(typecode)
+        self._maps.append((mapped, base, view))
+        return view
+
+    def close(self):
+        for mapped, base, view in self._maps:
+            view.release()
+            base.release()
+            mapped.close()
+        self._maps = []
+        self.keys = self.offsets = self.postings = memoryview(b'')
+
+    # ---- building ------------------------------------------------------------------
+
+    def update(self, root, file_paths):
+        """
+        Bring the index in line with file_paths (absolute paths under root).
+        Unchanged files keep their postings; changed and new files are re-read.
+        Returns the number of files that were (re)indexed.
+        """
+        root = os.path.abspath(root)
+        old_docs = self.docs if self.root == root else []
+        old_ids = {doc[0]: doc_id for doc_id, doc in enumerate(old_docs)}
+
+        kept = {}     # old doc id -> new doc id
+        docs = []
+        to_read = []
+        for path in file_paths:
+            rel_path = os.path.relpath(path, root).replace(os.sep, '/')
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            doc_id = old_ids.get(rel_path)
+            if doc_id is not None and old_docs[doc_id][1:] == [st.st_size, st.st_mtime_ns]:
+                kept[doc_id] = None
+            else:
+                to_read.append((rel_path, path, st))
+
+        if len(kept) == len(old_docs) and not to_read and self.root == root:
+            return 0
+
+        # Renumber surviving docs in their old order so postings stay sorted,
+        # then append the (re)indexed ones after them
+        for doc_id in sorted(kept):
+            kept[doc_id] = len(docs)
+            docs.append(old_docs[doc_id])
+        identity = len(kept) == len(old_docs)
+
+        new_postings = {}
+        for rel_path, path, st in to_read:
+            data = read_indexable(path)
+            doc_id = len(docs)
+            docs.append([rel_path, st.st_size, st.st_mtime_ns])
+            if data is None:
+                continue
+            for key in trigram_keys(data):
+                new_postings.setdefault(key, array('I')).append(doc_id)
+
+        all_keys = sorted(set(self.keys) | set(new_postings)) if old_docs else sorted(new_postings)
+        keys_out = array('I')
+        offsets_out = array('Q', [0])
+        postings_out = array('I')
+        for key in all_keys:
+            start = len(postings_out)
+            i = bisect.bisect_left(self.keys, key) if old_docs else len(self.keys)
+            if i < len(self.keys) and self.keys[i] == key:
+                with self.postings[self.offsets[i]:self.offsets[i + 1]] as old:
+                    if identity:
+                        postings_out.frombytes(old.tobytes())
+                    else:
+                        postings_out.extend(kept[d] for d in old if d in kept)
+            added = new_postings.get(key)
+            if added is not None:
+                postings_out.extend(added)
+            if len(postings_out) > start:
+                keys_out.append(key)
+                offsets_out.append(len(postings_out))
+
+        self.close()
+        self._write(root, docs, keys_out, offsets_out, postings_out)
+        reopened = TrigramIndex.open(self.index_dir)
+        self.__dict__.update(reopened.__dict__)
+        return len(to_read)
+
+    def _write(self, root, docs, keys, offsets, postings):
+        os.makedirs(self.index_dir, exist_ok=True)
+        for name, table in ((KEYS_FILE, keys), (OFFSETS_FILE, offsets), (POSTINGS_FILE, postings)):
+            path = os.path.join(self.index_dir, name)
+            with open(path + '.tmp', 'wb') as f:
+                table.tofile(f)
+            os.replace(path + '.tmp', path)
+        meta = {
+            'version': INDEX_VERSION,
+            'byteorder': sys.byteorder,
+            'root': root,
+            'num_postings': len(postings),
+            'docs': docs,
+        }
+        meta_path = os.path.join(self.index_dir, META_FILE)
+        with open(meta_path + '.tmp', 'w', encoding='utf-8') as f:
+            json.dump(meta, f, separators=(',', ':'))
+        os.replace(meta_path + '.tmp', meta_path)
+
+    # ---- querying ------------------------------------------------------------------
+
+    def _posting_set(self, key):
+        i = bisect.bisect_left(self.keys, key)
+        if i == len(self.keys) or self.keys[i] != key:
+            return set()
+        with self.postings[self.offsets[i]:self.offsets[i + 1]] as docs:
+            return set(docs)
+
+    def _evaluate(self, node):
+        """
+        Return the set of doc ids that may satisfy node, or None for "any doc".
+        """
+        if node[0] == 'lit':
+            data = node[1].encode('utf-8')
+            if len(data) < 3:
+                return None
+            result = None
+            for key in sorted(trigram_keys(data)):
+                result = self._posting_set(key) if result is None else result & self._posting_set(key)
+                if not result:
+                    return set()
+            return result
+        if node[0] == 'and':
+            result = None
+            for child in node[1]:
+                docs = self._evaluate(child)
+                if docs is not None:
+                    result = docs if result is None else result & docs
+            return result
+        if node[0] == 'or':
+            result = set()
+            for child in node[1]:
+                docs = self._evaluate(child)
+                if docs is None:
+                    return None
+                result |= docs
+            return result
+        return None
+
+    def candidates(self, pattern, flags=0):
+        """
+        Absolute paths of the files that may match pattern, from the index alone.
+        """
+        doc_ids = self._evaluate(plan_query(pattern, flags))
+        if doc_ids is None:
+            doc_ids = range(len(self.docs))
+        return [os.path.join(self.root, *self.docs[d][0].split('/')) for d in sorted(doc_ids)]
+
+    def search(self, pattern, flags=0):
+        """
+        Return {absolute path: number of matching lines} for files matching pattern.
+        Candidates from the index are verified against their current contents.
+        """
+        regex = re.compile(pattern, flags | re.MULTILINE)
+        hits = {}
+        for path in self.candidates(pattern, flags):
+            data = read_indexable(path)
+            if data is None:
+                continue
+            text = data.decode('utf-8', 'replace')
+            lines = set()
+            line = pos = 0
+            for m in regex.finditer(text):
+                line += text.count('\n', pos, m.start())
+                pos = m.start()
+                lines.add(line)
+            if lines:
+                hits[path] = len(lines)
+        return hits
+
+
+def main():
+    """
+    Usage:
+      python trigram_index.py update <root> [index_dir]    build or refresh the index
+      python trigram_index.py query <pattern> [index_dir]  list matching files
+    """
+    from exclude_matcher import ExcludeMatcher
+    from tree_walker import walk_tree
+
+    if len(sys.argv) < 3 or sys.argv[1] not in ('update', 'query'):
+        print(main.__doc__)
+        sys.exit(1)
+    index_dir = sys.argv[3] if len(sys.argv) > 3 else os.getenv("TRIGRAM_INDEX_DIR", '.trigram_index')
+    index = TrigramIndex.open(index_dir)
+    if sys.argv[1] == 'update':
+        root = sys.argv[2]
+        matcher = ExcludeMatcher(['.git', os.path.basename(os.path.abspath(index_dir))])
+        _, file_paths = walk_tree(root, matcher.excludes_child)
+        count = index.update(root, file_paths)
+        print(f"Indexed {count} changed files, {len(index.docs)} files in {index_dir}")
+    else:
+        for path, count in sorted(index.search(sys.argv[2]).items()):
+            print(f"{path}:{count}")
+
+
+if __name__ == '__main__':
+    main()
@@ -1,55 +1,77 @@
 import re
 import os
 import sys
-import subprocess
 import time
 from openai import OpenAI
 from rich.console import Console
 from rich.live import Live
 from rich.text import Text
 from pathlib import Path
-import requests
+
+sys.path.insert(0, Path(__file__).resolve().parent.parent.as_posix())
+from common.completion_cache import cached_client
+from common.history import ChatHistory
+from common.metrics import METRICS_SUMMARY, LatencyMetrics
+from common.trajectory import TrajectoryRecorder
+from debuggee_worker import DEBUGGEE_RUN_TIMEOUT, DebuggeePool
+from middleware_client import MiddlewareClient, start_middleware
 
 openai_api_key = os.getenv(
     "OPENAI_API_KEY",
     "xai-sk-XXXXXXXXXXXXXXXXXXXXXXXXXXXXXX",
 )
 openai_api_base = "https://api.x.ai/v1"  # "http://127.0.0.1:30000/v1"
-client = OpenAI(api_key=openai_api_key, base_url=openai_api_base)
+# COMPLETION_CACHE=on|record|replay serves repeated requests from a local cache
+client = cached_client(OpenAI(api_key=openai_api_key, base_url=openai_api_base))
 
 console = Console()
 
-wd: str = Path(__file__).parent.absolute()
-debug_middleware = (wd / "middleware_debug.py").as_posix()
-debug_server = subprocess.Popen([sys.executable, debug_middleware], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, start_new_session=True)
+# Requests, chunk timings, code runs and debug calls are logged to TRAJECTORY_DIR ('off' to disable)
+recorder = TrajectoryRecorder("debugger_agent")
+# TTFT, inter-chunk latency, tokens/s, code run time and middleware round trips, per turn
+metrics = LatencyMetrics("debugger_agent")
+
+# Starts in the background; the first debug call waits for /health, then reuses one keep-alive connection
+debug_server = start_middleware()
+middleware = MiddlewareClient(debug_server)
+# Interpreters with debugpy already listening, each on its own port (DEBUGGEE_WORKERS)
+debuggees = DebuggeePool()
+debuggees.start()
 
-messages = [
+# Token-budgeted chat memory; the system prompt stays fixed so prefix caching keeps hitting
+history = ChatHistory([
     {
         "role": "system",
         "content": 
             """
             You are Quentin, a helpful assistant who writes concise Python code to answer questions. 
             After running code, review the output and add assertions to verify the correctness based on the user's intent. 
-            Use debug commands like /debug/connect, /debug/status, /debug/stacktrace, /debug/variables to inspect the state if needed.
+            Use debug commands like /debug/connect, /debug/status, /debug/snapshot, /debug/stacktrace, /debug/variables to inspect the state if needed.
             """,
     }
-]
+])
 
 while True:
     user_input = console.input("[bold blue]You:[/bold blue] ")
     if user_input.lower() == "exit":
+        middleware.close()
         debug_server.terminate()
+        debuggees.close()
         console.print("[yellow]Goodbye![/yellow]")
         break
+    turn = metrics.start_turn()
     # chat memory
-    messages.append({"role": "user", "content": user_input})
+    history.add("user", user_input)
 
-    stream = client.chat.completions.create(
+    request = dict(
         model="grok-4-latest",
-        messages=messages,
+        messages=history.messages,
         stream=True,
         temperature=0.7,
     )
+    record = recorder.response(recorder.request(request))
+    turn.request()
+    stream = client.chat.completions.create(**request)
 
     # Stream and render assistant response with styles
     assistant_response = Text()
@@ -60,9 +82,14 @@ while True:
             if delta.content is not None:
                 content = chunk.choices[0].delta.content
                 assistant_response.append(content)
-                live.update(assistant_response)
+                record.chunk(content)
+                turn.chunk()
+                with turn.timed("render"):
+                    live.update(assistant_response)
+    record.finish()
+    turn.tokens = history.count_tokens(assistant_response.plain)
 
-    messages.append({"role": "assistant", "content": assistant_response.plain})
+    history.add("assistant", assistant_response.plain)
 
     # Extract Python code block from plain text
     plain_response = assistant_response.plain
@@ -78,65 +105,121 @@ while True:
             host = parts[1] if len(parts) > 1 else 'localhost'
             port = int(parts[2]) if len(parts) > 2 else 5678
             try:
-                response = requests.post('http://localhost:8000/connect', json={'host': host, 'port': port})
-                result = response.json()
+                with turn.timed("debug", endpoint="/connect"):
+                    result = middleware.connect(host, port)
+                recorder.record("debug", command=cmd, result=result)
                 console.print(f"[green]Debug connect result:[/green] {result}")
-                messages.append({"role": "user", "content": f"Debug connect result: {result}"})
+                history.add("user", f"Debug connect result: {result}", tool=True)
             except Exception as e:
+                recorder.record("debug", command=cmd, error=repr(e))
                 console.print(f"[red]Debug connect error:[/red] {e}")
-                messages.append({"role": "user", "content": f"Debug connect error: {e}"})
+                history.add("user", f"Debug connect error: {e}", tool=True)
         elif command == '/debug/status':
             try:
-                response = requests.get('http://localhost:8000/status')
-                result = response.json()
+                with turn.timed("debug", endpoint="/status"):
+                    result = middleware.status()
+                recorder.record("debug", command=cmd, result=result)
                 console.print(f"[green]Debug status:[/green] {result}")
-                messages.append({"role": "user", "content": f"Debug status: {result}"})
+                history.add("user", f"Debug status: {result}", tool=True)
             except Exception as e:
+                recorder.record("debug", command=cmd, error=repr(e))
                 console.print(f"[red]Debug status error:[/red] {e}")
-                messages.append({"role": "user", "content": f"Debug status error: {e}"})
+                history.add("user", f"Debug status error: {e}", tool=True)
+        elif command == '/debug/snapshot':
+            try:
+                with turn.timed("debug", endpoint="/snapshot"):
+                    result = middleware.snapshot()
+                recorder.record("debug", command=cmd, result=result)
+                console.print(f"[green]Debug snapshot:[/green] {result}")
+                history.add("user", f"Debug snapshot: {result}", tool=True)
+            except Exception as e:
+                recorder.record("debug", command=cmd, error=repr(e))
+                console.print(f"[red]Debug snapshot error:[/red] {e}")
+                history.add("user", f"Debug snapshot error: {e}", tool=True)
         # Add more commands as needed
 
     if match:
         code = match.group(1).strip()
         run = console.input("[bold red]Run the code? (y/n): [/bold red]").lower() == "y"
+        debuggee = None
         if run:
-            import tempfile
-            with tempfile.NamedTemporaryFile(mode='w', suffix='.py', delete=False, dir=wd) as f:
-                f.write('import debugpy\ndebugpy.listen(5678)\ndebugpy.wait_for_client()\ndebugpy.breakpoint()\n' + code)
-                temp_file = f.name
-            console.print(f"[yellow]Temp file: {temp_file}[/yellow]")
-            proc = subprocess.Popen([sys.executable, temp_file], stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-            time.sleep(1)
+            started = time.monotonic()
+            debug_before = turn.phases.get("debug", 0.0)
             try:
-                response = requests.post('http://localhost:8000/connect', json={'host': 'localhost', 'port': 5678, 'pid': proc.pid})
-                result = response.json()
+                # Already listening; stops at the first line of the code once the debugger attaches
+                debuggee = debuggees.acquire()
+                debuggee.send(code)
+            except Exception as e:
+                recorder.record("exec", code=code, error=repr(e))
+                console.print(f"[red]Debuggee error:[/red] {e}")
+                history.add("user", f"Debuggee error, the code was not run: {e}", tool=True)
+                if debuggee is not None:
+                    debuggee.kill()
+                    debuggee.communicate()
+                debuggee = None
+        if debuggee is not None:
+            console.print(f"[yellow]Debuggee: pid {debuggee.pid}, port {debuggee.port}[/yellow]")
+            try:
+                with turn.timed("debug", endpoint="/connect"):
+                    result = middleware.connect(debuggee.host, debuggee.port, debuggee.pid, debuggee.harness_paths)
+                recorder.record("debug", command="connect", pid=debuggee.pid, result=result)
                 console.print(f"[green]Connected to debug session:[/green] {result}")
-                messages.append({"role": "user", "content": f"Connected to debug session: {result}"})
+                history.add("user", f"Connected to debug session: {result}", tool=True)
                 try:
-                    threads_response = requests.get('http://localhost:8000/threads')
-                    threads_result = threads_response.json()
-                    console.print(f"[green]Threads:[/green] {threads_result}")
-                    messages.append({"role": "user", "content": f"Threads: {threads_result}"})
+                    # Threads, frames, scopes and variables in one round trip
+                    with turn.timed("debug", endpoint="/snapshot"):
+                        snapshot_result = middleware.snapshot(result["session_id"])
+                    recorder.record("debug", command="snapshot", result=snapshot_result)
+                    console.print(f"[green]Snapshot:[/green] {snapshot_result}")
+                    history.add("user", f"Snapshot: {snapshot_result}", tool=True)
                 except Exception as e:
-                    console.print(f"[red]Threads error:[/red] {e}")
-                    messages.append({"role": "user", "content": f"Threads error: {e}"})
+                    recorder.record("debug", command="snapshot", error=repr(e))
+                    console.print(f"[red]Snapshot error:[/red] {e}")
+                    history.add("user", f"Snapshot error: {e}", tool=True)
                 try:
-                    cont_response = requests.post('http://localhost:8000/continue')
-                    cont_result = cont_response.json()
+                    with turn.timed("debug", endpoint="/continue"):
+                        cont_result = middleware.continue_execution(result["session_id"])
+                    recorder.record("debug", command="continue", result=cont_result)
                     console.print(f"[green]Continued execution:[/green] {cont_result}")
                 except Exception as e:
+                    recorder.record("debug", command="continue", error=repr(e))
                     console.print(f"[red]Continue error:[/red] {e}")
+                try:
+                    # The adapter holds the debuggee's pipes open until the session is disconnected
+                    with turn.timed("debug", endpoint="/disconnect"):
+                        middleware.disconnect(result["session_id"])
+                except Exception as e:
+                    recorder.record("debug", command="disconnect", error=repr(e))
+                    console.print(f"[red]Disconnect error:[/red] {e}")
             except Exception as e:
+                recorder.record("debug", command="connect", error=repr(e))
                 console.print(f"[red]Connect error:[/red] {e}")
-            stdout, stderr = proc.communicate()
+                # Nobody will attach, and the debuggee would wait for a client forever
+                debuggee.kill()
+            stdout, stderr, timed_out = debuggee.finish()
             output = stdout.decode().strip()
             error = stderr.decode().strip()
+            if timed_out:
+                error = f"{error}\n[Timed out after {DEBUGGEE_RUN_TIMEOUT:g}s, debuggee killed]".strip()
+            # Middleware calls made during the run are already counted as debug time
+            turn.add("exec", time.monotonic() - started - (turn.phases.get("debug", 0.0) - debug_before))
+            recorder.record(
+                "exec",
+                code=code,
+                output=output,
+                error=error,
+                returncode=debuggee.returncode,
+                duration=time.monotonic() - started,
+            )
             if output:
                 console.print(f"[yellow]Code output:[/yellow]\n{output}")
-                messages.append({"role": "user", "content": f"Code output:\n{output}"})
+                history.add("user", f"Code output:\n{output}", tool=True)
             if error:
                 console.print(f"[red]Code error:[/red]\n{error}")
-                messages.append({"role": "user", "content": f"Code error:\n{error}"})
-            os.unlink(temp_file)
+                history.add("user", f"Code error:\n{error}", tool=True)
     else:
-        console.print("<system>No Python code block found in the response.</system>")
\ No newline at end of file
+        console.print("<system>No Python code block found in the response.</system>")
+
+    summary = metrics.finish(turn)
+    if METRICS_SUMMARY:
+        console.print(summary, style="dim")
\ No newline at end of file
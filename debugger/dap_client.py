@@ -0,0 +1,175 @@
+import os
+import json
+import asyncio
+import functools
+from typing import Any, Callable, Dict, List, Optional
+
+# Seconds to wait for the debug adapter to answer one request
+DAP_REQUEST_TIMEOUT = float(os.getenv("DAP_REQUEST_TIMEOUT", 10))
+
+
+class DAPError(Exception):
+    """
+    The debug adapter answered a request with success: false.
+    """
+
+    def __init__(self, command: str, message: str, body: Optional[dict] = None):
+        super().__init__(f"{command} failed: {message}")
+        self.command = command
+        self.body = body or {}
+
+
+class DAPTimeout(asyncio.TimeoutError):
+    pass
+
+
+class DAPClient:
+    """
+    Debug Adapter Protocol client on an asyncio stream.
+
+    A reader task parses Content-Length framed messages and resolves the future
+    registered for each request's seq, so any number of requests can be in
+    flight at once and a slow one never blocks the others or the event loop.
+    Events are dispatched to listeners and remembered by name for wait_for_event.
+    """
+
+    def __init__(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter, timeout: float = DAP_REQUEST_TIMEOUT):
+        self.reader = reader
+        self.writer = writer
+        self.timeout = timeout
+        self.seq = 0
+        self.pending: Dict[int, asyncio.Future] = {}
+        self.events: Dict[str, dict] = {}  # last body of each event received
+        self.event_waiters: Dict[str, List[asyncio.Future]] = {}
+        self.listeners: List[Callable[[str, dict], Any]] = []
+        self.closed = False
+        self.reader_task = asyncio.create_task(self._read_loop())
+
+    @classmethod
+    async def connect(cls, host: str, port: int, timeout: float = DAP_REQUEST_TIMEOUT) -> "DAPClient":
+        reader, writer = await asyncio.wait_for(asyncio.open_connection(host, port), timeout)
+        return cls(reader, writer, timeout)
+
+    def _write(self, message: dict) -> None:
+        body = json.dumps(message).encode("utf-8")
+        self.writer.write(b"Content-Length: %d\r\n\r\n" % len(body) + body)
+
+    def send(self, command: str, arguments: Optional[dict] = None) -> asyncio.Future:
+        """Send a request and return the future of its response body without waiting."""
+        if self.closed:
+            raise ConnectionError("Debug adapter connection is closed")
+        self.seq += 1
+        message = {"seq": self.seq, "type": "request", "command": command}
+        if arguments is not None:
+            message["arguments"] = arguments
+        future = asyncio.get_running_loop().create_future()
+        self.pending[self.seq] = future
+        future.add_done_callback(functools.partial(self._done, self.seq))
+        self._write(message)
+        return future
+
+    def _done(self, seq: int, future: asyncio.Future) -> None:
+        self.pending.pop(seq, None)
+        # A request nobody waits for (e.g. attach after a failed handshake) must not log a warning
+        if not future.cancelled():
+            future.exception()
+
+    async def wait(self, future: asyncio.Future, command: str = "request", timeout: Optional[float] = None) -> dict:
+        timeout = self.timeout if timeout is None else timeout
+        try:
+            return await asyncio.wait_for(future, timeout)
+        except asyncio.TimeoutError:
+            raise DAPTimeout(f"Debug adapter did not answer {command!r} within {timeout:g}s") from None
+
+    async def request(self, command: str, arguments: Optional[dict] = None, timeout: Optional[float] = None) -> dict:
+        """Send a request and wait (up to timeout) for its response body."""
+        future = self.send(command, arguments)
+        await self.writer.drain()
+        return await self.wait(future, command, timeout)
+
+    async def wait_for_event(self, event: str, timeout: Optional[float] = None) -> dict:
+        """Body of the named event; returns at once if it was already received."""
+        if event in self.events:
+            return self.events[event]
+        future = asyncio.get_running_loop().create_future()
+        self.event_waiters.setdefault(event, []).append(future)
+        return await self.wait(future, f"{event} event", timeout)
+
+    def on_event(self, listener: Callable[[str, dict], Any]) -> None:
+        self.listeners.append(listener)
+
+    async def _read_message(self) -> Optional[dict]:
+        length = None
+        while True:
+            line = await self.reader.readline()
+            if not line:
+                return None
+            line = line.strip()
+            if not line:
+                if length is not None:
+                    break
+                continue
+            name, _, value = line.decode("ascii").partition(":")
+            if name.strip().lower() == "content-length":
+                length = int(value)
+        return json.loads(await self.reader.readexactly(length))
+
+    async def _read_loop(self) -> None:
+        error: BaseException = ConnectionError("Debug adapter closed the connection")
+        try:
+            while True:
+                message = await self._read_message()
+                if message is None:
+                    break
+                self._dispatch(message)
+        except (OSError, asyncio.IncompleteReadError, ValueError) as e:
+            error = ConnectionError(f"Debug adapter connection failed: {e}")
+        finally:
+            self.closed = True
+            for future in list(self.pending.values()):
+                if not future.done():
+                    future.set_exception(error)
+            for waiters in self.event_waiters.values():
+                for future in waiters:
+                    if not future.done():
+                        future.set_exception(error)
+
+    def _dispatch(self, message: dict) -> None:
+        kind = message.get("type")
+        if kind == "response":
+            future = self.pending.get(message.get("request_seq"))
+            if future is None or future.done():
+                # Answer to a request that already timed out
+                return
+            if message.get("success"):
+                future.set_result(message.get("body") or {})
+            else:
+                future.set_exception(DAPError(message.get("command", ""), message.get("message", "unknown error"), message.get("body")))
+        elif kind == "event":
+            event, body = message.get("event", ""), message.get("body") or {}
+            self.events[event] = body
+            for future in self.event_waiters.pop(event, []):
+                if not future.done():
+                    future.set_result(body)
+            for listener in self.listeners:
+                listener(event, body)
+        elif kind == "request":
+            # Reverse requests (runInTerminal, startDebugging) are not supported
+            self.seq += 1
+            self._write({
+                "seq": self.seq,
+                "type": "response",
+                "request_seq": message.get("seq"),
+                "command": message.get("command"),
+                "success": False,
+                "message": "Not supported by the middleware",
+            })
+
+    async def close(self) -> None:
+        self.closed = True
+        self.reader_task.cancel()
+        self.writer.close()
+        try:
+            await self.writer.wait_closed()
+        except OSError:
+            pass
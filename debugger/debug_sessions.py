@@ -0,0 +1,197 @@
+import os
+import time
+import asyncio
+import secrets
+from typing import Dict, List, Optional, Sequence
+
+from dap_client import DAPClient
+
+# Connected debuggees one middleware process serves at once
+MAX_SESSIONS = int(os.getenv("DEBUG_MAX_SESSIONS", 64))
+# Sessions without a request for this many seconds are disconnected
+SESSION_IDLE_TIMEOUT = float(os.getenv("DEBUG_SESSION_IDLE_TIMEOUT", 600))
+# How often the reaper looks for idle or ended sessions (seconds)
+REAP_INTERVAL = float(os.getenv("DEBUG_REAP_INTERVAL", 15))
+# Events after which the debuggee is gone, even if the adapter keeps the connection open
+END_EVENTS = ("exited", "terminated")
+
+
+class SessionLimitError(RuntimeError):
+    pass
+
+
+class DebugSession:
+    """
+    One attached debuggee. Inspection requests share the DAP connection and run
+    concurrently; requests that change execution state (continue, step, pause,
+    breakpoints) take the session lock so they are applied one at a time.
+    """
+
+    def __init__(
+        self, session_id: str, host: str, port: int, pid: Optional[int] = None, exclude: Sequence[str] = ()
+    ):
+        self.id = session_id
+        self.host = host
+        self.port = port
+        self.pid = pid
+        self.exclude = list(exclude)
+        self.client: Optional[DAPClient] = None
+        self.ended = False
+        self.lock = asyncio.Lock()
+        self.in_flight = 0
+        self.created = self.last_used = time.monotonic()
+
+    @property
+    def connected(self) -> bool:
+        return self.client is not None and not self.client.closed and not self.ended
+
+    def _on_event(self, event: str, body: dict) -> None:
+        if event in END_EVENTS:
+            self.ended = True
+
+    async def attach(self) -> None:
+        self.client = await DAPClient.connect(self.host, self.port)
+        self.client.on_event(self._on_event)
+        await self.client.request("initialize", {
+            "clientID": "middleware",
+            "clientName": "Debug Middleware",
+            "adapterID": "python",
+            "pathFormat": "path",
+            "linesStartAt1": True,
+            "columnsStartAt1": True,
+            "supportsVariableType": True,
+            "supportsVariablePaging": True,
+            "supportsRunInTerminalRequest": True,
+            "locale": "en-us"
+        })
+
+        # The adapter answers attach only after configurationDone, so keep it in flight
+        attach = self.client.send("attach", {
+            "name": "Python Attach",
+            "type": "python",
+            "request": "attach",
+            "connect": {
+                "host": self.host,
+                "port": self.port
+            },
+            "pathMappings": [{"localRoot": ".", "remoteRoot": "."}],  # Adjust as needed
+            # Excluded files are skipped when stepping and left out of stack traces
+            "rules": [{"path": path, "include": False} for path in self.exclude],
+        })
+
+        await self.client.wait_for_event("initialized")
+        await self.client.request("configurationDone")
+        await self.client.wait(attach, "attach")
+
+    async def request(self, command: str, arguments: Optional[dict] = None, exclusive: bool = False) -> dict:
+        self.in_flight += 1
+        self.last_used = time.monotonic()
+        try:
+            if exclusive:
+                async with self.lock:
+                    return await self.client.request(command, arguments)
+            return await self.client.request(command, arguments)
+        finally:
+            self.in_flight -= 1
+            self.last_used = time.monotonic()
+
+    def idle(self) -> float:
+        return 0.0 if self.in_flight else time.monotonic() - self.last_used
+
+    def info(self) -> dict:
+        return {
+            "session_id": self.id,
+            "host": self.host,
+            "port": self.port,
+            "pid": self.pid,
+            "connected": self.connected,
+            "in_flight": self.in_flight,
+            "idle_seconds": round(self.idle(), 1),
+            "age_seconds": round(time.monotonic() - self.created, 1),
+        }
+
+    async def close(self) -> None:
+        if self.client is None:
+            return
+        if self.connected:
+            # Detach cleanly so the adapter lets go of the debuggee instead of waiting for us
+            try:
+                await self.client.request("disconnect", {"terminateDebuggee": False}, timeout=2)
+            except Exception:
+                pass
+        await self.client.close()
+
+
+class SessionRegistry:
+    """
+    Debug sessions by id, capped at max_sessions. Sessions whose debuggee went
+    away or that have been idle for idle_timeout are closed by reap(), which
+    run_reaper() calls every REAP_INTERVAL seconds. The most recently opened
+    session is the default used by the endpoints that take no session id.
+    """
+
+    def __init__(self, max_sessions: int = MAX_SESSIONS, idle_timeout: float = SESSION_IDLE_TIMEOUT):
+        self.max_sessions = max_sessions
+        self.idle_timeout = idle_timeout
+        self.sessions: Dict[str, DebugSession] = {}
+        self.default_id: Optional[str] = None
+        self.connecting = 0
+
+    def __len__(self) -> int:
+        return len(self.sessions)
+
+    def get(self, session_id: Optional[str] = None) -> Optional[DebugSession]:
+        return self.sessions.get(session_id or self.default_id or "")
+
+    async def open(
+        self, host: str, port: int, pid: Optional[int] = None, exclude: Sequence[str] = ()
+    ) -> DebugSession:
+        if len(self.sessions) + self.connecting >= self.max_sessions:
+            await self.reap()
+        # Sessions still attaching count against the cap
+        if len(self.sessions) + self.connecting >= self.max_sessions:
+            raise SessionLimitError(f"Too many debug sessions ({self.max_sessions})")
+        session = DebugSession(secrets.token_hex(8), host, port, pid, exclude)
+        self.connecting += 1
+        try:
+            await session.attach()
+        except BaseException:
+            await session.close()
+            raise
+        finally:
+            self.connecting -= 1
+        self.sessions[session.id] = session
+        self.default_id = session.id
+        return session
+
+    async def close(self, session_id: str) -> bool:
+        session = self.sessions.pop(session_id, None)
+        if session is None:
+            return False
+        if self.default_id == session_id:
+            self.default_id = None
+        await session.close()
+        return True
+
+    async def reap(self) -> List[str]:
+        expired = [
+            session_id
+            for session_id, session in self.sessions.items()
+            if not session.connected or session.idle() > self.idle_timeout
+        ]
+        # Unregister all of them before the first await, so none can pick up a new request
+        closing = [self.sessions.pop(session_id) for session_id in expired]
+        if self.default_id in expired:
+            self.default_id = None
+        for session in closing:
+            await session.close()
+        return expired
+
+    async def run_reaper(self, interval: float = REAP_INTERVAL) -> None:
+        while True:
+            await asyncio.sleep(interval)
+            await self.reap()
+
+    async def close_all(self) -> None:
+        for session_id in list(self.sessions):
+            await self.close(session_id)
@@ -0,0 +1,214 @@
+import os
+import ast
+import sys
+import json
+import time
+import atexit
+import select
+import signal
+import tempfile
+import importlib
+import traceback
+import subprocess
+from pathlib import Path
+
+sys.path.insert(0, Path(__file__).resolve().parent.parent.as_posix())
+from common.exec_pool import PRELOAD_MODULES
+
+# Debuggees kept listening ahead of time; each runs one snippet and is replaced right away
+DEBUGGEE_WORKERS = int(os.getenv("DEBUGGEE_WORKERS", 2))
+# Seconds to wait for a worker to report that debugpy is listening
+DEBUGGEE_READY_TIMEOUT = float(os.getenv("DEBUGGEE_READY_TIMEOUT", 30))
+# Seconds a debugged run may take once it was continued; then it is killed (0 = no limit)
+DEBUGGEE_RUN_TIMEOUT = float(os.getenv("DEBUGGEE_RUN_TIMEOUT", 60))
+DEBUGGEE_HOST = "127.0.0.1"
+
+
+def with_breakpoint(code, filename):
+    """
+    Compile code with a debugpy.breakpoint() call in front of its first statement,
+    so the debugger stops in the snippet's own frame with its line numbers intact.
+    """
+    tree = ast.parse(code, filename)
+    # A docstring and __future__ imports have to stay in front
+    index = 0
+    while index < len(tree.body) and (
+        isinstance(tree.body[index], ast.ImportFrom) and tree.body[index].module == "__future__"
+        or index == 0 and isinstance(tree.body[0], ast.Expr) and isinstance(tree.body[0].value, ast.Constant)
+    ):
+        index += 1
+    if index < len(tree.body):
+        # debugpy pauses at the next line event, so the call must not share a line with
+        # the statement it precedes (line 0 is free when the snippet starts on line 1)
+        line = tree.body[index - 1].end_lineno if index else 0
+        stop = ast.parse("__import__('debugpy').breakpoint()").body[0]
+        for node in ast.walk(stop):
+            if "lineno" in node._attributes:
+                node.lineno = node.end_lineno = line
+                node.col_offset = node.end_col_offset = 0
+        tree.body.insert(index, stop)
+    return compile(tree, filename, "exec")
+
+
+def worker_main():
+    """
+    Worker entry point: preload, start listening, report the port on stdout, then
+    wait for code on stdin, wait for the debugger to attach and run the code.
+    """
+    import debugpy
+
+    for name in PRELOAD_MODULES:
+        try:
+            importlib.import_module(name.strip())
+        except Exception:
+            pass
+    # Port 0 lets every worker listen on its own free port
+    host, port = debugpy.listen((DEBUGGEE_HOST, 0))
+    sys.stdout.write(json.dumps({"host": host, "port": port, "pid": os.getpid()}) + "\n")
+    sys.stdout.flush()
+
+    code = sys.stdin.read()
+    # A real file, so the debugger and tracebacks can show the source
+    fd, path = tempfile.mkstemp(prefix="debuggee_", suffix=".py")
+    with os.fdopen(fd, "w", encoding="utf-8") as f:
+        f.write(code)
+    atexit.register(os.unlink, path)
+    try:
+        compiled = with_breakpoint(code, path)
+    except SyntaxError as e:
+        sys.stderr.write("".join(traceback.format_exception_only(e)))
+        sys.exit(1)
+    debugpy.wait_for_client()
+    try:
+        exec(compiled, {"__name__": "__main__", "__file__": path})
+    except Exception as e:
+        sys.stdout.flush()
+        # Leave this function's frame out of the traceback
+        traceback.print_exception(type(e), e, e.__traceback__.tb_next)
+        sys.exit(1)
+
+
+class Debuggee:
+    """
+    A worker that has reported it is listening; send() hands it the code to run.
+    """
+
+    def __init__(self, proc, host, port):
+        self.proc = proc
+        self.host = host
+        self.port = port
+        self.pid = proc.pid
+        # worker_main's frame holds the code string and its code object; pass this as the
+        # session's exclude list so snapshots show only the snippet's frames
+        self.harness_paths = [os.path.abspath(__file__)]
+
+    def send(self, code):
+        self.proc.stdin.write(code.encode("utf-8"))
+        self.proc.stdin.close()
+        # The worker needs EOF before it waits for the debugger; communicate() must not touch stdin again
+        self.proc.stdin = None
+
+    def communicate(self, timeout=None):
+        return self.proc.communicate(timeout=timeout)
+
+    def finish(self, timeout=DEBUGGEE_RUN_TIMEOUT):
+        """
+        Wait for the run to end and return (stdout, stderr, timed_out); a run still
+        going after timeout seconds is killed with its process group.
+        """
+        try:
+            return (*self.communicate(timeout if timeout > 0 else None), False)
+        except subprocess.TimeoutExpired:
+            self.kill()
+            return (*self.communicate(), True)
+
+    @property
+    def returncode(self):
+        return self.proc.returncode
+
+    def kill(self):
+        if self.proc.poll() is not None:
+            return
+        try:
+            os.killpg(self.proc.pid, signal.SIGKILL)
+        except (AttributeError, ProcessLookupError, PermissionError):
+            self.proc.kill()
+
+
+class DebuggeePool:
+    """
+    Python interpreters that already have debugpy imported and listening, each on
+    its own port, so a debugged run starts as soon as the code is piped over
+    instead of after an interpreter start, a debugpy import and a fixed sleep.
+
+    Workers are spawned without waiting; acquire() only blocks until the one it
+    hands out has printed its ready line, which for a pool that had time to warm
+    up has already happened. Workers are single-use and replaced on acquire(),
+    and since they listen on distinct ports, several runs can be debugged at once.
+    """
+
+    def __init__(self, size=DEBUGGEE_WORKERS, ready_timeout=DEBUGGEE_READY_TIMEOUT):
+        self.size = max(1, size)
+        self.ready_timeout = ready_timeout
+        self.idle = []
+
+    def _spawn(self):
+        # Otherwise every run's stderr starts with debugpy's frozen modules warning
+        env = dict(os.environ, PYDEVD_DISABLE_FILE_VALIDATION="1")
+        return subprocess.Popen(
+            [sys.executable, "-u", os.path.abspath(__file__)],
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            env=env,
+            start_new_session=True,
+        )
+
+    def start(self):
+        while len(self.idle) < self.size:
+            self.idle.append(self._spawn())
+
+    def _ready(self, proc):
+        """
+        Read the worker's ready line straight from the pipe, byte by byte, so no
+        program output is left behind in a Python-side buffer.
+        """
+        deadline = time.monotonic() + self.ready_timeout
+        line = b""
+        fd = proc.stdout.fileno()
+        while not line.endswith(b"\n"):
+            remaining = deadline - time.monotonic()
+            if remaining <= 0 or not select.select([fd], [], [], remaining)[0]:
+                raise TimeoutError(f"Debuggee {proc.pid} not ready after {self.ready_timeout:g}s")
+            data = os.read(fd, 1)
+            if not data:
+                error = proc.stderr.read().decode("utf-8", "replace").strip()
+                raise RuntimeError(f"Debuggee {proc.pid} exited before listening: {error}")
+            line += data
+        ready = json.loads(line)
+        return Debuggee(proc, ready["host"], ready["port"])
+
+    def acquire(self):
+        while self.idle:
+            proc = self.idle.pop(0)
+            if proc.poll() is None:
+                break
+        else:
+            proc = self._spawn()
+        self.start()
+        try:
+            return self._ready(proc)
+        except Exception:
+            Debuggee(proc, None, None).kill()
+            proc.wait()
+            raise
+
+    def close(self):
+        for proc in self.idle:
+            Debuggee(proc, None, None).kill()
+            proc.wait()
+        self.idle.clear()
+
+
+if __name__ == "__main__":
+    worker_main()
@@ -0,0 +1,195 @@
+import os
+import sys
+import time
+import asyncio
+import subprocess
+from pathlib import Path
+from typing import Optional, Sequence
+
+import httpx
+
+# Base URL of middleware_debug.py over TCP
+MIDDLEWARE_URL = os.getenv("DEBUG_MIDDLEWARE_URL", "http://127.0.0.1:8000")
+# Unix domain socket path; when set, the middleware listens on it instead of TCP
+MIDDLEWARE_UDS = os.getenv("DEBUG_MIDDLEWARE_UDS", "")
+# Seconds to wait for a freshly started middleware to answer /health
+MIDDLEWARE_READY_TIMEOUT = float(os.getenv("DEBUG_MIDDLEWARE_READY_TIMEOUT", 30))
+# Seconds one middleware call may take (a snapshot or connect waits on the debug adapter)
+MIDDLEWARE_TIMEOUT = float(os.getenv("DEBUG_MIDDLEWARE_TIMEOUT", 60))
+# Readiness polling starts at the first delay and doubles up to the second
+READY_BACKOFF = (0.01, 0.5)
+
+
+class MiddlewareError(RuntimeError):
+    def __init__(self, status: int, detail):
+        super().__init__(f"{status}: {detail}")
+        self.status = status
+        self.detail = detail
+
+
+def start_middleware() -> subprocess.Popen:
+    """
+    Launch middleware_debug.py without waiting for it; the client waits for
+    readiness before its first call, so startup overlaps with other work.
+    """
+    return subprocess.Popen(
+        [sys.executable, (Path(__file__).parent / "middleware_debug.py").as_posix()],
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+        start_new_session=True,
+    )
+
+
+def session_path(endpoint: str, session_id: Optional[str]) -> str:
+    return f"/sessions/{session_id}{endpoint}" if session_id else endpoint
+
+
+class _BaseClient:
+    def __init__(self, process: Optional[subprocess.Popen], uds: str, ready_timeout: float):
+        self.process = process
+        self.uds = uds or None
+        # A Unix socket needs no real host, but httpx still wants a URL to route by
+        self.base_url = "http://middleware" if self.uds else MIDDLEWARE_URL
+        self.ready_timeout = ready_timeout
+        self.ready = False
+
+    def _check_process(self):
+        if self.process is not None and self.process.poll() is not None:
+            raise RuntimeError(f"Debug middleware exited with code {self.process.returncode}")
+
+    @staticmethod
+    def _result(response: httpx.Response):
+        if response.is_error:
+            try:
+                detail = response.json().get("detail", response.text)
+            except ValueError:
+                detail = response.text
+            raise MiddlewareError(response.status_code, detail)
+        return response.json()
+
+
+class MiddlewareClient(_BaseClient):
+    """
+    Calls to middleware_debug.py over one keep-alive connection pool (or a Unix
+    domain socket when DEBUG_MIDDLEWARE_UDS is set), so a debug command costs a
+    request on an open connection rather than a new TCP handshake. The first
+    call waits for the middleware to answer /health, polling with exponential
+    backoff, and fails early if the middleware process has exited.
+    """
+
+    def __init__(
+        self,
+        process: Optional[subprocess.Popen] = None,
+        uds: str = MIDDLEWARE_UDS,
+        timeout: float = MIDDLEWARE_TIMEOUT,
+        ready_timeout: float = MIDDLEWARE_READY_TIMEOUT,
+    ):
+        super().__init__(process, uds, ready_timeout)
+        self.http = httpx.Client(base_url=self.base_url, transport=httpx.HTTPTransport(uds=self.uds), timeout=timeout)
+
+    def wait_ready(self):
+        delay, max_delay = READY_BACKOFF
+        deadline = time.monotonic() + self.ready_timeout
+        while not self.ready:
+            self._check_process()
+            try:
+                self.ready = self.http.get("/health").status_code == 200
+            except httpx.TransportError:
+                pass
+            if not self.ready:
+                if time.monotonic() + delay > deadline:
+                    raise TimeoutError(f"Debug middleware not ready after {self.ready_timeout:g}s")
+                time.sleep(delay)
+                delay = min(delay * 2, max_delay)
+
+    def request(self, method: str, path: str, **kwargs):
+        self.wait_ready()
+        return self._result(self.http.request(method, path, **kwargs))
+
+    def connect(
+        self, host: str = "localhost", port: int = 5678, pid: Optional[int] = None, exclude: Sequence[str] = ()
+    ):
+        return self.request(
+            "POST", "/connect", json={"host": host, "port": port, "pid": pid, "exclude": list(exclude)}
+        )
+
+    def status(self, session_id: Optional[str] = None):
+        return self.request("GET", f"/sessions/{session_id}" if session_id else "/status")
+
+    def snapshot(self, session_id: Optional[str] = None, **params):
+        return self.request("GET", session_path("/snapshot", session_id), params=params)
+
+    def continue_execution(self, session_id: Optional[str] = None, thread_id: Optional[int] = None):
+        params = {"thread_id": thread_id} if thread_id is not None else None
+        return self.request("POST", session_path("/continue", session_id), params=params)
+
+    def disconnect(self, session_id: str):
+        return self.request("DELETE", f"/sessions/{session_id}")
+
+    def close(self):
+        self.http.close()
+
+
+class AsyncMiddlewareClient(_BaseClient):
+    """
+    MiddlewareClient for asyncio callers, on an httpx.AsyncClient pool; calls
+    from concurrent tasks share the pool and the readiness wait.
+    """
+
+    def __init__(
+        self,
+        process: Optional[subprocess.Popen] = None,
+        uds: str = MIDDLEWARE_UDS,
+        timeout: float = MIDDLEWARE_TIMEOUT,
+        ready_timeout: float = MIDDLEWARE_READY_TIMEOUT,
+    ):
+        super().__init__(process, uds, ready_timeout)
+        self.http = httpx.AsyncClient(
+            base_url=self.base_url, transport=httpx.AsyncHTTPTransport(uds=self.uds), timeout=timeout
+        )
+        self.ready_lock = asyncio.Lock()
+
+    async def wait_ready(self):
+        if self.ready:
+            return
+        async with self.ready_lock:
+            delay, max_delay = READY_BACKOFF
+            deadline = time.monotonic() + self.ready_timeout
+            while not self.ready:
+                self._check_process()
+                try:
+                    self.ready = (await self.http.get("/health")).status_code == 200
+                except httpx.TransportError:
+                    pass
+                if not self.ready:
+                    if time.monotonic() + delay > deadline:
+                        raise TimeoutError(f"Debug middleware not ready after {self.ready_timeout:g}s")
+                    await asyncio.sleep(delay)
+                    delay = min(delay * 2, max_delay)
+
+    async def request(self, method: str, path: str, **kwargs):
+        await self.wait_ready()
+        return self._result(await self.http.request(method, path, **kwargs))
+
+    async def connect(
+        self, host: str = "localhost", port: int = 5678, pid: Optional[int] = None, exclude: Sequence[str] = ()
+    ):
+        return await self.request(
+            "POST", "/connect", json={"host": host, "port": port, "pid": pid, "exclude": list(exclude)}
+        )
+
+    async def status(self, session_id: Optional[str] = None):
+        return await self.request("GET", f"/sessions/{session_id}" if session_id else "/status")
+
+    async def snapshot(self, session_id: Optional[str] = None, **params):
+        return await self.request("GET", session_path("/snapshot", session_id), params=params)
+
+    async def continue_execution(self, session_id: Optional[str] = None, thread_id: Optional[int] = None):
+        params = {"thread_id": thread_id} if thread_id is not None else None
+        return await self.request("POST", session_path("/continue", session_id), params=params)
+
+    async def disconnect(self, session_id: str):
+        return await self.request("DELETE", f"/sessions/{session_id}")
+
+    async def close(self):
+        await self.http.aclose()
@@ -1,21 +1,38 @@
-from fastapi import FastAPI, HTTPException
+import os
+import asyncio
+from fastapi import FastAPI, HTTPException, Query
 from pydantic import BaseModel
-from typing import Optional, AsyncGenerator
+from typing import List, Optional, AsyncGenerator
 from contextlib import asynccontextmanager
-from debugpy.common import messaging, sockets
+from debug_sessions import DebugSession, SessionLimitError, SessionRegistry
+from snapshot import SNAPSHOT_DEPTH, SNAPSHOT_FRAMES, SNAPSHOT_MAX_VALUE_CHARS, SNAPSHOT_MAX_VARIABLES, Snapshot
 
 @asynccontextmanager
 async def lifespan(app: FastAPI) -> AsyncGenerator[None, None]:
+    reaper = asyncio.create_task(registry.run_reaper())
     yield
+    reaper.cancel()
+    await registry.close_all()
 
 app = FastAPI(lifespan=lifespan)
 
-debug_channel = None
+# Every attached debuggee by session id; endpoints without one use the latest /connect
+registry = SessionRegistry()
+
+def get_session(session_id: Optional[str]) -> DebugSession:
+    session = registry.get(session_id)
+    if session is None and session_id:
+        raise HTTPException(status_code=404, detail=f"Unknown debug session {session_id}")
+    if session is None or not session.connected:
+        raise HTTPException(status_code=400, detail="Not connected to debug session")
+    return session
 
 class ConnectRequest(BaseModel):
     port: int = 5678
     host: str = "localhost"
     pid: Optional[int] = None
+    # Files whose frames the debugger leaves out, e.g. the harness that runs the code
+    exclude: List[str] = []
 
 class BreakpointRequest(BaseModel):
     file: str
@@ -35,69 +52,64 @@ class ConnectionStatus(BaseModel):
 
 
 @app.post("/connect", response_model=ConnectionStatus)
+@app.post("/sessions", response_model=ConnectionStatus)
 async def connect(request: ConnectRequest):
     """Connect to a debug session"""
-    global debug_channel
     try:
-        ipv6 = request.host.count(":") > 1
-        sock = sockets.create_client(ipv6)
-        sock.connect((request.host, request.port))
-        stream = messaging.JsonIOStream.from_socket(sock, "debugger")
-        debug_channel = messaging.JsonMessageChannel(stream, handlers={})
-        debug_channel.start()
-        
-        # Initialize the debug session
-        debug_channel.request("initialize", {
-            "clientID": "middleware",
-            "clientName": "Debug Middleware",
-            "adapterID": "python",
-            "pathFormat": "path",
-            "linesStartAt1": True,
-            "columnsStartAt1": True,
-            "supportsVariableType": True,
-            "supportsVariablePaging": True,
-            "supportsRunInTerminalRequest": True,
-            "locale": "en-us"
-        })
-        
-        debug_channel.request("attach", {
-            "name": "Python Attach",
-            "type": "python",
-            "request": "attach",
-            "connect": {
-                "host": request.host,
-                "port": request.port
-            },
-            "pathMappings": [{"localRoot": ".", "remoteRoot": "."}]  # Adjust as needed
-        })
-        
-        debug_channel.request("configurationDone")
-        
-        return ConnectionStatus(
-            status="connected",
-            connected=True,
-            session_id=str(id(debug_channel))
-        )
+        session = await registry.open(request.host, request.port, request.pid, request.exclude)
+    except SessionLimitError as e:
+        raise HTTPException(status_code=503, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=400, detail=f"Failed to connect: {str(e)}")
+    return ConnectionStatus(
+        status="connected",
+        connected=True,
+        session_id=session.id
+    )
+
+@app.get("/health")
+async def health():
+    """Readiness check for clients that just started the middleware"""
+    return {"status": "ok", "sessions": len(registry)}
+
+@app.get("/sessions")
+async def list_sessions():
+    """List debug sessions"""
+    return {
+        "default": registry.default_id,
+        "max_sessions": registry.max_sessions,
+        "sessions": [session.info() for session in registry.sessions.values()],
+    }
+
+@app.delete("/sessions/{session_id}")
+async def disconnect(session_id: str):
+    """Disconnect from a debug session"""
+    if not await registry.close(session_id):
+        raise HTTPException(status_code=404, detail=f"Unknown debug session {session_id}")
+    return {"status": "disconnected", "session_id": session_id}
 
 @app.get("/status", response_model=ConnectionStatus)
-async def get_status():
+@app.get("/sessions/{session_id}", response_model=ConnectionStatus)
+async def get_status(session_id: Optional[str] = None):
     """Get current connection status"""
+    session = registry.get(session_id)
+    if session is None and session_id:
+        raise HTTPException(status_code=404, detail=f"Unknown debug session {session_id}")
+    connected = session is not None and session.connected
     return ConnectionStatus(
-        status="connected" if debug_channel is not None else "disconnected",
-        connected=debug_channel is not None,
-        session_id=str(id(debug_channel)) if debug_channel else None
+        status="connected" if connected else "disconnected",
+        connected=connected,
+        session_id=session.id if connected else None
     )
 
 @app.get("/variables/{frame_id}")
-async def get_variables(frame_id: int):
+@app.get("/sessions/{session_id}/variables/{frame_id}")
+async def get_variables(frame_id: int, session_id: Optional[str] = None):
     """Get variables for a specific frame"""
-    if not debug_channel:
-        raise HTTPException(status_code=400, detail="Not connected to debug session")
+    session = get_session(session_id)
     
     try:
-        response = debug_channel.request('variables', {
+        response = await session.request('variables', {
             'variablesReference': frame_id
         })
         return response
@@ -105,13 +117,13 @@ async def get_variables(frame_id: int):
         raise HTTPException(status_code=500, detail=f"Failed to get variables: {str(e)}")
 
 @app.get("/stacktrace")
-async def get_stacktrace(thread_id: int = 1, start_frame: int = 0, levels: int = 20):
+@app.get("/sessions/{session_id}/stacktrace")
+async def get_stacktrace(thread_id: int = 1, start_frame: int = 0, levels: int = 20, session_id: Optional[str] = None):
     """Get current stack trace"""
-    if not debug_channel:
-        raise HTTPException(status_code=400, detail="Not connected to debug session")
+    session = get_session(session_id)
     
     try:
-        response = debug_channel.request('stackTrace', {
+        response = await session.request('stackTrace', {
             'threadId': thread_id,
             'startFrame': start_frame,
             'levels': levels
@@ -120,11 +132,30 @@ async def get_stacktrace(thread_id: int = 1, start_frame: int = 0, levels: int =
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Failed to get stack trace: {str(e)}")
 
+@app.get("/snapshot")
+@app.get("/sessions/{session_id}/snapshot")
+async def get_snapshot(
+    thread_id: Optional[int] = None,
+    # DAP reads a levels or count of 0 as "all", so 0 must not get through
+    frames: int = Query(SNAPSHOT_FRAMES, ge=1),
+    depth: int = Query(SNAPSHOT_DEPTH, ge=0),
+    max_variables: int = Query(SNAPSHOT_MAX_VARIABLES, ge=1),
+    max_value_chars: int = Query(SNAPSHOT_MAX_VALUE_CHARS, ge=1),
+    session_id: Optional[str] = None,
+):
+    """Get threads, top frames, scopes and variables of the paused program in one call"""
+    session = get_session(session_id)
+    
+    try:
+        return await Snapshot(session, frames, depth, max_variables, max_value_chars).take(thread_id)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Failed to take snapshot: {str(e)}")
+
 @app.post("/breakpoint")
-async def set_breakpoint(request: BreakpointRequest):
+@app.post("/sessions/{session_id}/breakpoint")
+async def set_breakpoint(request: BreakpointRequest, session_id: Optional[str] = None):
     """Set a breakpoint"""
-    if not debug_channel:
-        raise HTTPException(status_code=400, detail="Not connected to debug session")
+    session = get_session(session_id)
     
     try:
         breakpoint_data = {'line': request.line}
@@ -133,37 +164,37 @@ async def set_breakpoint(request: BreakpointRequest):
         if request.hit_condition:
             breakpoint_data['hitCondition'] = request.hit_condition
             
-        response = debug_channel.request('setBreakpoints', {
+        response = await session.request('setBreakpoints', {
             'source': {'path': request.file},
             'breakpoints': [breakpoint_data]
-        })
+        }, exclusive=True)
         return response
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Failed to set breakpoint: {str(e)}")
 
 @app.delete("/breakpoint")
-async def clear_breakpoints(file: str):
+@app.delete("/sessions/{session_id}/breakpoint")
+async def clear_breakpoints(file: str, session_id: Optional[str] = None):
     """Clear all breakpoints in a file"""
-    if not debug_channel:
-        raise HTTPException(status_code=400, detail="Not connected to debug session")
+    session = get_session(session_id)
     
     try:
-        response = debug_channel.request('setBreakpoints', {
+        response = await session.request('setBreakpoints', {
             'source': {'path': file},
             'breakpoints': []
-        })
+        }, exclusive=True)
         return response
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Failed to clear breakpoints: {str(e)}")
 
 @app.post("/evaluate")
-async def evaluate_expression(request: EvaluateRequest):
+@app.post("/sessions/{session_id}/evaluate")
+async def evaluate_expression(request: EvaluateRequest, session_id: Optional[str] = None):
     """Evaluate an expression in the current context"""
-    if not debug_channel:
-        raise HTTPException(status_code=400, detail="Not connected to debug session")
+    session = get_session(session_id)
     
     try:
-        response = debug_channel.request('evaluate', {
+        response = await session.request('evaluate', {
             'expression': request.expression,
             'frameId': request.frame_id,
             'context': request.context
@@ -173,35 +204,38 @@ async def evaluate_expression(request: EvaluateRequest):
         raise HTTPException(status_code=500, detail=f"Failed to evaluate expression: {str(e)}")
 
 @app.get("/threads")
-async def get_threads():
+@app.get("/sessions/{session_id}/threads")
+async def get_threads(session_id: Optional[str] = None):
     """Get all threads in the debug session"""
-    if not debug_channel:
-        raise HTTPException(status_code=400, detail="Not connected to debug session")
+    session = get_session(session_id)
     
     try:
-        response = debug_channel.request('threads')
+        response = await session.request('threads')
         return response
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Failed to get threads: {str(e)}")
 
 @app.post("/continue")
-async def continue_execution(thread_id: Optional[int] = None):
+@app.post("/sessions/{session_id}/continue")
+async def continue_execution(thread_id: Optional[int] = None, session_id: Optional[str] = None):
     """Continue execution"""
+    session = get_session(session_id)
+    
     try:
         args = {}
         if thread_id is not None:
             args['threadId'] = thread_id
             
-        response = debug_channel.request('continue', args)
+        response = await session.request('continue', args, exclusive=True)
         return response
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Failed to continue: {str(e)}")
 
 @app.post("/step")
-async def step(step_type: str = "in", thread_id: Optional[int] = None):
+@app.post("/sessions/{session_id}/step")
+async def step(step_type: str = "in", thread_id: Optional[int] = None, session_id: Optional[str] = None):
     """Step through code (in/over/out)"""
-    if not debug_channel:
-        raise HTTPException(status_code=400, detail="Not connected to debug session")
+    session = get_session(session_id)
     
     if step_type not in ["in", "over", "out"]:
         raise HTTPException(status_code=400, detail="step_type must be 'in', 'over', or 'out'")
@@ -217,23 +251,23 @@ async def step(step_type: str = "in", thread_id: Optional[int] = None):
         if thread_id is not None:
             args['threadId'] = thread_id
             
-        response = debug_channel.request(command_map[step_type], args)
+        response = await session.request(command_map[step_type], args, exclusive=True)
         return response
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Failed to step: {str(e)}")
 
 @app.post("/pause")
-async def pause_execution(thread_id: Optional[int] = None):
+@app.post("/sessions/{session_id}/pause")
+async def pause_execution(thread_id: Optional[int] = None, session_id: Optional[str] = None):
     """Pause execution"""
-    if not debug_channel:
-        raise HTTPException(status_code=400, detail="Not connected to debug session")
+    session = get_session(session_id)
     
     try:
         args = {}
         if thread_id is not None:
             args['threadId'] = thread_id
             
-        response = debug_channel.request('pause', args)
+        response = await session.request('pause', args, exclusive=True)
         return response
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Failed to pause: {str(e)}")
@@ -242,4 +276,9 @@ async def pause_execution(thread_id: Optional[int] = None):
 
 if __name__ == "__main__":
     import uvicorn
-    uvicorn.run(app, host="0.0.0.0", port=8000, workers=1, threads=1)
+    # Same setting as middleware_client.MIDDLEWARE_UDS; a Unix socket skips TCP entirely
+    uds = os.getenv("DEBUG_MIDDLEWARE_UDS", "")
+    if uds:
+        uvicorn.run(app, uds=uds, workers=1)
+    else:
+        uvicorn.run(app, host="0.0.0.0", port=8000, workers=1)
@@ -0,0 +1,148 @@
+import os
+import time
+import asyncio
+from typing import Optional
+
+from debug_sessions import DebugSession
+
+# Stack frames captured per thread, innermost first
+SNAPSHOT_FRAMES = int(os.getenv("DEBUG_SNAPSHOT_FRAMES", 3))
+# Levels of structured variables (objects, lists, dicts) expanded below each scope
+SNAPSHOT_DEPTH = int(os.getenv("DEBUG_SNAPSHOT_DEPTH", 1))
+# Variables fetched per scope or container; the rest are left out
+SNAPSHOT_MAX_VARIABLES = int(os.getenv("DEBUG_SNAPSHOT_MAX_VARIABLES", 50))
+# Longer value reprs are cut to this many characters
+SNAPSHOT_MAX_VALUE_CHARS = int(os.getenv("DEBUG_SNAPSHOT_MAX_VALUE_CHARS", 200))
+# DAP requests a snapshot keeps in flight at once
+SNAPSHOT_CONCURRENCY = int(os.getenv("DEBUG_SNAPSHOT_CONCURRENCY", 32))
+# debugpy's default presentation groups (dunders, methods and class attributes), which
+# are listed as if they were variables; "protected variables" are inline by default
+PRESENTATION_GROUPS = ("special variables", "function variables", "class variables")
+
+
+async def resolved(value=None):
+    return value
+
+
+def truncate(value: str, limit: int) -> str:
+    if len(value) <= limit:
+        return value
+    return value[:limit] + f"... ({len(value)} chars)"
+
+
+class Snapshot:
+    """
+    Threads, their top frames, each frame's scopes and variables, collected in
+    one pass. Requests at each level are issued concurrently (bounded by
+    SNAPSHOT_CONCURRENCY), so the snapshot takes roughly one DAP round trip per
+    level instead of one per object. A failed request is reported in place as
+    an "error" entry instead of failing the whole snapshot.
+    """
+
+    def __init__(
+        self,
+        session: DebugSession,
+        frames: int = SNAPSHOT_FRAMES,
+        depth: int = SNAPSHOT_DEPTH,
+        max_variables: int = SNAPSHOT_MAX_VARIABLES,
+        max_value_chars: int = SNAPSHOT_MAX_VALUE_CHARS,
+    ):
+        self.session = session
+        self.frames = frames
+        self.depth = depth
+        self.max_variables = max_variables
+        self.max_value_chars = max_value_chars
+        self.semaphore = asyncio.Semaphore(SNAPSHOT_CONCURRENCY)
+        self.requests = 0
+
+    async def request(self, command: str, arguments: Optional[dict] = None) -> dict:
+        async with self.semaphore:
+            self.requests += 1
+            return await self.session.request(command, arguments)
+
+    async def variables(self, reference: int, depth: int) -> dict:
+        # One more than can be shown (besides the groups) tells a full scope from a cut-off one
+        count = self.max_variables + len(PRESENTATION_GROUPS) + 1
+        try:
+            body = await self.request("variables", {
+                "variablesReference": reference,
+                "start": 0,
+                "count": count,
+            })
+        except Exception as e:
+            return {"error": str(e)}
+        received = body.get("variables", [])
+        listed = [variable for variable in received if variable.get("name") not in PRESENTATION_GROUPS]
+        truncated = len(listed) > self.max_variables or len(received) >= count
+        listed = listed[: self.max_variables]
+        children = await asyncio.gather(*[
+            self.variables(variable["variablesReference"], depth - 1)
+            if depth > 0 and variable.get("variablesReference")
+            else resolved()
+            for variable in listed
+        ])
+        result = {}
+        for variable, nested in zip(listed, children):
+            entry = {"value": truncate(variable.get("value", ""), self.max_value_chars)}
+            if variable.get("type"):
+                entry["type"] = variable["type"]
+            if nested:
+                entry["vars"] = nested
+            elif variable.get("variablesReference"):
+                # Structured value that was not expanded
+                entry["ref"] = variable["variablesReference"]
+            result[variable["name"]] = entry
+        if truncated:
+            result["..."] = {"value": f"only the first {len(listed)} variables are shown"}
+        return result
+
+    async def scopes(self, frame_id: int) -> dict:
+        try:
+            body = await self.request("scopes", {"frameId": frame_id})
+        except Exception as e:
+            return {"error": str(e)}
+        # Expensive scopes (large globals) are listed but not fetched
+        listed = body.get("scopes", [])
+        contents = await asyncio.gather(*[
+            resolved({"expensive": True, "ref": scope["variablesReference"]})
+            if scope.get("expensive")
+            else self.variables(scope["variablesReference"], self.depth)
+            for scope in listed
+        ])
+        return {scope["name"]: content for scope, content in zip(listed, contents)}
+
+    async def frame(self, frame: dict) -> dict:
+        source = frame.get("source") or {}
+        return {
+            "id": frame["id"],
+            "name": frame.get("name"),
+            "file": source.get("path") or source.get("name"),
+            "line": frame.get("line"),
+            "scopes": await self.scopes(frame["id"]),
+        }
+
+    async def thread(self, thread: dict) -> dict:
+        result = {"id": thread["id"], "name": thread.get("name")}
+        try:
+            body = await self.request("stackTrace", {
+                "threadId": thread["id"],
+                "startFrame": 0,
+                "levels": self.frames,
+            })
+        except Exception as e:
+            # Typically a thread that is running rather than paused
+            result["error"] = str(e)
+            return result
+        result["frames"] = await asyncio.gather(*[self.frame(frame) for frame in body.get("stackFrames", [])])
+        return result
+
+    async def take(self, thread_id: Optional[int] = None) -> dict:
+        started = time.perf_counter()
+        threads = (await self.request("threads")).get("threads", [])
+        if thread_id is not None:
+            threads = [thread for thread in threads if thread["id"] == thread_id]
+        return {
+            "threads": await asyncio.gather(*[self.thread(thread) for thread in threads]),
+            "dap_requests": self.requests,
+            "ms": round((time.perf_counter() - started) * 1000, 1),
+        }
@@ -1,17 +1,28 @@
 import os
+import sys
+from pathlib import Path
 from openai import OpenAI
 
+sys.path.insert(0, Path(__file__).resolve().parent.parent.as_posix())
+from common.completion_cache import cached_client
+from common.metrics import METRICS_SUMMARY, LatencyMetrics
+
 openai_api_key = os.getenv("OPENAI_API_KEY", "")
 openai_api_base = "http://127.0.0.1:30000/v1"
 
-client = OpenAI(
+# COMPLETION_CACHE=on|record|replay serves repeated requests from a local cache
+client = cached_client(OpenAI(
     api_key=openai_api_key,
     base_url=openai_api_base,
-)
+))
 
 source_sentence = "The camera floats gently through rows of pastel-painted wooden beehives, buzzing honeybees gliding in and out of frame. The motion settles on the refined farmer standing at the center, his pristine white beekeeping suit gleaming in the golden afternoon light. He lifts a jar of honey, tilting it slightly to catch the light. Behind him, tall sunflowers sway rhythmically in the breeze, their petals glowing in the warm sunlight. The camera tilts upward to reveal a retro farmhouse with mint-green shutters, its walls dappled with shadows from swaying trees. Shot with a 35mm lens on Kodak Portra 400 film, the golden light creates rich textures on the farmer’s gloves, marmalade jar, and weathered wood of the beehives."
 prompt_template = "Can you translate form English to Chinese (simplified) the following prompt: {}  /think"
 
+# Request latency and tokens/s, printed after the response and exported like the agent loops
+metrics = LatencyMetrics("simple_reasoning")
+turn = metrics.start_turn()
+turn.request()
 chat_response = client.chat.completions.create(
     model="Qwen/Qwen3-30B-A3B-250425",
     messages=[
@@ -25,9 +36,16 @@ chat_response = client.chat.completions.create(
         "separate_reasoning": True
     }, 
 )
+turn.chunk()
+if chat_response.usage is not None:
+    turn.tokens = chat_response.usage.completion_tokens
+summary = metrics.finish(turn)
 
 print("==== Reasoning ====")
 print(chat_response.choices[0].message.reasoning_content)
 
 print("==== Text ====")
-print(chat_response.choices[0].message.content)
\ No newline at end of file
+print(chat_response.choices[0].message.content)
+
+if METRICS_SUMMARY:
+    print(f"==== Metrics ====\n{summary}")
\ No newline at end of file
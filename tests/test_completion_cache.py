@@ -0,0 +1,115 @@
+import sys
+import asyncio
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, Path(__file__).resolve().parent.parent.as_posix())
+from common.completion_cache import (
+    AsyncRecordingStream,
+    AsyncReplayStream,
+    CompletionStore,
+    RecordingStream,
+    ReplayStream,
+    cached_client,
+)
+
+openai = pytest.importorskip("openai")
+from openai.types.chat import ChatCompletion, ChatCompletionChunk
+
+REQUEST = {"model": "test-model", "messages": [{"role": "user", "content": "Hi"}]}
+
+
+def completion():
+    return ChatCompletion.model_validate({
+        "id": "c1", "object": "chat.completion", "created": 0, "model": "test-model",
+        "choices": [{
+            "index": 0, "finish_reason": "stop", "message": {"role": "assistant", "content": "Hello"},
+        }],
+    })
+
+
+def chunks():
+    return [
+        ChatCompletionChunk.model_validate({
+            "id": "c1", "object": "chat.completion.chunk", "created": 0, "model": "test-model",
+            "choices": [{"index": 0, "finish_reason": None, "delta": {"content": text}}],
+        })
+        for text in ("Hel", "lo")
+    ]
+
+
+class FakeStream:
+    def __init__(self, items):
+        self.items = items
+
+    def __iter__(self):
+        return iter(self.items)
+
+    async def __aiter__(self):
+        for item in self.items:
+            yield item
+
+    def close(self):
+        pass
+
+
+def make_client(client_type, monkeypatch):
+    """
+    A real OpenAI/AsyncOpenAI client whose HTTP layer is replaced, so create()
+    keeps the SDK's own (synchronous) decorator around it.
+    """
+    client = client_type(api_key="test")
+    calls = []
+
+    def response(kwargs):
+        calls.append(kwargs)
+        return FakeStream(chunks()) if kwargs.get("stream") else completion()
+
+    if client_type is openai.AsyncOpenAI:
+        async def post(*args, **kwargs):
+            return response(kwargs)
+    else:
+        def post(*args, **kwargs):
+            return response(kwargs)
+    monkeypatch.setattr(client.chat.completions, "_post", post)
+    return client, calls
+
+
+def test_sync_client(tmp_path, monkeypatch):
+    client, calls = make_client(openai.OpenAI, monkeypatch)
+    cached = cached_client(client, "on", CompletionStore(tmp_path))
+    assert not cached.chat.completions.is_async
+
+    first = cached.chat.completions.create(**REQUEST)
+    second = cached.chat.completions.create(**REQUEST)
+    assert first.choices[0].message.content == second.choices[0].message.content == "Hello"
+
+    stream = cached.chat.completions.create(stream=True, **REQUEST)
+    assert isinstance(stream, RecordingStream)
+    assert "".join(chunk.choices[0].delta.content for chunk in stream) == "Hello"
+    replay = cached.chat.completions.create(stream=True, **REQUEST)
+    assert isinstance(replay, ReplayStream)
+    assert "".join(chunk.choices[0].delta.content for chunk in replay) == "Hello"
+    assert len(calls) == 2
+
+
+def test_async_client(tmp_path, monkeypatch):
+    client, calls = make_client(openai.AsyncOpenAI, monkeypatch)
+    cached = cached_client(client, "on", CompletionStore(tmp_path))
+    assert cached.chat.completions.is_async
+
+    async def run():
+        first = await cached.chat.completions.create(**REQUEST)
+        second = await cached.chat.completions.create(**REQUEST)
+        assert first.choices[0].message.content == second.choices[0].message.content == "Hello"
+
+        stream = await cached.chat.completions.create(stream=True, **REQUEST)
+        assert isinstance(stream, AsyncRecordingStream)
+        assert "".join([chunk.choices[0].delta.content async for chunk in stream]) == "Hello"
+        replay = await cached.chat.completions.create(stream=True, **REQUEST)
+        assert isinstance(replay, AsyncReplayStream)
+        assert "".join([chunk.choices[0].delta.content async for chunk in replay]) == "Hello"
+
+    asyncio.run(run())
+    assert len(calls) == 2
@@ -0,0 +1,59 @@
+import sys
+from pathlib import Path
+
+import pytest
+
+for module in ("fastapi", "uvicorn", "httpx"):
+    pytest.importorskip(module)
+
+sys.path.insert(0, (Path(__file__).resolve().parent.parent / "debugger").as_posix())
+from middleware_client import MiddlewareClient, start_middleware
+
+
+def check_started(monkeypatch, uds=""):
+    monkeypatch.setenv("DEBUG_MIDDLEWARE_UDS", uds)
+    process = start_middleware()
+    client = MiddlewareClient(process, uds=uds)
+    try:
+        client.wait_ready()
+        assert client.status() == {"status": "disconnected", "connected": False, "session_id": None}
+    finally:
+        client.close()
+        process.terminate()
+        process.wait()
+
+
+def test_tcp(monkeypatch):
+    check_started(monkeypatch)
+
+
+def test_unix_socket(monkeypatch, tmp_path):
+    check_started(monkeypatch, (tmp_path / "middleware.sock").as_posix())
+
+
+def test_debugged_run(monkeypatch, tmp_path):
+    pytest.importorskip("debugpy")
+    from debuggee_worker import DebuggeePool
+
+    uds = (tmp_path / "middleware.sock").as_posix()
+    monkeypatch.setenv("DEBUG_MIDDLEWARE_UDS", uds)
+    process = start_middleware()
+    client = MiddlewareClient(process, uds=uds)
+    pool = DebuggeePool(size=1)
+    try:
+        debuggee = pool.acquire()
+        debuggee.send("x = 41\nprint(x + 1)\n")
+        session_id = client.connect(debuggee.host, debuggee.port, debuggee.pid, debuggee.harness_paths)["session_id"]
+        snapshot = client.snapshot(session_id)
+        # Paused before the first statement, with the harness frame left out
+        frames = snapshot["threads"][0]["frames"]
+        assert [(frame["name"], frame["line"]) for frame in frames] == [("<module>", 1)]
+        assert "x" not in frames[0]["scopes"]["Locals"]
+        client.continue_execution(session_id)
+        client.disconnect(session_id)
+        assert debuggee.finish(timeout=30) == (b"42\n", b"", False)
+    finally:
+        pool.close()
+        client.close()
+        process.terminate()
+        process.wait()